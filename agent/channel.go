@@ -0,0 +1,125 @@
+package main
+
+import (
+	"fmt"
+	"log"
+	"net/url"
+	"strings"
+	"sync"
+	"time"
+
+	"golang.org/x/net/websocket"
+)
+
+const (
+	heartbeatInterval    = 10 * time.Second
+	channelRetryInterval = time.Minute
+)
+
+// ChannelMessage is a message received from the server over the agent channel
+type ChannelMessage struct {
+	Type   string `json:"type"`
+	Task   *Task  `json:"task,omitempty"`
+	TaskID string `json:"task_id,omitempty"`
+	Status string `json:"status,omitempty"`
+	Error  string `json:"error,omitempty"`
+}
+
+type channelHeartbeat struct {
+	Type   string `json:"type"`
+	Status string `json:"status"`
+}
+
+type channelResult struct {
+	Type string `json:"type"`
+	Result
+}
+
+func agentChannelURL(centralServerURL, agentID string) string {
+	wsURL := centralServerURL
+	if strings.HasPrefix(wsURL, "https://") {
+		wsURL = "wss://" + strings.TrimPrefix(wsURL, "https://")
+	} else {
+		wsURL = "ws://" + strings.TrimPrefix(wsURL, "http://")
+	}
+	return fmt.Sprintf("%s/ws/agent?agent_id=%s", wsURL, url.QueryEscape(agentID))
+}
+
+// runAgentChannel keeps one WebSocket open to the server. Tasks are pushed as soon as they are
+// approved, and results and heartbeats go back over the same connection. It returns when the
+// connection cannot be opened or is lost.
+func runAgentChannel(centralServerURL, agentID, pat string) error {
+	config, err := websocket.NewConfig(agentChannelURL(centralServerURL, agentID), centralServerURL)
+	if err != nil {
+		return err
+	}
+	config.Header.Set("Authorization", "Bearer "+pat)
+
+	ws, err := websocket.DialConfig(config)
+	if err != nil {
+		return err
+	}
+	defer ws.Close()
+	log.Println("Agent channel connected")
+
+	var sendMu sync.Mutex
+	send := func(message interface{}) error {
+		sendMu.Lock()
+		defer sendMu.Unlock()
+		return websocket.JSON.Send(ws, message)
+	}
+
+	done := make(chan struct{})
+	defer close(done)
+	go func() {
+		ticker := time.NewTicker(heartbeatInterval)
+		defer ticker.Stop()
+		for {
+			if err := send(channelHeartbeat{Type: "heartbeat", Status: "idle"}); err != nil {
+				return
+			}
+			select {
+			case <-done:
+				return
+			case <-ticker.C:
+			}
+		}
+	}()
+
+	for {
+		var message ChannelMessage
+		if err := websocket.JSON.Receive(ws, &message); err != nil {
+			return err
+		}
+
+		switch message.Type {
+		case "task":
+			if message.Task == nil {
+				continue
+			}
+			task := message.Task
+			log.Printf("Received task with ID %s. Executing script...\n", task.TaskID)
+			output, error := executeScript(task.ScriptCode)
+			result := Result{
+				TaskID:  task.TaskID,
+				Input:   task.Input,
+				Command: task.Command,
+				Output:  output,
+				Error:   error,
+			}
+			if err := send(channelResult{Type: "result", Result: result}); err != nil {
+				// Don't lose the result with the connection
+				reportResult(centralServerURL, pat, result)
+				return err
+			}
+		case "result_ack":
+			if message.Status == "ok" {
+				log.Println("Result reported successfully")
+			} else {
+				log.Printf("Failed to report result for task %s: %s\n", message.TaskID, message.Status)
+			}
+		case "error":
+			log.Printf("Agent channel error: %s\n", message.Error)
+		}
+	}
+}
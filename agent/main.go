@@ -2,6 +2,7 @@ package main
 
 import (
 	"bytes"
+	"compress/gzip"
 	"encoding/json"
 	"fmt"
 	"log"
@@ -10,7 +11,9 @@ import (
 	"os"
 	"os/exec"
 	"runtime"
+	"strconv"
 	"strings"
+	"sync"
 	"time"
 
 	"github.com/NerdyNot/NerdyOps.git/agent/logo"
@@ -44,6 +47,18 @@ type Result struct {
 }
 
 var configFile = "agent_config.json"
+
+// Seconds the server holds a /lease-tasks request open while waiting for a task
+const taskPollTimeoutSeconds = 25
+
+// Most tasks leased, and executed in parallel, per request
+const taskLeaseBatchSize = 4
+
+type LeasedTasks struct {
+	Tasks        []Task `json:"tasks"`
+	LeaseSeconds int    `json:"lease_seconds"`
+}
+
 var client = resty.New()
 var startTime time.Time
 
@@ -200,37 +215,65 @@ func reconnectOrExit(centralServerURL string) string {
 	}
 }
 
-func fetchTask(centralServerURL, agentID, pat string) *Task {
+// fetchTasks long-polls the server for up to taskLeaseBatchSize tasks, leased to this agent
+// until it reports their results. polled is true when the server held the request for the full
+// wait, so the caller can poll again right away.
+func fetchTasks(centralServerURL, agentID, pat string) (tasks []Task, polled bool) {
 	resp, err := client.R().
 		SetHeader("Authorization", "Bearer "+pat).
 		SetQueryParam("agent_id", agentID).
-		Get(fmt.Sprintf("%s/get-task", centralServerURL))
+		SetQueryParam("timeout", strconv.Itoa(taskPollTimeoutSeconds)).
+		SetQueryParam("max_tasks", strconv.Itoa(taskLeaseBatchSize)).
+		Get(fmt.Sprintf("%s/lease-tasks", centralServerURL))
 
 	if err != nil {
-		log.Printf("Error fetching task: %v", err)
-		return nil
+		log.Printf("Error fetching tasks: %v", err)
+		return nil, false
 	}
 
 	if resp.StatusCode() == http.StatusOK {
-		var task Task
-		err := json.Unmarshal(resp.Body(), &task)
+		var leased LeasedTasks
+		err := json.Unmarshal(resp.Body(), &leased)
 		if err != nil {
-			log.Printf("Error parsing task: %v", err)
-			return nil
+			log.Printf("Error parsing tasks: %v", err)
+			return nil, false
 		}
-		log.Printf("Fetched task for agent ID %s: %v\n", agentID, task)
-		return &task
+		log.Printf("Leased %d task(s) for agent ID %s for %d seconds\n", len(leased.Tasks), agentID, leased.LeaseSeconds)
+		return leased.Tasks, true
+	}
+
+	if resp.StatusCode() == http.StatusNoContent {
+		return nil, true
 	}
 
 	log.Printf("No task found for agent ID %s\n", agentID)
-	return nil
+	return nil, false
 }
 
+// Reports larger than this are sent gzip-encoded
+const resultGzipThreshold = 8 * 1024
+
 func reportResult(centralServerURL, pat string, result Result) {
-	resp, err := client.R().
+	body, err := json.Marshal(result)
+	if err != nil {
+		log.Printf("Failed to encode result: %v", err)
+		return
+	}
+
+	request := client.R().
 		SetHeader("Content-Type", "application/json").
-		SetHeader("Authorization", "Bearer "+pat).
-		SetBody(result).
+		SetHeader("Authorization", "Bearer "+pat)
+	if len(body) > resultGzipThreshold {
+		var compressed bytes.Buffer
+		writer := gzip.NewWriter(&compressed)
+		writer.Write(body)
+		writer.Close()
+		body = compressed.Bytes()
+		request.SetHeader("Content-Encoding", "gzip")
+	}
+
+	resp, err := request.
+		SetBody(body).
 		Post(fmt.Sprintf("%s/report-result", centralServerURL))
 
 	if err != nil {
@@ -288,6 +331,40 @@ func executeScript(scriptCode string) (string, string) {
 	return out.String(), stderr.String()
 }
 
+// pollTasks fetches and executes tasks over HTTP for the given duration
+func pollTasks(centralServerURL, agentID, pat string, duration time.Duration) {
+	deadline := time.Now().Add(duration)
+	for time.Now().Before(deadline) {
+		tasks, polled := fetchTasks(centralServerURL, agentID, pat)
+		if len(tasks) > 0 {
+			var wg sync.WaitGroup
+			for _, task := range tasks {
+				wg.Add(1)
+				go func(task Task) {
+					defer wg.Done()
+					log.Printf("Received task with ID %s. Executing script...\n", task.TaskID)
+					output, error := executeScript(task.ScriptCode)
+					result := Result{
+						TaskID:  task.TaskID,
+						Input:   task.Input,
+						Command: task.Command,
+						Output:  output,
+						Error:   error,
+					}
+					reportResult(centralServerURL, pat, result)
+				}(task)
+			}
+			wg.Wait()
+			reportStatus(centralServerURL, agentID, "idle", pat)
+		} else {
+			reportStatus(centralServerURL, agentID, "idle", pat)
+			if !polled {
+				time.Sleep(10 * time.Second)
+			}
+		}
+	}
+}
+
 func main() {
 	// Initial setup and configuration
 	initialSetup()
@@ -313,24 +390,10 @@ func main() {
 	go monitoring.ReportResourceUsage(centralServerURL, agentID, startTime) // Run resource usage reporting asynchronously
 	go monitoring.MonitorAgent(centralServerURL, agentID, pat)              // Run agent monitoring based on settings
 
-	// Main loop to fetch and execute tasks
+	// Main loop: keep the agent channel open, polling over HTTP while it is unavailable
 	for {
-		task := fetchTask(centralServerURL, agentID, pat)
-		if task != nil {
-			log.Printf("Received task with ID %s. Executing script...\n", task.TaskID)
-			output, error := executeScript(task.ScriptCode)
-			result := Result{
-				TaskID:  task.TaskID,
-				Input:   task.Input,
-				Command: task.Command,
-				Output:  output,
-				Error:   error,
-			}
-			reportResult(centralServerURL, pat, result)
-			reportStatus(centralServerURL, agentID, "idle", pat)
-		} else {
-			reportStatus(centralServerURL, agentID, "idle", pat)
-			time.Sleep(10 * time.Second)
-		}
+		err := runAgentChannel(centralServerURL, agentID, pat)
+		log.Printf("Agent channel unavailable: %v. Polling for tasks instead.\n", err)
+		pollTasks(centralServerURL, agentID, pat, channelRetryInterval)
 	}
 }
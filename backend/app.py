@@ -1,7 +1,8 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sock import Sock
-from utils.db import init_db
+from utils.db import init_db, get_db_pool_status
+from utils.migrations import check_schema_version
 from utils.logo import print_logo
 import logging
 import os
@@ -16,26 +17,30 @@ def create_app():
     sock.init_app(app)
     return app
 
-db_initialized = False
+schema_checked = False
 
 if not os.path.exists('downloads'):
     os.makedirs('downloads')
 
+# Migrations run once at deploy time (python manage.py migrate); workers only verify the version
 @app.before_request
-def initialize_database():
-    global db_initialized
-    if not db_initialized:
+def verify_database_schema():
+    global schema_checked
+    if not schema_checked:
         try:
-            init_db()
-            db_initialized = True
-            logging.info("Database initialized successfully.")
+            check_schema_version()
+            schema_checked = True
         except Exception as e:
-            logging.error(f"Error initializing database: {e}")
+            logging.error(f"Error checking database schema version: {e}")
 
 @app.route('/health', methods=['GET'])
 def ping():
     return jsonify({"status": "ok"}), 200
 
+@app.route('/db-pool-stats', methods=['GET'])
+def db_pool_stats():
+    return jsonify(get_db_pool_status()), 200
+
 # Blueprint registrations and other setup
 def register_blueprints(app):
     from endpoints.auth import auth_bp
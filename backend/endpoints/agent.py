@@ -1,17 +1,36 @@
 import os
-from flask import Blueprint, request, jsonify, send_from_directory
+import json
+import uuid
+import threading
+from urllib.parse import quote
+from flask import Blueprint, Response, request, jsonify, send_file
+from werkzeug.security import safe_join
+from simple_websocket import ConnectionClosed
+from app import sock
 from utils.db import get_db_connection, DB_TYPE
+from utils.db_writer import execute_write
+from utils.agent_cache import get_agent, invalidate_agent
+from utils.agent_heartbeat import record_heartbeat, forget_agent, get_live_statuses
+from utils.agent_downloads import AGENT_DOWNLOAD_ACCEL_PATH, file_checksum, start_checksum_precompute
+from utils.agent_registry import query_agent_registry, set_agent_tags, delete_agent_tags, parse_tags, MAX_AGENT_LIMIT
 from utils.redis_connection import get_redis_connection
-from datetime import datetime, timedelta
+from utils.task_store import agent_index_key, pending_index_key, task_queue_key, TASK_PRIORITIES
+from utils.task_transitions import dequeue_task, complete_task, dispatched_task_payload
+from utils.task_notify import add_waiter, remove_waiter
+from utils.agent_channel import AGENT_CONNECTION_TTL, register_connection, unregister_connection, get_connections
+from datetime import datetime
 import logging
 
 agent_bp = Blueprint('agent', __name__)
 logging.basicConfig(level=logging.INFO)
 
+redis = get_redis_connection()
+
 # Config download build binaries path
 DOWNLOAD_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), '../downloads'))
 if not os.path.exists(DOWNLOAD_FOLDER):
     os.makedirs(DOWNLOAD_FOLDER)
+start_checksum_precompute(DOWNLOAD_FOLDER)
 
 # Set extension for windows and others
 def get_mimetype(filename):
@@ -36,8 +55,6 @@ def register_agent():
         return jsonify({"error": "Invalid agent ID or OS type"}), 400
     
     # Save agent information in the database
-    conn = get_db_connection()
-    cursor = conn.cursor()
     if DB_TYPE == 'mysql':
         query = '''
         INSERT INTO agents (agent_id, os_type, status, computer_name, private_ip, shell_version, last_update_date)
@@ -51,10 +68,13 @@ def register_agent():
         INSERT OR REPLACE INTO agents (agent_id, os_type, status, computer_name, private_ip, shell_version, last_update_date)
         VALUES (?, ?, 'active', ?, ?, ?, CURRENT_TIMESTAMP)
         '''
-    cursor.execute(query, (agent_id, os_type, computer_name, private_ip, shell_version))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    execute_write(query, (agent_id, os_type, computer_name or '', private_ip or '', shell_version))
+    invalidate_agent(agent_id)
+    record_heartbeat(redis, agent_id, 'active')
+
+    # Tags are only replaced when the agent sends them
+    if 'tags' in data:
+        set_agent_tags(agent_id, parse_tags(data.get('tags')))
     
     return jsonify({"status": "Agent registered", "agent_id": agent_id, "os_type": os_type})
 
@@ -68,17 +88,104 @@ def agent_status():
     if not agent_id or not status:
         return jsonify({"error": "No agent_id or status provided"}), 400
     
-    # Update the agent's status in the database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    query = 'UPDATE agents SET status = %s, last_update_date = CURRENT_TIMESTAMP WHERE agent_id = %s' if DB_TYPE == 'mysql' else 'UPDATE agents SET status = ?, last_update_date = CURRENT_TIMESTAMP WHERE agent_id = ?'
-    cursor.execute(query, (status, agent_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    update_agent_status(redis, agent_id, status)
     
     return jsonify({"status": "Status updated", "agent_id": agent_id})
 
+# Heartbeats go to Redis only; the scheduler flushes them to the agents table in batches
+def update_agent_status(redis, agent_id, status):
+    record_heartbeat(redis, agent_id, status)
+
+# Persistent agent channel: tasks are pushed to the agent as soon as they are approved, and
+# results and heartbeats come back on the same socket. One task is in flight at a time, so
+# tasks still queued stay in Redis if the connection drops. Served by the gevent worker.
+@sock.route('/ws/agent')
+def agent_channel_socket(ws):
+    agent_id = request.args.get('agent_id')
+    if not agent_id:
+        ws.send(json.dumps({"type": "error", "error": "Agent ID is required"}))
+        return
+    AgentChannel(ws, agent_id).run()
+
+class AgentChannel:
+    def __init__(self, ws, agent_id):
+        self.ws = ws
+        self.agent_id = agent_id
+        # The process-wide client: a pool per socket would hold two connections per agent
+        self.redis = redis
+        self.connection_id = str(uuid.uuid4())
+        self.connected_at = datetime.now().isoformat()
+        self.send_lock = threading.Lock()
+        self.in_flight = None
+        self.closed = False
+        self.wakeup = None
+
+    def send(self, message):
+        with self.send_lock:
+            self.ws.send(json.dumps(message))
+
+    def run(self):
+        logging.info(f"Agent channel opened for {self.agent_id}")
+        self.wakeup = add_waiter(self.agent_id)
+        register_connection(self.redis, self.agent_id, self.connection_id, self.connected_at)
+        sender_thread = threading.Thread(target=self.deliver_tasks, name=f'agent-channel-{self.agent_id}')
+        sender_thread.daemon = True
+        sender_thread.start()
+        try:
+            while True:
+                # An agent that stops sending heartbeats is treated as gone
+                data = self.ws.receive(timeout=AGENT_CONNECTION_TTL)
+                if data is None:
+                    break
+                self.handle_message(json.loads(data))
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            logging.error(f"Agent channel error for {self.agent_id}: {e}")
+        finally:
+            self.closed = True
+            self.wakeup.set()
+            remove_waiter(self.agent_id, self.wakeup)
+            unregister_connection(self.redis, self.agent_id, self.connection_id)
+            logging.info(f"Agent channel closed for {self.agent_id}")
+
+    def deliver_tasks(self):
+        while not self.closed:
+            try:
+                if self.in_flight is None:
+                    # Clear before dequeueing so an approval in between still wakes us
+                    self.wakeup.clear()
+                    task_data, result = dequeue_task(self.redis, self.agent_id, datetime.now().isoformat())
+                    if task_data:
+                        self.in_flight = task_data['task_id']
+                        self.send({"type": "task", "task": dispatched_task_payload(task_data, result)})
+                        continue
+                self.wakeup.wait(AGENT_CONNECTION_TTL)
+            except Exception as e:
+                logging.error(f"Failed to deliver task to {self.agent_id}: {e}")
+                self.wakeup.wait(5)
+
+    def handle_message(self, message):
+        message_type = message.get('type')
+        if message_type == 'heartbeat':
+            update_agent_status(self.redis, self.agent_id, message.get('status', 'active'))
+            register_connection(self.redis, self.agent_id, self.connection_id, self.connected_at)
+        elif message_type == 'result':
+            task_id = message.get('task_id')
+            result = {
+                "input": message.get('input') or "",
+                "command": message.get('command') or "",
+                "output": message.get('output') or "",
+                "error": message.get('error') or ""
+            }
+            outcome, _ = complete_task(self.redis, task_id, datetime.now().isoformat(), result)
+            if task_id == self.in_flight:
+                self.in_flight = None
+                self.wakeup.set()
+            self.send({"type": "result_ack", "task_id": task_id, "status": outcome})
+        else:
+            self.send({"type": "error", "error": f"Unknown message type: {message_type}"})
+
 @agent_bp.route('/get-agents', methods=['GET'])
 def get_agents():
     conn = get_db_connection()
@@ -89,26 +196,61 @@ def get_agents():
     conn.close()
     
     agent_list = [dict(agent) for agent in agents]
+    agent_ids = [agent['agent_id'] for agent in agent_list]
+    connections = get_connections(redis, agent_ids)
+    # Statuses reported since the last heartbeat flush
+    statuses = get_live_statuses(redis, agent_ids)
+    for agent in agent_list:
+        agent['connected'] = connections.get(agent['agent_id']) is not None
+        agent['status'] = statuses.get(agent['agent_id'], agent['status'])
     return jsonify(agent_list)
 
-def check_agent_status():
-    logging.info("Checking agent statuses...")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT agent_id, last_update_date, status FROM agents')
-    agents = cursor.fetchall()
-    
+# Server-side filtered, sorted and cursor-paginated view of the agent registry. Filters:
+# os_type, status, name and ip (prefixes of computer_name and private_ip) and tags (comma
+# separated, all required). Status filters on the last heartbeat flush; the returned status is
+# the latest reported one.
+@agent_bp.route('/query-agents', methods=['GET'])
+def query_agents_endpoint():
+    try:
+        limit = min(int(request.args.get('limit', 50)), MAX_AGENT_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        agents, next_cursor = query_agent_registry(
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            sort=request.args.get('sort', 'agent_id'),
+            order=request.args.get('order', 'asc'),
+            os_type=request.args.get('os_type'),
+            status=request.args.get('status'),
+            name=request.args.get('name'),
+            ip=request.args.get('ip'),
+            tags=parse_tags(request.args.get('tags'))
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    agent_ids = [agent['agent_id'] for agent in agents]
+    connections = get_connections(redis, agent_ids)
+    statuses = get_live_statuses(redis, agent_ids)
     for agent in agents:
-        last_update_date = datetime.fromisoformat(agent['last_update_date'])
-        time_diff = datetime.utcnow() - last_update_date
-        if time_diff > timedelta(minutes=1) and agent['status'] != 'down':
-            query = 'UPDATE agents SET status = %s WHERE agent_id = %s' if DB_TYPE == 'mysql' else 'UPDATE agents SET status = ? WHERE agent_id = ?'
-            cursor.execute(query, ('down', agent['agent_id']))
-            logging.info(f"Agent {agent['agent_id']} marked as down")
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+        agent['connected'] = connections.get(agent['agent_id']) is not None
+        agent['status'] = statuses.get(agent['agent_id'], agent['status'])
+    return jsonify({"agents": agents, "next_cursor": next_cursor})
+
+@agent_bp.route('/set-agent-tags', methods=['POST'])
+def set_agent_tags_endpoint():
+    data = request.get_json()
+    agent_id = data.get('agent_id')
+    tags = data.get('tags')
+
+    if not agent_id or not isinstance(tags, list):
+        return jsonify({"error": "Agent ID and a tags list are required"}), 400
+    if not get_agent(agent_id):
+        return jsonify({"error": "Agent not found"}), 404
+
+    tags = parse_tags(tags)
+    set_agent_tags(agent_id, tags)
+    return jsonify({"status": "Tags updated", "agent_id": agent_id, "tags": tags})
 
 # Endpoint to delete an agent
 @agent_bp.route('/delete-agent', methods=['POST'])
@@ -123,19 +265,16 @@ def delete_agent():
         return jsonify({"error": "Agent ID is required"}), 400
     
     # Delete agent information from the database
-    conn = get_db_connection()
-    cursor = conn.cursor()
     query = 'DELETE FROM agents WHERE agent_id = %s' if DB_TYPE == 'mysql' else 'DELETE FROM agents WHERE agent_id = ?'
-    cursor.execute(query, (agent_id,))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    execute_write(query, (agent_id,))
+    delete_agent_tags(agent_id)
+    invalidate_agent(agent_id)
     
-    # Delete agent tasks from Redis
-    task_queue_key = f'task_queue:{agent_id}'
+    # Delete agent tasks and heartbeat from Redis
+    task_queue_keys = [task_queue_key(agent_id, priority) for priority in TASK_PRIORITIES]
     agent_tasks_key = f'agent_tasks:{agent_id}'
-    redis.delete(task_queue_key)
-    redis.delete(agent_tasks_key)
+    redis.delete(*task_queue_keys, agent_tasks_key, agent_index_key(agent_id), pending_index_key(agent_id))
+    forget_agent(redis, agent_id)
     
     return jsonify({"status": "Agent deleted", "agent_id": agent_id})
 
@@ -153,28 +292,25 @@ def install_agent():
     else:
         filename += '.tar.gz'
     
-    try:
-        file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-        logging.info(f"Attempting to send file from: {file_path}")
-        
-        # Set the correct mimetype based on the file extension
-        mimetype = get_mimetype(filename)
-        
-        return send_from_directory(DOWNLOAD_FOLDER, filename, as_attachment=True, mimetype=mimetype)
-    except FileNotFoundError:
-        logging.error(f"File not found: {file_path}")
+    file_path = safe_join(DOWNLOAD_FOLDER, filename)
+    if not file_path or os.path.dirname(file_path) != DOWNLOAD_FOLDER or not os.path.isfile(file_path):
+        logging.error(f"File not found: {filename}")
         return jsonify({"error": "File not found"}), 404
 
-def schedule_agent_status_check():
-    import schedule
-    import time
-    from threading import Thread
-
-    schedule.every(1).minute.do(check_agent_status)
-
-    def run_scheduler():
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
-    
-    Thread(target=run_scheduler).start()
+    # The archive's SHA-256 is its ETag, so clients revalidate with If-None-Match and resume with
+    # If-Range, and installers can verify the download against X-Checksum-SHA256
+    checksum = file_checksum(file_path)
+    mimetype = get_mimetype(filename)
+    if AGENT_DOWNLOAD_ACCEL_PATH:
+        if request.if_none_match.contains(checksum):
+            response = Response(status=304)
+        else:
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = AGENT_DOWNLOAD_ACCEL_PATH.rstrip('/') + '/' + quote(filename)
+            response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        response.set_etag(checksum)
+    else:
+        response = send_file(file_path, mimetype=mimetype, as_attachment=True, etag=checksum, conditional=True)
+    response.headers['X-Checksum-SHA256'] = checksum
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
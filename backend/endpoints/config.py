@@ -1,6 +1,11 @@
 from flask import Blueprint, request, jsonify, json
 from utils.db import get_db_connection, init_db, DB_TYPE
 from utils.slack_integration import save_slack_service_hook
+from utils.config_cache import publish_invalidation
+from utils.redis_connection import get_redis_connection
+from utils.agent_cache import get_agent
+from utils.task_store import task_key
+from utils.script_cache import get_cache_stats, reset_cache_stats, get_pinned_scripts, pin_script, unpin_script, purge_scripts
 
 config_bp = Blueprint('config_bp', __name__)
 
@@ -48,6 +53,9 @@ def set_all_api_keys():
     cursor.close()
     conn.close()
 
+    for api_key in api_keys:
+        publish_invalidation('api_keys', api_key['key_name'])
+
     return jsonify({"message": "API keys saved successfully!"}), 200
 
 
@@ -77,6 +85,7 @@ def set_api_key():
     conn.commit()
     cursor.close()
     conn.close()
+    publish_invalidation('api_keys', 'openai_api_key')
 
     return jsonify({"message": "API key saved successfully!"}), 200
 
@@ -159,6 +168,7 @@ def set_slack_notification_settings():
     conn.commit()
     cursor.close()
     conn.close()
+    publish_invalidation('config')
 
     return jsonify({"message": "Slack notification settings saved successfully!"}), 200
 
@@ -208,6 +218,7 @@ def set_redis_config():
     conn.commit()
     cursor.close()
     conn.close()
+    publish_invalidation('config')
 
     return jsonify({"message": "Redis configuration saved successfully!"}), 200
 
@@ -268,6 +279,7 @@ def set_llm_config():
     conn.commit()
     cursor.close()
     conn.close()
+    publish_invalidation('api_keys', 'llm')
 
     return jsonify({"message": "LLM configuration saved successfully!"}), 200
 
@@ -331,6 +343,7 @@ def set_embedding_config():
     conn.commit()
     cursor.close()
     conn.close()
+    publish_invalidation('api_keys', 'embedding')
 
     return jsonify({"message": "Embedding configuration saved successfully!"}), 200
 
@@ -350,3 +363,66 @@ def get_embedding_config():
         return jsonify({"embeddingConfig": json.loads(row['key_value'])}), 200
     else:
         return jsonify({"message": "Embedding configuration not found"}), 404
+
+# Script cache endpoints
+@config_bp.route('/get-script-cache-stats', methods=['GET'])
+def get_script_cache_stats():
+    return jsonify(get_cache_stats()), 200
+
+@config_bp.route('/reset-script-cache-stats', methods=['POST'])
+def reset_script_cache_stats():
+    reset_cache_stats()
+    return jsonify({"message": "Script cache statistics reset"}), 200
+
+@config_bp.route('/get-pinned-scripts', methods=['GET'])
+def get_pinned_scripts_endpoint():
+    return jsonify(get_pinned_scripts()), 200
+
+# Pin the script of an approved task, or an explicit command/os_type/script
+@config_bp.route('/pin-script', methods=['POST'])
+def pin_script_endpoint():
+    data = request.json
+    task_id = data.get('task_id')
+    pinned_by = data.get('username')
+
+    if not pinned_by:
+        return jsonify({"message": "Username is required"}), 400
+
+    if task_id:
+        fields = ['status', 'agent_id', 'input', 'script_code']
+        task = dict(zip(fields, get_redis_connection().hmget(task_key(task_id), fields)))
+        if not task['status']:
+            return jsonify({"message": "Task not found"}), 404
+        task = {field: value.decode() if value else '' for field, value in task.items()}
+        if task['status'] not in ['approved', 'completed']:
+            return jsonify({"message": "Only approved tasks can be pinned"}), 409
+        agent_info = get_agent(task['agent_id'])
+        if not agent_info:
+            return jsonify({"message": "Agent not found"}), 404
+        command, os_type, script = task['input'], agent_info['os_type'], task['script_code']
+    else:
+        command = data.get('command')
+        os_type = data.get('os_type')
+        script = data.get('script')
+        if not command or not os_type or not script:
+            return jsonify({"message": "Task ID, or command, OS type and script are required"}), 400
+        if os_type.lower() not in ['linux', 'windows', 'darwin']:
+            return jsonify({"message": "Invalid OS type"}), 400
+
+    script_hash = pin_script(command, os_type, script, pinned_by, task_id)
+    return jsonify({"message": "Script pinned successfully!", "hash": script_hash}), 200
+
+@config_bp.route('/unpin-script', methods=['POST'])
+def unpin_script_endpoint():
+    script_hash = request.json.get('hash')
+    if not script_hash:
+        return jsonify({"message": "Hash is required"}), 400
+    if not unpin_script(script_hash):
+        return jsonify({"message": "Pinned script not found"}), 404
+    return jsonify({"message": "Script unpinned successfully!"}), 200
+
+@config_bp.route('/purge-script-cache', methods=['POST'])
+def purge_script_cache():
+    data = request.get_json(silent=True) or {}
+    count = purge_scripts(include_pinned=bool(data.get('include_pinned')))
+    return jsonify({"message": "Script cache purged", "purged": count}), 200
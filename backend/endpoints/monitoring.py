@@ -193,7 +193,7 @@ def handle_monitoring_notification():
 
     # Generate script based on the message
     try:
-        script_code = convert_natural_language_to_script(message, os_type)
+        script_code = convert_natural_language_to_script(message, os_type, use_cache=False)
         logging.info(f"Generated Script: {script_code}")
     except Exception as e:
         logging.error(f"Error in converting message to script: {e}")
@@ -201,6 +201,8 @@ def handle_monitoring_notification():
 
     # Execute the script and get the result
     result = execute_script_and_get_result(agent_id, script_code)
+    if not isinstance(result, dict):
+        return jsonify({"agent_id": agent_id, "error": result}), 504
 
     # Add Slack notification
     notification_data = {
@@ -1,13 +1,21 @@
 from flask import Blueprint, request, jsonify
 from utils.redis_connection import get_redis_connection
-from utils.langchain_integration import convert_natural_language_to_script, interpret_result
-from utils.db import get_db_connection, DB_TYPE
+from utils.langchain_integration import convert_natural_language_to_script
+from utils.script_cache import store_script, evict_script
+from utils.task_history import query_task_history, parse_fields, MAX_HISTORY_LIMIT
+from utils.task_stats import get_task_stats
+from utils.agent_cache import get_agent, get_agents_by_id, query_agents
+from utils.task_output import decode_output, decode_result, decompress_request_body
+from utils.task_notify import add_waiter, remove_waiter, TASK_POLL_TIMEOUT, TASK_POLL_MAX_TIMEOUT
+from utils.task_schedules import create_pending_schedule, decide_schedule, delete_schedule, get_schedules, is_valid_cron
+from utils.task_transitions import SLACK_NOTIFICATIONS_KEY, create_pending_job, decide_job, create_pending_task, approve_pending_task, reject_pending_task, dequeue_task, lease_tasks, complete_task, dispatched_task_payload
+from utils.task_store import PENDING_QUEUE, PENDING_JOBS, task_key, job_key, job_tasks_key, get_pending_tasks_for_agent, fetch_tasks, get_completed_tasks, get_task_outcome_counts, fetch_tasks_with_results, load_persisted_task, query_cold_tasks, TASK_LEASE_TIMEOUT, TASK_LEASE_MAX_TIMEOUT, TASK_LEASE_MAX_BATCH, TASK_PRIORITIES
 import json
+import zlib
 import uuid
 import logging
 from datetime import datetime
-import threading
-from time import sleep
+from time import monotonic
 
 logging.basicConfig(level=logging.INFO)
 
@@ -15,86 +23,33 @@ tasks_bp = Blueprint('tasks', __name__)
 
 redis = get_redis_connection()
 
-# Initialize a lock for synchronization
-sync_lock = threading.Lock()
-
-def sync_redis_and_db():
-    with sync_lock:  # Acquire lock
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Sync from Redis to DB
-        task_keys = redis.keys('result:*')
-        for key in task_keys:
-            task_id = key.decode().split(':')[1]
-            task_data = redis.get(f'task:{task_id}')
-            if task_data:
-                task = json.loads(task_data)
-                if task['status'] == 'completed':
-                    result_data = redis.hgetall(f'result:{task_id}')
-                    task.update({k.decode(): v.decode() for k, v in result_data.items()})
-                    if DB_TYPE == 'mysql':
-                        query = '''
-                            INSERT INTO completed_tasks (task_id, agent_id, input, script_code, status, submitted_at, approved_at, completed_at, output, error, interpretation)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ON DUPLICATE KEY UPDATE
-                            agent_id=VALUES(agent_id),
-                            input=VALUES(input),
-                            script_code=VALUES(script_code),
-                            status=VALUES(status),
-                            submitted_at=VALUES(submitted_at),
-                            approved_at=VALUES(approved_at),
-                            completed_at=VALUES(completed_at),
-                            output=VALUES(output),
-                            error=VALUES(error),
-                            interpretation=VALUES(interpretation)
-                        '''
-                    else:  # sqlite
-                        query = '''
-                            INSERT OR REPLACE INTO completed_tasks (task_id, agent_id, input, script_code, status, submitted_at, approved_at, completed_at, output, error, interpretation)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        '''
-                    cursor.execute(query, (
-                        task['task_id'], task['agent_id'], task['input'], task['script_code'], task['status'],
-                        task.get('submitted_at'), task.get('approved_at'), task.get('completed_at'),
-                        task.get('output'), task.get('error'), task.get('interpretation')
-                    ))
-
-        # Sync from DB to Redis
-        cursor.execute('SELECT * FROM completed_tasks')
-        rows = cursor.fetchall()
-        for row in rows:
-            task_id = row['task_id']
-            task_data = {
-                "task_id": row['task_id'],
-                "agent_id": row['agent_id'],
-                "input": row['input'],
-                "script_code": row['script_code'],
-                "status": row['status'],
-                "submitted_at": row['submitted_at'].isoformat() if row['submitted_at'] else None,
-                "approved_at": row['approved_at'].isoformat() if row['approved_at'] else None,
-                "completed_at": row['completed_at'].isoformat() if row['completed_at'] else None,
-                "output": row['output'],
-                "error": row['error'],
-                "interpretation": row['interpretation']
-            }
-            redis.set(f'task:{task_id}', json.dumps(task_data))
-            redis.hset(f'result:{task_id}', "output", row['output'])
-            redis.hset(f'result:{task_id}', "error", row['error'])
-            redis.hset(f'result:{task_id}', "interpretation", row['interpretation'])
-
-        conn.commit()
-        conn.close()
-
-def sync_redis_to_db_background():
-    while True:
-        sync_redis_and_db()
-        sleep(60)  # Perform sync every 1 minute
-
-def start_sync_thread():
-    sync_thread = threading.Thread(target=sync_redis_to_db_background)
-    sync_thread.daemon = True
-    sync_thread.start()
+SUPPORTED_OS_TYPES = ['linux', 'windows', 'darwin']
+
+# Completed task lists return the newest tasks only; the full history is paged through
+# /get-task-history
+TASK_LIST_LIMIT = 200
+
+def parse_list_limit(value):
+    limit = min(int(value or TASK_LIST_LIMIT), MAX_HISTORY_LIMIT)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return limit
+
+# Priority of a submitted task or job, and the time it should run at if it is delayed. Approved
+# tasks with a future run_at are held back by the scheduler until then.
+def parse_scheduling(data):
+    priority = data.get('priority') or 'normal'
+    if priority not in TASK_PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(TASK_PRIORITIES)}")
+    fields = {"priority": priority}
+    if data.get('run_at'):
+        try:
+            run_at = datetime.fromisoformat(data['run_at'])
+        except (TypeError, ValueError):
+            raise ValueError("run_at must be an ISO 8601 timestamp")
+        fields["run_at"] = run_at.isoformat()
+        fields["run_at_score"] = run_at.timestamp()
+    return fields
 
 @tasks_bp.route('/submit-task', methods=['POST'])
 def submit_task():
@@ -105,14 +60,13 @@ def submit_task():
     
     if not input_text or not target_agent_id or not submitted_by:
         return jsonify({"error": "Command, Agent ID, and Username are required"}), 400
+
+    try:
+        scheduling = parse_scheduling(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    query = 'SELECT os_type FROM agents WHERE agent_id = %s' if DB_TYPE == 'mysql' else 'SELECT os_type FROM agents WHERE agent_id = ?'
-    cursor.execute(query, (target_agent_id,))
-    agent_info = cursor.fetchone()
-    conn.close()
-    
+    agent_info = get_agent(target_agent_id)
     if not agent_info:
         return jsonify({"error": "Agent not found"}), 404
     
@@ -137,21 +91,329 @@ def submit_task():
         "timestamp": datetime.now().isoformat(),
         "status": "pending",
         "submitted_at": datetime.now().isoformat(),
-        "submitted_by": submitted_by  # username 저장
+        "submitted_by": submitted_by,  # username 저장
+        **scheduling
     }
     
-    redis.set(f'task:{task_id}', json.dumps(task_data))
-    redis.lpush('pending_tasks', task_id)
-    
     # Send notification to Slack
     notification_data = {
         "type": "submit_task",
         "message": f"*Submit Task Alert*\n - Task {task_id} has been submitted by {submitted_by} and is pending review."
     }
-    redis.rpush('slack_notifications', json.dumps(notification_data))
+    pipe = redis.pipeline()
+    create_pending_task(pipe, task_data, notification_data)
+    pipe.execute()
     
     return jsonify({"task_id": task_id, "status": "Task created and pending review"})
 
+# Fan one command out to many agents, given as an agent_ids list or a selector on os_type and
+# status. The script is generated once per OS type and the child tasks are reviewed together
+# through the job.
+@tasks_bp.route('/submit-job', methods=['POST'])
+def submit_job():
+    data = request.get_json()
+    input_text = data.get('command')
+    submitted_by = data.get('username')
+    agent_ids = data.get('agent_ids')
+    selector = data.get('selector') or {}
+
+    if not input_text or not submitted_by:
+        return jsonify({"error": "Command and Username are required"}), 400
+    if not agent_ids and not selector:
+        return jsonify({"error": "agent_ids or selector is required"}), 400
+
+    try:
+        scheduling = parse_scheduling(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    agents, skipped_agents = resolve_agents(agent_ids, selector)
+    if not agents:
+        return jsonify({"error": "No matching agents found", "skipped_agents": skipped_agents}), 404
+
+    try:
+        scripts = generate_scripts(input_text, {agent['os_type'] for agent in agents})
+    except Exception as e:
+        logging.error(f"Error in converting command: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    job_id = str(uuid.uuid4())
+    now = datetime.now().isoformat()
+    tasks = [{
+        "task_id": str(uuid.uuid4()),
+        "job_id": job_id,
+        "input": input_text,
+        "script_code": scripts[agent['os_type']],
+        "agent_id": agent['agent_id'],
+        "timestamp": now,
+        "status": "pending",
+        "submitted_at": now,
+        "submitted_by": submitted_by,
+        **scheduling
+    } for agent in agents]
+    job_data = {
+        "job_id": job_id,
+        "input": input_text,
+        "scripts": scripts,
+        "selector": selector,
+        "task_count": len(tasks),
+        "status": "pending",
+        "submitted_at": now,
+        "submitted_by": submitted_by,
+        **scheduling
+    }
+
+    # Send notification to Slack
+    notification_data = {
+        "type": "submit_task",
+        "message": f"*Submit Job Alert*\n - Job {job_id} for {len(tasks)} agents has been submitted by {submitted_by} and is pending review."
+    }
+    pipe = redis.pipeline()
+    create_pending_job(pipe, job_data, tasks, notification_data)
+    pipe.execute()
+
+    return jsonify({"job_id": job_id, "task_count": len(tasks), "skipped_agents": skipped_agents, "status": "Job created and pending review"})
+
+# Agents given as an agent_ids list or matching a selector, and the ids of those that are unknown
+# or run an unsupported OS
+def resolve_agents(agent_ids, selector):
+    if agent_ids:
+        agent_ids = list(dict.fromkeys(agent_ids))
+        found = get_agents_by_id(agent_ids)
+        agents = [found[agent_id] for agent_id in agent_ids if found.get(agent_id)]
+        skipped_agents = [agent_id for agent_id in agent_ids if not found.get(agent_id)]
+    else:
+        agents = query_agents(os_type=selector.get('os_type'), status=selector.get('status'))
+        skipped_agents = []
+    skipped_agents += [agent['agent_id'] for agent in agents if agent['os_type'] not in SUPPORTED_OS_TYPES]
+    agents = [agent for agent in agents if agent['os_type'] in SUPPORTED_OS_TYPES]
+    return agents, skipped_agents
+
+# Cache the scripts of an approved task, job or schedule so the same command is served without
+# the LLM next time, and drop them on rejection so a resubmission gets a fresh script
+def record_script_review(input_text, scripts, status):
+    for os_type, script in scripts.items():
+        try:
+            if status == 'approved':
+                store_script(input_text, os_type, script)
+            else:
+                evict_script(input_text, os_type, script)
+        except Exception as e:
+            logging.error(f"Error updating the script cache for {os_type}: {e}")
+
+def record_task_script_review(task_id, status):
+    input_text, script_code, agent_id = redis.hmget(task_key(task_id), 'input', 'script_code', 'agent_id')
+    agent_info = get_agent(agent_id.decode()) if agent_id else None
+    if input_text and script_code and agent_info:
+        record_script_review(input_text.decode(), {agent_info['os_type']: script_code.decode()}, status)
+
+def generate_scripts(input_text, os_types):
+    scripts = {}
+    for os_type in sorted(os_types):
+        scripts[os_type] = convert_natural_language_to_script(input_text, os_type)
+        logging.info(f"Converted Script for {os_type}: {scripts[os_type]}")
+    return scripts
+
+# Run a command on a cron schedule. Like a job it targets agent_ids or a selector; a selector is
+# evaluated again at every run, so scripts are generated for every OS it can match. The schedule
+# is reviewed once, after which each run queues its tasks already approved.
+@tasks_bp.route('/submit-schedule', methods=['POST'])
+def submit_schedule():
+    data = request.get_json()
+    input_text = data.get('command')
+    submitted_by = data.get('username')
+    cron = data.get('cron')
+    agent_ids = data.get('agent_ids')
+    selector = data.get('selector') or {}
+
+    if not input_text or not submitted_by or not cron:
+        return jsonify({"error": "Command, Username and cron are required"}), 400
+    if not agent_ids and not selector:
+        return jsonify({"error": "agent_ids or selector is required"}), 400
+    if not is_valid_cron(cron):
+        return jsonify({"error": "cron must be a valid cron expression"}), 400
+
+    try:
+        scheduling = parse_scheduling(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if 'run_at' in scheduling:
+        return jsonify({"error": "run_at is not supported for schedules"}), 400
+
+    skipped_agents = []
+    if agent_ids:
+        agents, skipped_agents = resolve_agents(agent_ids, selector)
+        if not agents:
+            return jsonify({"error": "No matching agents found", "skipped_agents": skipped_agents}), 404
+        agent_ids = [agent['agent_id'] for agent in agents]
+        os_types = {agent['os_type'] for agent in agents}
+    elif selector.get('os_type'):
+        if selector['os_type'] not in SUPPORTED_OS_TYPES:
+            return jsonify({"error": "Unsupported OS type in selector"}), 400
+        os_types = {selector['os_type']}
+    else:
+        os_types = set(SUPPORTED_OS_TYPES)
+
+    try:
+        scripts = generate_scripts(input_text, os_types)
+    except Exception as e:
+        logging.error(f"Error in converting command: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    schedule_id = str(uuid.uuid4())
+    schedule_data = {
+        "schedule_id": schedule_id,
+        "input": input_text,
+        "scripts": scripts,
+        "agent_ids": agent_ids or [],
+        "selector": selector,
+        "cron": cron,
+        "priority": scheduling['priority'],
+        "status": "pending",
+        "submitted_at": datetime.now().isoformat(),
+        "submitted_by": submitted_by,
+        "run_count": 0
+    }
+
+    # Send notification to Slack
+    notification_data = {
+        "type": "submit_task",
+        "message": f"*Submit Schedule Alert*\n - Schedule {schedule_id} ({cron}) has been submitted by {submitted_by} and is pending review."
+    }
+    pipe = redis.pipeline()
+    create_pending_schedule(pipe, schedule_data, SLACK_NOTIFICATIONS_KEY, notification_data)
+    pipe.execute()
+
+    return jsonify({"schedule_id": schedule_id, "skipped_agents": skipped_agents, "status": "Schedule created and pending review"})
+
+@tasks_bp.route('/approve-schedule', methods=['POST'])
+def approve_schedule():
+    return decide_schedule_request('approved')
+
+@tasks_bp.route('/reject-schedule', methods=['POST'])
+def reject_schedule():
+    return decide_schedule_request('rejected')
+
+def decide_schedule_request(status):
+    data = request.get_json()
+    schedule_id = data.get('schedule_id')
+    username = data.get('username')
+
+    if not schedule_id or not username:
+        return jsonify({"error": "Schedule ID and Username are required"}), 400
+
+    action = 'approve' if status == 'approved' else 'reject'
+    outcome, schedule = decide_schedule(redis, schedule_id, status, {
+        f"{status}_at": datetime.now().isoformat(),
+        f"{status}_by": username
+    })
+    if outcome == 'not_found':
+        return jsonify({"error": "Schedule not found"}), 404
+    if outcome == 'conflict':
+        return jsonify({"error": "Schedule is not in pending status"}), 400
+    record_script_review(schedule['input'], schedule['scripts'], status)
+
+    # Send notification to Slack
+    redis.rpush(SLACK_NOTIFICATIONS_KEY, json.dumps({
+        "type": f"{action}_task",
+        "message": f"*{action.capitalize()} Schedule Alert*\n - Schedule {schedule_id} has been {status} by {username}."
+    }))
+    return jsonify({"status": f"Schedule {status}", "schedule_id": schedule_id, "next_run_at": schedule.get('next_run_at')})
+
+@tasks_bp.route('/get-schedules', methods=['GET'])
+def get_schedules_endpoint():
+    return jsonify(get_schedules(redis))
+
+@tasks_bp.route('/delete-schedule', methods=['POST'])
+def delete_schedule_endpoint():
+    data = request.get_json()
+    schedule_id = data.get('schedule_id')
+
+    if not schedule_id:
+        return jsonify({"error": "Schedule ID is required"}), 400
+    if not delete_schedule(redis, schedule_id):
+        return jsonify({"error": "Schedule not found"}), 404
+    return jsonify({"status": "Schedule deleted", "schedule_id": schedule_id})
+
+@tasks_bp.route('/approve-job', methods=['POST'])
+def approve_job():
+    data = request.get_json()
+    job_id = data.get('job_id')
+    approved_by = data.get('username')
+
+    if not job_id or not approved_by:
+        return jsonify({"error": "Job ID and Username are required"}), 400
+
+    # Send notification to Slack
+    notification_data = {
+        "type": "approve_task",
+        "message": f"*Approve Job Alert*\n - Job {job_id} has been approved by {approved_by}."
+    }
+    updates = {
+        "approved_at": datetime.now().isoformat(),
+        "approved_by": approved_by
+    }
+    outcome, job, task_count = decide_job(redis, job_id, 'approved', updates, notification_data)
+    if outcome == 'not_found':
+        return jsonify({"error": "Job not found"}), 404
+    if outcome == 'conflict':
+        return jsonify({"error": "Job is not in pending status"}), 400
+    record_script_review(job['input'], job['scripts'], 'approved')
+
+    return jsonify({"status": "Job approved", "job_id": job_id, "task_count": task_count})
+
+@tasks_bp.route('/reject-job', methods=['POST'])
+def reject_job():
+    data = request.get_json()
+    job_id = data.get('job_id')
+    rejected_by = data.get('username')
+
+    if not job_id or not rejected_by:
+        return jsonify({"error": "Job ID and Username are required"}), 400
+
+    # Send notification to Slack
+    notification_data = {
+        "type": "reject_task",
+        "message": f"*Reject Job Alert*\n - Job {job_id} has been rejected by {rejected_by}."
+    }
+    updates = {
+        "rejected_at": datetime.now().isoformat(),
+        "rejected_by": rejected_by
+    }
+    outcome, job, task_count = decide_job(redis, job_id, 'rejected', updates, notification_data)
+    if outcome == 'not_found':
+        return jsonify({"error": "Job not found"}), 404
+    if outcome == 'conflict':
+        return jsonify({"error": "Job is not in pending status"}), 400
+    record_script_review(job['input'], job['scripts'], 'rejected')
+
+    return jsonify({"status": "Job rejected", "job_id": job_id, "task_count": task_count})
+
+@tasks_bp.route('/get-pending-jobs', methods=['GET'])
+def get_pending_jobs():
+    job_ids = redis.lrange(PENDING_JOBS, 0, -1)
+    jobs = []
+    if job_ids:
+        for job_data in redis.mget([job_key(job_id.decode()) for job_id in job_ids]):
+            if job_data:
+                jobs.append(json.loads(job_data))
+    return jsonify(jobs)
+
+@tasks_bp.route('/job-status/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job_data = redis.get(job_key(job_id))
+    if not job_data:
+        return jsonify({"error": "Job not found"}), 404
+
+    job = json.loads(job_data)
+    tasks = [decode_result(task) for task in fetch_tasks_with_results(redis, redis.lrange(job_tasks_key(job_id), 0, -1))]
+    counts = {}
+    for task in tasks:
+        counts[task['status']] = counts.get(task['status'], 0) + 1
+    job['status_counts'] = counts
+    job['tasks'] = tasks
+    return jsonify(job)
+
 
 @tasks_bp.route('/get-pending-tasks', methods=['GET'])
 def get_pending_tasks():
@@ -160,49 +422,19 @@ def get_pending_tasks():
     if not agent_id:
         return jsonify({"error": "Agent ID is required"}), 400
 
-    pending_task_ids = redis.lrange('pending_tasks', 0, -1)
-    pending_tasks = []
-    
-    for task_id in pending_task_ids:
-        task_data = redis.get(f'task:{task_id.decode()}')
-        if task_data:
-            task = json.loads(task_data)
-            if task['agent_id'] == agent_id:
-                pending_tasks.append(task)
-    
-    return jsonify(pending_tasks)
+    return jsonify(get_pending_tasks_for_agent(redis, agent_id))
 
 @tasks_bp.route('/get-all-pending-tasks', methods=['GET'])
 def get_all_pending_tasks():
-    pending_task_ids = redis.lrange('pending_tasks', 0, -1)
-    pending_tasks = []
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    for task_id in pending_task_ids:
-        task_data = redis.get(f'task:{task_id.decode()}')
-        if task_data:
-            task = json.loads(task_data)
-            agent_id = task.get('agent_id')
-            print(agent_id)
-            
-            # if agent_id is available, get hostname from agents table
-            if agent_id:
-                query = 'SELECT computer_name FROM agents WHERE agent_id = %s' if DB_TYPE == 'mysql' else 'SELECT computer_name FROM agents WHERE agent_id = ?'
-                cursor.execute(query, (agent_id,))
-                result = cursor.fetchone()
-                print(result)
-                
-                logging.debug(f'Query: {query} | Parameters: {agent_id} | Result: {result}')  # Add logging
-
-                if result:
-                    task['hostname'] = result['computer_name']  # Add hostname to task data
-                else:
-                    task['hostname'] = None  # Set hostname to None if not found
-            pending_tasks.append(task)
+    pending_tasks = fetch_tasks(redis, redis.lrange(PENDING_QUEUE, 0, -1))
+
+    # Add hostname from the agent cache, loading any uncached agents in one query
+    agents = get_agents_by_id([task.get('agent_id') for task in pending_tasks])
+    for task in pending_tasks:
+        if task.get('agent_id'):
+            agent = agents.get(task['agent_id'])
+            task['hostname'] = agent['computer_name'] if agent else None
     
-    cursor.close()
-    conn.close()
     return jsonify(pending_tasks)
 
 @tasks_bp.route('/approve-task', methods=['POST'])
@@ -214,28 +446,21 @@ def approve_task():
     if not task_id or not approved_by:
         return jsonify({"error": "Task ID and Username are required"}), 400
     
-    task_data = redis.get(f'task:{task_id}')
-    if not task_data:
-        return jsonify({"error": "Task not found"}), 404
-    
-    task_data = json.loads(task_data)
-    if task_data.get('status') != 'pending':
-        return jsonify({"error": "Task is not in pending status"}), 400
-    
-    task_data['status'] = 'approved'
-    task_data['approved_at'] = datetime.now().isoformat()
-    task_data['approved_by'] = approved_by  # username 저장
-    redis.set(f'task:{task_id}', json.dumps(task_data))
-    target_agent_id = task_data['agent_id']
-    redis.lpush(f'task_queue:{target_agent_id}', json.dumps(task_data))
-    redis.lrem('pending_tasks', 0, task_id)
-    
     # Send notification to Slack
     notification_data = {
         "type": "approve_task",
         "message": f"*Approve Task Alert*\n - Task {task_id} has been approved by {approved_by}."
     }
-    redis.rpush('slack_notifications', json.dumps(notification_data))
+    updates = {
+        "approved_at": datetime.now().isoformat(),
+        "approved_by": approved_by  # username 저장
+    }
+    outcome, _ = approve_pending_task(redis, task_id, updates, notification_data)
+    if outcome == 'not_found':
+        return jsonify({"error": "Task not found"}), 404
+    if outcome == 'conflict':
+        return jsonify({"error": "Task is not in pending status"}), 400
+    record_task_script_review(task_id, 'approved')
     
     return jsonify({"status": "Task approved", "task_id": task_id})
 
@@ -249,26 +474,21 @@ def reject_task():
     if not task_id or not rejected_by:
         return jsonify({"error": "Task ID and Username are required"}), 400
     
-    task_data = redis.get(f'task:{task_id}')
-    if not task_data:
-        return jsonify({"error": "Task not found"}), 404
-    
-    task_data = json.loads(task_data)
-    if task_data.get('status') != 'pending':
-        return jsonify({"error": "Task is not in pending status"}), 400
-    
-    task_data['status'] = 'rejected'
-    task_data['rejected_at'] = datetime.now().isoformat()
-    task_data['rejected_by'] = rejected_by  # username 저장
-    redis.set(f'task:{task_id}', json.dumps(task_data))
-    redis.lrem('pending_tasks', 0, task_id)
-    
     # Send notification to Slack
     notification_data = {
         "type": "reject_task",
         "message": f"*Reject Task Alert*\n - Task {task_id} has been rejected by {rejected_by}."
     }
-    redis.rpush('slack_notifications', json.dumps(notification_data))
+    updates = {
+        "rejected_at": datetime.now().isoformat(),
+        "rejected_by": rejected_by  # username 저장
+    }
+    outcome, _ = reject_pending_task(redis, task_id, updates, notification_data)
+    if outcome == 'not_found':
+        return jsonify({"error": "Task not found"}), 404
+    if outcome == 'conflict':
+        return jsonify({"error": "Task is not in pending status"}), 400
+    record_task_script_review(task_id, 'rejected')
     
     return jsonify({"status": "Task rejected", "task_id": task_id})
 
@@ -280,32 +500,95 @@ def get_task():
     if not agent_id:
         return jsonify({"error": "Agent ID is required"}), 400
 
-    task_queue_key = f'task_queue:{agent_id}'
-    task = redis.rpop(task_queue_key)
+    task_data, result = dequeue_task(redis, agent_id, datetime.now().isoformat())
 
-    if task:
-        task_data = json.loads(task.decode())
-        task_id = task_data["task_id"]
-        input_text = task_data["input"]
-        script_code = task_data["script_code"]
-        timestamp = task_data.get("timestamp", "N/A")
-        result_key = f"result:{task_id}"
-        result = redis.hgetall(result_key)
-        if result:
-            output = result.get(b'output', b'').decode()
-            error = result.get(b'error', b'').decode()
-            interpretation = result.get(b'interpretation', b'').decode()
-        else:
-            output = ""
-            error = ""
-            interpretation = ""
-        return jsonify({"task_id": task_id, "input": input_text, "script_code": script_code, "timestamp": timestamp, "output": output, "error": error, "interpretation": interpretation})
+    if task_data:
+        return dispatched_task_response(task_data, result)
     else:
         return jsonify({"error": "No task found for this agent"}), 404
 
+# Long-poll variant of /get-task: holds the request until a task is approved for the agent or
+# the timeout passes (204). Served by the gevent worker pool, see infra/supervisord.conf.
+@tasks_bp.route('/poll-task', methods=['GET'])
+def poll_task():
+    agent_id = request.args.get('agent_id')
+
+    if not agent_id:
+        return jsonify({"error": "Agent ID is required"}), 400
+
+    try:
+        timeout = min(float(request.args.get('timeout', TASK_POLL_TIMEOUT)), TASK_POLL_MAX_TIMEOUT)
+    except ValueError:
+        return jsonify({"error": "timeout must be a number of seconds"}), 400
+
+    leased = wait_for_tasks(agent_id, timeout, lambda: lease_tasks(redis, agent_id, datetime.now().isoformat()))
+    if not leased:
+        return '', 204
+    return dispatched_task_response(*leased[0])
+
+# Batch variant of /poll-task: leases up to max_tasks of the agent's queued tasks for
+# lease_seconds, so a backlog can be worked through in parallel. Tasks not reported through
+# /report-result before their lease ends are handed out again by the scheduler.
+# Served by the gevent worker pool like /poll-task.
+@tasks_bp.route('/lease-tasks', methods=['GET'])
+def lease_tasks_for_agent():
+    agent_id = request.args.get('agent_id')
+
+    if not agent_id:
+        return jsonify({"error": "Agent ID is required"}), 400
+
+    try:
+        timeout = min(float(request.args.get('timeout', TASK_POLL_TIMEOUT)), TASK_POLL_MAX_TIMEOUT)
+        max_tasks = min(int(request.args.get('max_tasks', 1)), TASK_LEASE_MAX_BATCH)
+        lease_seconds = min(int(request.args.get('lease_seconds', TASK_LEASE_TIMEOUT)), TASK_LEASE_MAX_TIMEOUT)
+    except ValueError:
+        return jsonify({"error": "timeout, max_tasks and lease_seconds must be numbers"}), 400
+    if max_tasks < 1 or lease_seconds < 1:
+        return jsonify({"error": "max_tasks and lease_seconds must be at least 1"}), 400
+
+    leased = wait_for_tasks(agent_id, timeout, lambda: lease_tasks(redis, agent_id, datetime.now().isoformat(), max_tasks, lease_seconds))
+    if not leased:
+        return '', 204
+    return jsonify({
+        "tasks": [dispatched_task_payload(task_data, result) for task_data, result in leased],
+        "lease_seconds": lease_seconds
+    })
+
+# Hold the request until lease() hands out tasks or timeout seconds pass
+def wait_for_tasks(agent_id, timeout, lease):
+    deadline = monotonic() + timeout
+    while True:
+        event = add_waiter(agent_id)
+        try:
+            leased = lease()
+            if leased:
+                return leased
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return []
+            event.wait(remaining)
+        finally:
+            remove_waiter(agent_id, event)
+
+def dispatched_task_response(task_data, result):
+    return jsonify(dispatched_task_payload(task_data, result))
+
 @tasks_bp.route('/report-result', methods=['POST'])
 def report_result():
-    data = request.get_json()
+    # Agents gzip large reports
+    if request.headers.get('Content-Encoding') == 'gzip':
+        try:
+            body = decompress_request_body(request.get_data())
+        except zlib.error:
+            return jsonify({"error": "Invalid gzip request body"}), 400
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 413
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return jsonify({"error": "Invalid JSON request body"}), 400
+    else:
+        data = request.get_json()
     task_id = data.get('task_id')
     input_text = data.get('input')
     command = data.get('command')
@@ -315,34 +598,24 @@ def report_result():
     if not task_id:
         return jsonify({"error": "Task ID is required"}), 400
 
-    result_key = f"result:{task_id}"
-
     output_str = output if output is not None else ""
     error_str = error if error is not None else ""
 
     try:
-        interpretation = interpret_result(input_text, output_str, error_str)
-
-        if interpretation is None:
-            interpretation = ""
-
-        redis.hset(result_key, "input", input_text)
-        redis.hset(result_key, "command", command)
-        redis.hset(result_key, "output", output_str)
-        redis.hset(result_key, "error", error_str)
-        redis.hset(result_key, "interpretation", interpretation)
-        
-        task_data = redis.get(f'task:{task_id}')
-        if task_data:
-            task = json.loads(task_data)
-            task['status'] = 'completed'
-            task['completed_at'] = datetime.now().isoformat()
-            redis.set(f'task:{task_id}', json.dumps(task))
-
-            agent_tasks_key = f'agent_tasks:{task["agent_id"]}'
-            redis.lpush(agent_tasks_key, json.dumps(task))
-
-        return jsonify({"status": "Result reported", "task_id": task_id, "interpretation": interpretation})
+        # The interpretation is filled in later by the scheduler's interpretation workers
+        result = {
+            "input": input_text or "",
+            "command": command or "",
+            "output": output_str,
+            "error": error_str
+        }
+        outcome, _ = complete_task(redis, task_id, datetime.now().isoformat(), result)
+        if outcome == 'not_found':
+            return jsonify({"error": "Task not found"}), 404
+        if outcome == 'conflict':
+            return jsonify({"error": "Task is not awaiting a result"}), 409
+
+        return jsonify({"status": "Result reported", "task_id": task_id, "interpretation": "", "interpretation_status": "pending"})
     except Exception as e:
         logging.error(f"Error in report-result: {e}")
         return jsonify({"error": str(e)}), 500
@@ -354,9 +627,10 @@ def task_status(task_id):
     if result:
         input_text = result.get(b'input', b'').decode()
         command = result.get(b'command', b'').decode()
-        output = result.get(b'output', b'').decode()
+        output = decode_output(result.get(b'output', b'').decode(), result.get(b'output_encoding', b'').decode())
         error = result.get(b'error', b'').decode()
         interpretation = result.get(b'interpretation', b'').decode()
+        interpretation_status = result.get(b'interpretation_status', b'completed').decode()
         
         logging.info(f"Task ID: {task_id} Input: {input_text}")
         logging.info(f"Task ID: {task_id} Command: {command}")
@@ -364,7 +638,12 @@ def task_status(task_id):
         logging.info(f"Task ID: {task_id} Error: {error}")
         logging.info(f"Task ID: {task_id} Interpretation: {interpretation}")
         
-        return jsonify({"task_id": task_id, "input": input_text, "command": command, "output": output, "error": error, "interpretation": interpretation})
+        return jsonify({"task_id": task_id, "input": input_text, "command": command, "output": output, "error": error, "interpretation": interpretation, "interpretation_status": interpretation_status})
+
+    # Past its hot window the task is only in completed_tasks
+    task = load_persisted_task(redis, task_id, rewarm=request.args.get('rewarm', 'true') != 'false')
+    if task:
+        return jsonify({"task_id": task_id, "input": task['input'], "command": task['script_code'], "output": task['output'], "error": task['error'], "interpretation": task['interpretation'], "interpretation_status": "completed"})
     return jsonify({"error": "Task not found"}), 404
 
 @tasks_bp.route('/get-agent-tasks', methods=['GET'])
@@ -373,108 +652,118 @@ def get_agent_tasks():
     
     if not agent_id:
         return jsonify({"error": "Agent ID is required"}), 400
+    try:
+        limit = parse_list_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    task_queue_key = f'agent_tasks:{agent_id}'
-    tasks = redis.lrange(task_queue_key, 0, -1)
+    # Task and result hashes are read in pipelined batches, not one round trip per task
+    tasks = fetch_tasks_with_results(redis, redis.lrange(f'agent_tasks:{agent_id}', 0, limit - 1))
     
     task_list = []
-    for task in tasks:
-        task_data = json.loads(task.decode())
-        task_id = task_data["task_id"]
-        input_text = task_data["input"]
-        script_code = task_data["script_code"]
-        submitted_at = task_data.get("submitted_at", "N/A")
-        approved_at = task_data.get("approved_at", None)
-        rejected_at = task_data.get("rejected_at", None)
-        status = task_data.get("status", "pending")
-
-        result_key = f"result:{task_id}"
-        result = redis.hgetall(result_key)
-        if result:
-            output = result.get(b'output', b'').decode()
-            error = result.get(b'error', b'').decode()
-            interpretation = result.get(b'interpretation', b'').decode()
-        else:
-            output = ""
-            error = ""
-            interpretation = ""
-
+    for task_data in tasks:
+        # Tasks without a result hash have no output fields
+        has_result = 'output' in task_data or 'error' in task_data
         task_list.append({
-            "task_id": task_id,
-            "input": input_text,
-            "script_code": script_code,
-            "submitted_at": submitted_at,
-            "approved_at": approved_at,
-            "rejected_at": rejected_at,
-            "status": status,
-            "output": output,
-            "error": error,
-            "interpretation": interpretation,
+            "task_id": task_data["task_id"],
+            "input": task_data["input"],
+            "script_code": task_data["script_code"],
+            "submitted_at": task_data.get("submitted_at", "N/A"),
+            "approved_at": task_data.get("approved_at", None),
+            "rejected_at": task_data.get("rejected_at", None),
+            "status": task_data.get("status", "pending"),
+            "output": decode_output(task_data.get('output', ''), task_data.get('output_encoding', '')),
+            "error": task_data.get('error', ''),
+            "interpretation": task_data.get('interpretation', ''),
+            "interpretation_status": task_data.get('interpretation_status', 'completed') if has_result else None,
             "submitted_by": task_data.get('submitted_by'),
             "approved_by": task_data.get('approved_by')
         })
+
+    # Older tasks have left Redis; read the rest of the page from completed_tasks
+    hot_task_ids = {task['task_id'] for task in task_list}
+    cold_tasks = query_cold_tasks(limit - len(task_list), agent_id) if len(task_list) < limit else []
+    for task in cold_tasks:
+        if task['task_id'] not in hot_task_ids:
+            task_list.append({
+                "task_id": task['task_id'],
+                "input": task['input'],
+                "script_code": task['script_code'],
+                "submitted_at": task['submitted_at'] or "N/A",
+                "approved_at": task['approved_at'],
+                "rejected_at": None,
+                "status": task['status'],
+                "output": task['output'],
+                "error": task['error'],
+                "interpretation": task['interpretation'],
+                "interpretation_status": "completed",
+                "submitted_by": task['submitted_by'],
+                "approved_by": task['approved_by']
+            })
     
     return jsonify(task_list)
 
 
 @tasks_bp.route('/get-all-completed-tasks', methods=['GET'])
 def get_all_completed_tasks():
-    completed_tasks = []
-
-    # First try to get data from Redis
-    task_keys = redis.keys('result:*')
-    for key in task_keys:
-        task_id = key.decode().split(':')[1]
-        task_data = redis.get(f'task:{task_id}')
-        if task_data:
-            task = json.loads(task_data)
-            if task['status'] == 'completed':
-                result_data = redis.hgetall(f'result:{task_id}')
-                task.update({k.decode(): v.decode() for k, v in result_data.items()})
-                completed_tasks.append(task)
-    
-    # If Redis doesn't have data, fetch from DB
-    if not completed_tasks:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM completed_tasks')
-        rows = cursor.fetchall()
-        for row in rows:
-            task = {
-                "task_id": row['task_id'],
-                "agent_id": row['agent_id'],
-                "input": row['input'],
-                "script_code": row['script_code'],
-                "status": row['status'],
-                "submitted_at": row['submitted_at'].isoformat() if row['submitted_at'] else None,
-                "approved_at": row['approved_at'].isoformat() if row['approved_at'] else None,
-                "completed_at": row['completed_at'].isoformat() if row['completed_at'] else None,
-                "output": row['output'],
-                "error": row['error'],
-                "interpretation": row['interpretation'],
-                "submitted_by": row['submitted_by'],
-                "approved_by": row['approved_by']
-            }
-            completed_tasks.append(task)
-        conn.close()
-
-    completed_tasks.sort(key=lambda x: x.get('approved_at', ''), reverse=True)
+    try:
+        limit = parse_list_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Tasks still in their hot window come from Redis, older ones from completed_tasks
+    completed_tasks = get_completed_tasks(redis, 0, limit - 1)
+    if len(completed_tasks) < limit:
+        hot_task_ids = {task['task_id'] for task in completed_tasks}
+        completed_tasks.extend(task for task in query_cold_tasks(limit - len(completed_tasks)) if task['task_id'] not in hot_task_ids)
 
     return jsonify(completed_tasks)
 
 
+# Paginated task history served from the completed_tasks table
+@tasks_bp.route('/get-task-history', methods=['GET'])
+def get_task_history():
+    try:
+        limit = min(int(request.args.get('limit', 50)), MAX_HISTORY_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        fields = parse_fields(request.args.get('fields'))
+        tasks, next_cursor = query_task_history(
+            fields,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            agent_id=request.args.get('agent_id'),
+            submitted_by=request.args.get('submitted_by'),
+            status=request.args.get('status'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"tasks": tasks, "next_cursor": next_cursor})
+
+
+# Task counters maintained at completion time: global, per agent, per submitter and per time bucket
+@tasks_bp.route('/get-task-stats', methods=['GET'])
+def get_task_stats_endpoint():
+    try:
+        stats = get_task_stats(
+            redis,
+            agent_id=request.args.get('agent_id'),
+            submitted_by=request.args.get('submitted_by'),
+            bucket=request.args.get('bucket'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(stats)
+
+
 # Endpoint to summary the tasks
 @tasks_bp.route('/get-tasks-summary', methods=['GET'])
 def get_tasks_summary():
-    success_count = 0
-    failure_count = 0
-    
-    task_keys = redis.keys('result:*')
-    for key in task_keys:
-        result = redis.hgetall(key)
-        if b'error' in result and result[b'error']:
-            failure_count += 1
-        else:
-            success_count += 1
-    
+    success_count, failure_count = get_task_outcome_counts(redis)
     return jsonify({"successCount": success_count, "failureCount": failure_count})
\ No newline at end of file
@@ -0,0 +1,36 @@
+import argparse
+import logging
+from utils.migrations import run_migrations_with_retry
+
+logging.basicConfig(level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description='NerdyOps backend management commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser('migrate', help='Apply pending database schema migrations')
+    migrate_parser.add_argument('--retries', type=int, default=0, help='Retry this many times while the database is unavailable')
+
+    subparsers.add_parser('rebuild-task-indexes', help='Rebuild Redis task indexes from existing task keys')
+    subparsers.add_parser('backfill-task-stats', help='Rebuild task statistics counters from the completed_tasks table')
+    subparsers.add_parser('migrate-task-hashes', help='Convert Redis task records from JSON strings to hashes')
+
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        run_migrations_with_retry(retries=args.retries)
+    elif args.command == 'rebuild-task-indexes':
+        from utils.redis_connection import get_redis_connection
+        from utils.task_store import rebuild_task_indexes
+        rebuild_task_indexes(get_redis_connection())
+    elif args.command == 'backfill-task-stats':
+        from utils.redis_connection import get_redis_connection
+        from utils.task_stats import backfill_task_stats
+        backfill_task_stats(get_redis_connection())
+    elif args.command == 'migrate-task-hashes':
+        from utils.redis_connection import get_redis_connection
+        from utils.task_store import migrate_task_hashes
+        migrate_task_hashes(get_redis_connection())
+
+if __name__ == '__main__':
+    main()
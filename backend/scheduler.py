@@ -2,135 +2,83 @@ import schedule
 import threading
 import time
 import logging
-from utils.db import get_db_connection, DB_TYPE, init_db
+from utils.migrations import check_schema_version
 from utils.redis_connection import get_redis_connection
-from datetime import datetime, timedelta
+from datetime import datetime
 from utils.slack_integration import process_redis_notifications
-import json
+from utils.interpretation_worker import start_interpretation_workers
+from utils.task_store import ensure_task_indexes, prune_expired_tasks, task_key, FETCH_BATCH_SIZE, TASK_LEASES, TASK_LEASE_MAX_ATTEMPTS
+from utils.task_sync import process_task_events
+from utils.task_transitions import requeue_expired_leases, promote_scheduled_tasks, complete_task
+from utils.task_schedules import run_due_schedules
+from utils.agent_heartbeat import flush_heartbeats, mark_down_agents, seed_heartbeats, HEARTBEAT_FLUSH_INTERVAL
 
 logging.basicConfig(level=logging.INFO)
 
 redis = get_redis_connection()
-db_initialized = False
+schema_checked = False
 
-def initialize_database():
-    global db_initialized
-    if not db_initialized:
+def verify_database_schema():
+    global schema_checked
+    if not schema_checked:
         try:
-            init_db()
-            db_initialized = True
-            logging.info("Database initialized successfully.")
+            check_schema_version()
+            schema_checked = True
         except Exception as e:
-            logging.error(f"Error initializing database: {e}")
+            logging.error(f"Error checking database schema version: {e}")
 
-def get_initialized_db_connection():
-    initialize_database()
-    return get_db_connection()
+def flush_agent_heartbeats():
+    try:
+        flush_heartbeats(redis)
+        mark_down_agents(redis)
+    except Exception as e:
+        logging.error(f"Error flushing agent heartbeats: {e}")
 
-def check_agent_status():
-    logging.info("Checking agent statuses...")
-    conn = get_initialized_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT agent_id, last_update_date, status FROM agents')
-    agents = cursor.fetchall()
-    
-    for agent in agents:
-        last_update_date = agent['last_update_date']
-        if not isinstance(last_update_date, str):
-            last_update_date = str(last_update_date)
-        last_update_date = datetime.fromisoformat(last_update_date)
-        time_diff = datetime.utcnow() - last_update_date
-        if time_diff > timedelta(minutes=1) and agent['status'] != 'down':
-            query = 'UPDATE agents SET status = %s WHERE agent_id = %s' if DB_TYPE == 'mysql' else 'UPDATE agents SET status = ? WHERE agent_id = ?'
-            cursor.execute(query, ('down', agent['agent_id']))
-            logging.info(f"Agent {agent['agent_id']} marked as down")
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def sync_redis_and_db():
-    logging.info("Syncing Redis and DB...")
-    conn = get_initialized_db_connection()
-    cursor = conn.cursor()
+def prune_hot_tasks():
+    try:
+        while prune_expired_tasks(redis) >= FETCH_BATCH_SIZE:
+            pass
+    except Exception as e:
+        logging.error(f"Error pruning tasks past their hot window: {e}")
 
-    # Sync from Redis to DB
-    task_keys = redis.keys('result:*')
-    for key in task_keys:
-        task_id = key.decode().split(':')[1]
-        task_data = redis.get(f'task:{task_id}')
-        if task_data:
-            task = json.loads(task_data)
-            if task['status'] == 'completed':
-                result_data = redis.hgetall(f'result:{task_id}')
-                task.update({k.decode(): v.decode() for k, v in result_data.items()})
-                if DB_TYPE == 'mysql':
-                    query = '''
-                        INSERT INTO completed_tasks (task_id, agent_id, input, script_code, status, submitted_at, approved_at, completed_at, output, error, interpretation, submitted_by, approved_by, rejected_by)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                        agent_id=VALUES(agent_id),
-                        input=VALUES(input),
-                        script_code=VALUES(script_code),
-                        status=VALUES(status),
-                        submitted_at=VALUES(submitted_at),
-                        approved_at=VALUES(approved_at),
-                        completed_at=VALUES(completed_at),
-                        output=VALUES(output),
-                        error=VALUES(error),
-                        interpretation=VALUES(interpretation),
-                        submitted_by=VALUES(submitted_by),
-                        approved_by=VALUES(approved_by),
-                        rejected_by=VALUES(rejected_by)
-                    '''
-                else:  # sqlite
-                    query = '''
-                        INSERT OR REPLACE INTO completed_tasks (task_id, agent_id, input, script_code, status, submitted_at, approved_at, completed_at, output, error, interpretation, submitted_by, approved_by, rejected_by)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    '''
-                cursor.execute(query, (
-                    task['task_id'], task['agent_id'], task['input'], task['script_code'], task['status'],
-                    task.get('submitted_at'), task.get('approved_at'), task.get('completed_at'),
-                    task.get('output'), task.get('error'), task.get('interpretation'),
-                    task.get('submitted_by'), task.get('approved_by'), task.get('rejected_by')
-                ))
+# Hand tasks whose agent never reported back to the agent again, and give up on them once they
+# have run out of lease attempts
+def requeue_expired_tasks():
+    try:
+        requeued, exhausted = requeue_expired_leases(redis, FETCH_BATCH_SIZE, TASK_LEASE_MAX_ATTEMPTS)
+        if requeued:
+            logging.info(f"Re-queued {requeued} task(s) whose lease expired")
+        for task_id in exhausted:
+            input_text = redis.hget(task_key(task_id), 'input')
+            result = {
+                "input": input_text.decode() if input_text else "",
+                "command": "",
+                "output": "",
+                "error": f"No result reported after {TASK_LEASE_MAX_ATTEMPTS} lease(s); giving up on the task"
+            }
+            outcome, _ = complete_task(redis, task_id, datetime.now().isoformat(), result)
+            if outcome == 'ok':
+                logging.info(f"Task {task_id} failed after {TASK_LEASE_MAX_ATTEMPTS} expired lease(s)")
+            else:
+                redis.zrem(TASK_LEASES, task_id)
+    except Exception as e:
+        logging.error(f"Error re-queuing tasks with expired leases: {e}")
 
-    # Sync from DB to Redis
-    cursor.execute('SELECT * FROM completed_tasks')
-    rows = cursor.fetchall()
-    for row in rows:
-        task_id = row['task_id']
-        task_data = {
-            "task_id": row['task_id'],
-            "agent_id": row['agent_id'],
-            "input": row['input'],
-            "script_code": row['script_code'],
-            "status": row['status'],
-            "submitted_at": row['submitted_at'].isoformat() if row['submitted_at'] else None,
-            "approved_at": row['approved_at'].isoformat() if row['approved_at'] else None,
-            "completed_at": row['completed_at'].isoformat() if row['completed_at'] else None,
-            "output": row['output'],
-            "error": row['error'],
-            "interpretation": row['interpretation'],
-            "submitted_by": row['submitted_by'],
-            "approved_by": row['approved_by'],
-            "rejected_by": row['rejected_by']
-        }
-        redis.set(f'task:{task_id}', json.dumps(task_data))
-        redis.hset(f'result:{task_id}', "output", row['output'])
-        redis.hset(f'result:{task_id}', "error", row['error'])
-        redis.hset(f'result:{task_id}', "interpretation", row['interpretation'])
-
-    conn.commit()
-    conn.close()
-
-def sync_redis_to_db_background():
-    while True:
-        sync_redis_and_db()
-        time.sleep(60)  # Perform sync every 1 minute
+# Queue delayed tasks whose run_at has come and start the recurring schedules that are due,
+# a batch at a time
+def run_scheduled_tasks():
+    try:
+        while promote_scheduled_tasks(redis, FETCH_BATCH_SIZE) >= FETCH_BATCH_SIZE:
+            pass
+        run_due_schedules(redis)
+    except Exception as e:
+        logging.error(f"Error queuing scheduled tasks: {e}")
 
 def schedule_agent_status_check():
-    schedule.every(1).minute.do(check_agent_status)
+    schedule.every(HEARTBEAT_FLUSH_INTERVAL).seconds.do(flush_agent_heartbeats)
+    schedule.every(1).minute.do(prune_hot_tasks)
+    schedule.every(5).seconds.do(requeue_expired_tasks)
+    schedule.every(1).seconds.do(run_scheduled_tasks)
 
     def run_scheduler():
         while True:
@@ -147,15 +95,18 @@ def start_notification_thread():
     notification_thread.start()
 
 def start_sync_thread():
-    sync_thread = threading.Thread(target=sync_redis_to_db_background)
+    sync_thread = threading.Thread(target=process_task_events)
     sync_thread.daemon = True
     sync_thread.start()
 
 if __name__ == "__main__":
-    initialize_database()
+    verify_database_schema()
+    ensure_task_indexes(redis)
+    seed_heartbeats(redis)
     schedule_agent_status_check()
     start_notification_thread()
     start_sync_thread()
+    start_interpretation_workers()
     
     # Keep the main thread alive to allow daemon threads to run
     while True:
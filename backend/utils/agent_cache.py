@@ -0,0 +1,61 @@
+from utils.db import get_db_connection, DB_TYPE
+from utils.config_cache import get_cached_many, publish_invalidation
+
+# Agent rows are cached per process under this namespace and dropped on register, delete
+# and status change through the shared config invalidation channel.
+AGENT_CACHE_NAMESPACE = 'agents'
+AGENT_FIELDS = ['agent_id', 'os_type', 'computer_name', 'private_ip', 'shell_version', 'status']
+# Keeps IN lists under SQLite's bound-parameter limit
+LOAD_BATCH_SIZE = 500
+
+def load_agents(agent_ids):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    agents = {}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for start in range(0, len(agent_ids), LOAD_BATCH_SIZE):
+            batch = agent_ids[start:start + LOAD_BATCH_SIZE]
+            query = f"SELECT {', '.join(AGENT_FIELDS)} FROM agents WHERE agent_id IN ({', '.join([placeholder] * len(batch))})"
+            cursor.execute(query, batch)
+            for row in cursor.fetchall():
+                agents[row['agent_id']] = {field: row[field] for field in AGENT_FIELDS}
+        cursor.close()
+    finally:
+        conn.close()
+    return agents
+
+# Look up many agents, loading whatever isn't cached in one batched query; unknown agents map to None
+def get_agents_by_id(agent_ids):
+    agent_ids = [agent_id for agent_id in agent_ids if agent_id]
+    if not agent_ids:
+        return {}
+    return get_cached_many(AGENT_CACHE_NAMESPACE, agent_ids, load_agents)
+
+def get_agent(agent_id):
+    return get_agents_by_id([agent_id]).get(agent_id)
+
+# Agents matching every given filter, straight from the database
+def query_agents(os_type=None, status=None):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    conditions = []
+    params = []
+    for column, value in (('os_type', os_type), ('status', status)):
+        if value:
+            conditions.append(f'{column} = {placeholder}')
+            params.append(value)
+    query = f"SELECT {', '.join(AGENT_FIELDS)} FROM agents"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return [{field: row[field] for field in AGENT_FIELDS} for row in rows]
+
+def invalidate_agent(agent_id):
+    publish_invalidation(AGENT_CACHE_NAMESPACE, agent_id)
@@ -0,0 +1,42 @@
+import os
+import json
+import socket
+from utils.redis_connection import load_script
+
+# Registry of open agent channels (/ws/agent), shared by every backend node through Redis.
+# Tasks reach an agent through task_queue:{agent_id} and the task_ready channel no matter
+# which node holds its socket; the registry records where each agent is connected.
+AGENT_CONNECTION_TTL = int(os.getenv('AGENT_CONNECTION_TTL', 60))
+NODE_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+# Delete the registration only if it still belongs to this connection
+UNREGISTER_SCRIPT = load_script("""
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['connection_id'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+def connection_key(agent_id):
+    return f'agent_connection:{agent_id}'
+
+# Called on connect and on every heartbeat, so a registration outlives its socket by at most
+# AGENT_CONNECTION_TTL seconds if the node dies
+def register_connection(redis, agent_id, connection_id, connected_at):
+    registration = {
+        "connection_id": connection_id,
+        "node": NODE_ID,
+        "connected_at": connected_at
+    }
+    redis.set(connection_key(agent_id), json.dumps(registration), ex=AGENT_CONNECTION_TTL)
+
+def unregister_connection(redis, agent_id, connection_id):
+    UNREGISTER_SCRIPT(keys=[connection_key(agent_id)], args=[connection_id], client=redis)
+
+# Current registration for each agent id, or None when it has no open channel
+def get_connections(redis, agent_ids):
+    if not agent_ids:
+        return {}
+    values = redis.mget([connection_key(agent_id) for agent_id in agent_ids])
+    return {agent_id: json.loads(value) if value else None for agent_id, value in zip(agent_ids, values)}
@@ -0,0 +1,53 @@
+import os
+import hashlib
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+# Internal nginx location serving the downloads folder (see infra/nginx.conf). When set,
+# /install-agent only validates the request and hands the transfer to nginx with
+# X-Accel-Redirect, which sends the file with sendfile and handles Range requests itself.
+AGENT_DOWNLOAD_ACCEL_PATH = os.getenv('AGENT_DOWNLOAD_ACCEL_PATH', '')
+
+AGENT_ARCHIVE_PREFIX = 'NerdyOps-Agent-'
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# SHA-256 of each archive, keyed by path and checked against its mtime and size so a rebuilt
+# archive is hashed again on its next download. The digest doubles as the ETag.
+_checksums = {}
+_lock = threading.Lock()
+
+def file_checksum(path):
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _checksums.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    checksum = digest.hexdigest()
+    with _lock:
+        _checksums[path] = (version, checksum)
+    return checksum
+
+def precompute_checksums(folder):
+    count = 0
+    for filename in os.listdir(folder):
+        if filename.startswith(AGENT_ARCHIVE_PREFIX):
+            try:
+                file_checksum(os.path.join(folder, filename))
+                count += 1
+            except OSError as e:
+                logging.error(f"Failed to checksum {filename}: {e}")
+    if count:
+        logging.info(f"Computed checksums for {count} agent archive(s)")
+
+# Hash the archives in the background when a worker starts, so the first downloads don't wait
+def start_checksum_precompute(folder):
+    thread = threading.Thread(target=precompute_checksums, args=(folder,))
+    thread.daemon = True
+    thread.start()
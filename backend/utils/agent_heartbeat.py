@@ -0,0 +1,125 @@
+import os
+import time
+import logging
+from utils.db import get_db_connection, DB_TYPE
+from utils.db_writer import execute_write
+from utils.redis_connection import load_script
+from utils.agent_cache import get_agents_by_id, invalidate_agent
+
+logging.basicConfig(level=logging.INFO)
+
+# Heartbeats only touch Redis: the agent's last-seen time goes into AGENT_HEARTBEATS and its
+# reported status into AGENT_STATUSES. The scheduler writes both to the agents table in batches
+# every few seconds, and marks agents down with one range query over the sorted set. Agents
+# marked down leave the set until their next heartbeat, so it only ever holds live agents.
+AGENT_HEARTBEATS = 'agents:heartbeats'  # ZSET agent_id -> last heartbeat
+AGENT_STATUSES = 'agents:status'  # HASH agent_id -> last reported status
+HEARTBEATS_FLUSHED_KEY = 'agents:heartbeats:flushed_at'
+
+# Seconds without a heartbeat before an agent is marked down
+AGENT_DOWN_AFTER = int(os.getenv('AGENT_DOWN_AFTER', 60))
+# Seconds between flushes of heartbeats to the agents table
+HEARTBEAT_FLUSH_INTERVAL = int(os.getenv('HEARTBEAT_FLUSH_INTERVAL', 10))
+# Each flush re-reads this many seconds before the previous one, so heartbeats stamped just
+# before a flush but written after it are not missed
+HEARTBEAT_FLUSH_OVERLAP = 5
+HEARTBEAT_FLUSH_BATCH = 1000
+
+# Take agents whose last heartbeat is older than the cutoff out of the live set and mark them
+# down, atomically so a heartbeat landing meanwhile is never removed.
+# KEYS[1] heartbeat ZSET, KEYS[2] status hash; ARGV[1] cutoff, ARGV[2] batch size
+MARK_DOWN_SCRIPT = load_script("""
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, agent_id in ipairs(stale) do
+    redis.call('ZREM', KEYS[1], agent_id)
+    redis.call('HSET', KEYS[2], agent_id, 'down')
+end
+return stale
+""")
+
+# Heartbeat times are handed to the database as Unix timestamps and converted there, so
+# last_update_date is in the same zone CURRENT_TIMESTAMP writes: the session time zone on MySQL,
+# UTC on SQLite
+if DB_TYPE == 'mysql':
+    UPDATE_AGENT_HEARTBEAT = 'UPDATE agents SET status = %s, last_update_date = FROM_UNIXTIME(%s) WHERE agent_id = %s'
+    UPDATE_AGENT_STATUS = 'UPDATE agents SET status = %s WHERE agent_id = %s'
+    SELECT_LIVE_AGENTS = "SELECT agent_id, UNIX_TIMESTAMP(last_update_date) AS last_seen FROM agents WHERE status != 'down'"
+else:  # sqlite
+    UPDATE_AGENT_HEARTBEAT = "UPDATE agents SET status = ?, last_update_date = datetime(?, 'unixepoch') WHERE agent_id = ?"
+    UPDATE_AGENT_STATUS = 'UPDATE agents SET status = ? WHERE agent_id = ?'
+    SELECT_LIVE_AGENTS = "SELECT agent_id, CAST(strftime('%s', last_update_date) AS INTEGER) AS last_seen FROM agents WHERE status != 'down'"
+
+def record_heartbeat(redis, agent_id, status):
+    pipe = redis.pipeline(transaction=False)
+    pipe.zadd(AGENT_HEARTBEATS, {agent_id: time.time()})
+    pipe.hset(AGENT_STATUSES, agent_id, status)
+    pipe.execute()
+
+def forget_agent(redis, agent_id):
+    pipe = redis.pipeline(transaction=False)
+    pipe.zrem(AGENT_HEARTBEATS, agent_id)
+    pipe.hdel(AGENT_STATUSES, agent_id)
+    pipe.execute()
+
+# Latest reported status of each agent, ahead of the next flush to the table
+def get_live_statuses(redis, agent_ids):
+    if not agent_ids:
+        return {}
+    statuses = redis.hmget(AGENT_STATUSES, agent_ids)
+    return {agent_id: status.decode() for agent_id, status in zip(agent_ids, statuses) if status is not None}
+
+# Only agents whose status changed need other processes to reload them
+def invalidate_changed(agent_statuses):
+    cached = get_agents_by_id(list(agent_statuses))
+    for agent_id, status in agent_statuses.items():
+        agent = cached.get(agent_id)
+        if agent and agent['status'] != status:
+            invalidate_agent(agent_id)
+
+# Write the heartbeats received since the last flush to the agents table
+def flush_heartbeats(redis):
+    now = time.time()
+    flushed_at = float(redis.get(HEARTBEATS_FLUSHED_KEY) or 0)
+    entries = redis.zrangebyscore(AGENT_HEARTBEATS, max(flushed_at - HEARTBEAT_FLUSH_OVERLAP, 0), '+inf', withscores=True)
+    count = 0
+    for start in range(0, len(entries), HEARTBEAT_FLUSH_BATCH):
+        batch = [(agent_id.decode(), score) for agent_id, score in entries[start:start + HEARTBEAT_FLUSH_BATCH]]
+        statuses = get_live_statuses(redis, [agent_id for agent_id, _ in batch])
+        # Agents seeded from the table have no reported status until their next heartbeat, and
+        # their row is already current
+        rows = [(statuses[agent_id], int(score), agent_id) for agent_id, score in batch if agent_id in statuses]
+        if not rows:
+            continue
+        execute_write(UPDATE_AGENT_HEARTBEAT, rows, many=True)
+        invalidate_changed({agent_id: status for status, _, agent_id in rows})
+        count += len(rows)
+    redis.set(HEARTBEATS_FLUSHED_KEY, now)
+    return count
+
+def mark_down_agents(redis):
+    cutoff = time.time() - AGENT_DOWN_AFTER
+    count = 0
+    while True:
+        stale = [agent_id.decode() for agent_id in MARK_DOWN_SCRIPT(keys=[AGENT_HEARTBEATS, AGENT_STATUSES], args=[cutoff, HEARTBEAT_FLUSH_BATCH], client=redis)]
+        if not stale:
+            return count
+        execute_write(UPDATE_AGENT_STATUS, [('down', agent_id) for agent_id in stale], many=True)
+        for agent_id in stale:
+            invalidate_agent(agent_id)
+            logging.info(f"Agent {agent_id} marked as down")
+        count += len(stale)
+
+# Agents that have not sent a heartbeat since the set was introduced are seeded from the table
+# once, so those that never come back are still marked down
+def seed_heartbeats(redis):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SELECT_LIVE_AGENTS)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    heartbeats = {row['agent_id']: float(row['last_seen']) for row in rows if row['last_seen'] is not None}
+    if heartbeats:
+        redis.zadd(AGENT_HEARTBEATS, heartbeats, nx=True)
@@ -0,0 +1,121 @@
+import json
+import base64
+from datetime import datetime
+from utils.db import get_db_connection, DB_TYPE
+from utils.db_writer import execute_write
+
+REGISTRY_FIELDS = ['agent_id', 'os_type', 'status', 'computer_name', 'private_ip', 'shell_version', 'last_update_date']
+# Columns the registry can be sorted on; each has an index ending in agent_id, the tie-breaker
+SORT_FIELDS = ['agent_id', 'computer_name', 'private_ip', 'last_update_date']
+MAX_AGENT_LIMIT = 500
+# Keeps IN lists under SQLite's bound-parameter limit
+TAG_BATCH_SIZE = 500
+
+def serialize_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+def encode_cursor(sort, order, value, agent_id):
+    payload = json.dumps([sort, order, serialize_value(value), agent_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor, sort, order):
+    try:
+        cursor_sort, cursor_order, value, agent_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError("Cursor was issued for a different sort order")
+    return value, agent_id
+
+def escape_like(prefix):
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def parse_tags(tags):
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return sorted({tag.strip() for tag in tags or [] if tag and tag.strip()})
+
+# Replace all tags of an agent
+def set_agent_tags(agent_id, tags):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    execute_write(f'DELETE FROM agent_tags WHERE agent_id = {placeholder}', (agent_id,))
+    if tags:
+        execute_write(f'INSERT INTO agent_tags (agent_id, tag) VALUES ({placeholder}, {placeholder})', [(agent_id, tag) for tag in tags], many=True)
+
+def delete_agent_tags(agent_id):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    execute_write(f'DELETE FROM agent_tags WHERE agent_id = {placeholder}', (agent_id,))
+
+def get_agent_tags(cursor, agent_ids):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    tags = {agent_id: [] for agent_id in agent_ids}
+    for start in range(0, len(agent_ids), TAG_BATCH_SIZE):
+        batch = agent_ids[start:start + TAG_BATCH_SIZE]
+        cursor.execute(f"SELECT agent_id, tag FROM agent_tags WHERE agent_id IN ({', '.join([placeholder] * len(batch))}) ORDER BY tag", batch)
+        for row in cursor.fetchall():
+            tags[row['agent_id']].append(row['tag'])
+    return tags
+
+# Keyset-paginated read over agents ordered by (sort, agent_id). name and ip match by prefix and
+# tags must all be present. Returns (agents, next_cursor); next_cursor is None on the last page.
+def query_agent_registry(limit=50, cursor=None, sort='agent_id', order='asc', os_type=None, status=None, name=None, ip=None, tags=None):
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    conditions = []
+    params = []
+    for column, value in (('os_type', os_type), ('status', status)):
+        if value:
+            conditions.append(f'{column} = {placeholder}')
+            params.append(value)
+    for column, prefix in (('computer_name', name), ('private_ip', ip)):
+        if prefix:
+            conditions.append(f"{column} LIKE {placeholder} ESCAPE '\\\\'" if DB_TYPE == 'mysql' else f"{column} LIKE {placeholder} ESCAPE '\\'")
+            params.append(escape_like(prefix))
+    if tags:
+        conditions.append(f'''agent_id IN (
+            SELECT agent_id FROM agent_tags WHERE tag IN ({', '.join([placeholder] * len(tags))})
+            GROUP BY agent_id HAVING COUNT(*) = {placeholder})''')
+        params.extend(tags)
+        params.append(len(tags))
+    if cursor:
+        cursor_value, cursor_agent_id = decode_cursor(cursor, sort, order)
+        comparison = '>' if order == 'asc' else '<'
+        if sort == 'agent_id':
+            conditions.append(f'agent_id {comparison} {placeholder}')
+            params.append(cursor_agent_id)
+        else:
+            conditions.append(f'({sort} {comparison} {placeholder} OR ({sort} = {placeholder} AND agent_id {comparison} {placeholder}))')
+            params.extend([cursor_value, cursor_value, cursor_agent_id])
+
+    direction = 'ASC' if order == 'asc' else 'DESC'
+    order_by = f'agent_id {direction}' if sort == 'agent_id' else f'{sort} {direction}, agent_id {direction}'
+    query = f"SELECT {', '.join(REGISTRY_FIELDS)} FROM agents"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    query += f' ORDER BY {order_by} LIMIT {placeholder}'
+    params.append(limit + 1)
+
+    conn = get_db_connection()
+    try:
+        db_cursor = conn.cursor()
+        db_cursor.execute(query, params)
+        rows = db_cursor.fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(sort, order, rows[-1][sort], rows[-1]['agent_id'])
+        agents = [{field: serialize_value(row[field]) for field in REGISTRY_FIELDS} for row in rows]
+        tags_by_agent = get_agent_tags(db_cursor, [agent['agent_id'] for agent in agents])
+        db_cursor.close()
+    finally:
+        conn.close()
+
+    for agent in agents:
+        agent['tags'] = tags_by_agent[agent['agent_id']]
+    return agents, next_cursor
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+# Channel every process listens on to drop cached settings as soon as they change
+CONFIG_INVALIDATION_CHANNEL = 'config_invalidation'
+# Upper bound on staleness if an invalidation message is ever missed
+CONFIG_CACHE_TTL = float(os.getenv('CONFIG_CACHE_TTL', 300))
+
+_cache = {}
+_generation = 0
+_lock = threading.Lock()
+_listener_pid = None
+
+
+# Read-through lookup: return the cached value for (namespace, key) or call loader() and cache it
+def get_cached(namespace, key, loader):
+    ensure_invalidation_listener()
+    cache_key = (namespace, key)
+    with _lock:
+        entry = _cache.get(cache_key)
+        generation = _generation
+    if entry and time.monotonic() - entry[1] < CONFIG_CACHE_TTL:
+        return entry[0]
+
+    value = loader()
+    with _lock:
+        # Skip caching if an invalidation arrived while we were loading
+        if _generation == generation:
+            _cache[cache_key] = (value, time.monotonic())
+    return value
+
+
+# Batched read-through lookup: return {key: value} for every key, calling loader(missing_keys)
+# once for whatever isn't cached. Keys the loader leaves out are cached as None.
+def get_cached_many(namespace, keys, loader):
+    ensure_invalidation_listener()
+    now = time.monotonic()
+    values = {}
+    missing = []
+    with _lock:
+        generation = _generation
+        for key in dict.fromkeys(keys):
+            entry = _cache.get((namespace, key))
+            if entry and now - entry[1] < CONFIG_CACHE_TTL:
+                values[key] = entry[0]
+            else:
+                missing.append(key)
+    if not missing:
+        return values
+
+    loaded = loader(missing)
+    now = time.monotonic()
+    with _lock:
+        for key in missing:
+            values[key] = loaded.get(key)
+            if _generation == generation:
+                _cache[(namespace, key)] = (values[key], now)
+    return values
+
+
+# Drop cached entries in this process only; key=None drops a namespace, namespace=None drops everything
+def invalidate_local(namespace=None, key=None):
+    global _generation
+    with _lock:
+        _generation += 1
+        if namespace is None:
+            _cache.clear()
+        elif key is None:
+            for cache_key in [k for k in _cache if k[0] == namespace]:
+                del _cache[cache_key]
+        else:
+            _cache.pop((namespace, key), None)
+
+
+# Drop cached entries everywhere: locally right away, and in every other process via Redis
+def publish_invalidation(namespace, key=None):
+    invalidate_local(namespace, key)
+    try:
+        from utils.redis_connection import get_redis_connection
+        get_redis_connection().publish(CONFIG_INVALIDATION_CHANNEL, json.dumps({"namespace": namespace, "key": key}))
+    except Exception as e:
+        logging.warning(f"Failed to publish config invalidation for {namespace}:{key}: {e}")
+
+
+def listen_for_invalidations():
+    from utils.redis_connection import get_redis_connection
+    while True:
+        try:
+            pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CONFIG_INVALIDATION_CHANNEL)
+            # Anything may have changed while we weren't subscribed
+            invalidate_local()
+            for message in pubsub.listen():
+                data = json.loads(message['data'])
+                invalidate_local(data.get('namespace'), data.get('key'))
+        except Exception as e:
+            logging.error(f"Config invalidation listener error: {e}")
+            invalidate_local()
+            time.sleep(5)
+
+
+def ensure_invalidation_listener():
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+    # A forked worker must not trust entries inherited from its parent
+    invalidate_local()
+    listener_thread = threading.Thread(target=listen_for_invalidations, name='config-invalidation')
+    listener_thread.daemon = True
+    listener_thread.start()
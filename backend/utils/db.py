@@ -1,10 +1,7 @@
 import os
-import sqlite3
-import pymysql
-import json
-from werkzeug.security import generate_password_hash
-import uuid
 from dotenv import load_dotenv
+from utils.db_pool import get_pool, get_pool_status
+from utils.config_cache import get_cached
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,255 +14,23 @@ DB_PORT = os.getenv('DB_PORT', 3306)
 DB_USER = os.getenv('DB_USER', 'root')
 DB_PASSWORD = os.getenv('DB_PASSWORD', '')
 
-# Initialize the database and create the necessary tables if they don't exist
+# Bring the database schema up to date by applying any pending migrations
 def init_db():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        
-        if DB_TYPE == 'sqlite':
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS agents (
-                    agent_id TEXT PRIMARY KEY,
-                    os_type TEXT,
-                    status TEXT,
-                    computer_name TEXT,
-                    private_ip TEXT,
-                    shell_version TEXT,
-                    last_update_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    username TEXT UNIQUE,
-                    email TEXT UNIQUE,
-                    password TEXT,
-                    role TEXT
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_pats (
-                    pat_id TEXT PRIMARY KEY,
-                    token TEXT UNIQUE,
-                    expiry_date TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    user_id TEXT,
-                    FOREIGN KEY (user_id) REFERENCES users (username)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS api_keys (
-                    key_name TEXT PRIMARY KEY,
-                    key_value TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS completed_tasks (
-                    task_id TEXT PRIMARY KEY,
-                    agent_id TEXT,
-                    input TEXT,
-                    script_code TEXT,
-                    status TEXT,
-                    submitted_at TIMESTAMP,
-                    approved_at TIMESTAMP,
-                    completed_at TIMESTAMP,
-                    output TEXT,
-                    error TEXT,
-                    interpretation TEXT,
-                    submitted_by TEXT,
-                    approved_by TEXT,
-                    rejected_by TEXT
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS config (
-                    config_key TEXT PRIMARY KEY,
-                    config_value TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS agent_monitoring_settings (
-                    agent_id TEXT PRIMARY KEY,
-                    check_schedule BOOLEAN,
-                    check_ping TEXT,
-                    running_process TEXT,
-                    listen_port TEXT,
-                    FOREIGN KEY (agent_id) REFERENCES agents(agent_id)
-                )
-            ''')
-        elif DB_TYPE == 'mysql':
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS agents (
-                    agent_id VARCHAR(255) PRIMARY KEY,
-                    os_type VARCHAR(255),
-                    status VARCHAR(255),
-                    computer_name VARCHAR(255),
-                    private_ip VARCHAR(255),
-                    shell_version VARCHAR(512),
-                    last_update_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id VARCHAR(255) PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE,
-                    email VARCHAR(255) UNIQUE,
-                    password VARCHAR(255),
-                    role VARCHAR(255)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_pats (
-                    pat_id VARCHAR(255) PRIMARY KEY,
-                    token VARCHAR(255) UNIQUE,
-                    expiry_date TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    user_id VARCHAR(255),
-                    FOREIGN KEY (user_id) REFERENCES users (username)
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS api_keys (
-                    key_name VARCHAR(255) PRIMARY KEY,
-                    key_value VARCHAR(255) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS completed_tasks (
-                    task_id VARCHAR(255) PRIMARY KEY,
-                    agent_id VARCHAR(255),
-                    input TEXT,
-                    script_code TEXT,
-                    status VARCHAR(255),
-                    submitted_at TIMESTAMP,
-                    approved_at TIMESTAMP,
-                    completed_at TIMESTAMP,
-                    output TEXT,
-                    error TEXT,
-                    interpretation TEXT,
-                    submitted_by VARCHAR(255),
-                    approved_by VARCHAR(255),
-                    rejected_by VARCHAR(255)
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS config (
-                    config_key VARCHAR(255) PRIMARY KEY,
-                    config_value TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS agent_monitoring_settings (
-                    agent_id VARCHAR(255) PRIMARY KEY,
-                    check_schedule BOOLEAN,
-                    check_ping VARCHAR(255),
-                    running_process VARCHAR(255),
-                    listen_port VARCHAR(255),
-                    FOREIGN KEY (agent_id) REFERENCES agents(agent_id)
-                )
-            ''')
-
-        # Check if the admin user already exists
-        query = 'SELECT * FROM users WHERE username = %s' if DB_TYPE == 'mysql' else 'SELECT * FROM users WHERE username = ?'
-        cursor.execute(query, ('admin',))
-        admin_user = cursor.fetchone()
-        
-        if not admin_user:
-            # Hash the default admin password
-            hashed_password = generate_password_hash('admin', method='pbkdf2:sha256')
-            query = '''
-                INSERT INTO users (user_id, username, email, password, role)
-                VALUES (%s, %s, %s, %s, %s)
-            ''' if DB_TYPE == 'mysql' else '''
-                INSERT INTO users (user_id, username, email, password, role)
-                VALUES (?, ?, ?, ?, ?)
-            '''
-            cursor.execute(query, (str(uuid.uuid4()), 'admin', 'admin@admin.com', hashed_password, 'admin'))
-            conn.commit()  # Save changes
+    from utils.migrations import run_migrations
+    run_migrations()
 
-        # Insert or update the LLM configuration if it's empty
-        query = 'SELECT key_value FROM api_keys WHERE key_name = %s' if DB_TYPE == 'mysql' else 'SELECT key_value FROM api_keys WHERE key_name = ?'
-        cursor.execute(query, ('llm',))
-        llm_row = cursor.fetchone()
-        
-        if not llm_row or not llm_row['key_value']:
-            llm_config = {
-                'provider': 'openai',  # Default provider
-                'api_key': 'your_openai_api_key',
-                'model': 'gpt-4o',  # Default model
-                'temperature': 0.7,  # Default temperature
-                'azure': {
-                    'api_version': '2023-12-01-preview',
-                    'endpoint': 'https://your-resource-name.openai.azure.com',
-                    'api_key': 'your_azure_openai_api_key'
-                }
-            }
-            cursor.execute('''
-                INSERT INTO api_keys (key_name, key_value) VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE key_value = VALUES(key_value)
-            ''', ('llm', json.dumps(llm_config)))
-            conn.commit()
-
-        # Insert or update the embedding configuration if it's empty
-        cursor.execute(query, ('embedding',))
-        embedding_row = cursor.fetchone()
-
-        if not embedding_row or not embedding_row['key_value']:
-            embedding_config = {
-                'provider': 'openai',  # Default provider
-                'api_key': 'your_openai_api_key',
-                'model': 'text-embedding-ada-002',  # Default model
-                'azure': {
-                    'api_version': '2024-05-01-preview',
-                    'endpoint': 'https://your-resource-name.openai.azure.com',
-                    'api_key': 'your_azure_openai_api_key'
-                }
-            }
-            cursor.execute('''
-                INSERT INTO api_keys (key_name, key_value) VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE key_value = VALUES(key_value)
-            ''', ('embedding', json.dumps(embedding_config)))
-            conn.commit()
-
-    finally:
-        conn.close()  # Close the connection
-
-# Establish and return a connection to the database
+# Check out a connection from the process-wide pool; close() returns it to the pool
 def get_db_connection():
-    if DB_TYPE == 'sqlite':
-        conn = sqlite3.connect(DB_NAME)  # Connect to the SQLite database
-        conn.row_factory = sqlite3.Row  # Enable name-based column access
-    elif DB_TYPE == 'mysql':
-        conn = pymysql.connect(
-            host=DB_HOST,
-            port=int(DB_PORT),
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            cursorclass=pymysql.cursors.DictCursor
-        )
-    else:
-        raise ValueError(f"Unsupported DB_TYPE: {DB_TYPE}")
-    return conn  # Return the database connection
+    pool = get_pool(DB_TYPE, DB_NAME, DB_HOST, DB_PORT, DB_USER, DB_PASSWORD)
+    return pool.acquire()
+
+def get_db_pool_status():
+    return get_pool_status()
 
 def get_api_key(key_name):
+    return get_cached('api_keys', key_name, lambda: load_api_key(key_name))
+
+def load_api_key(key_name):
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
@@ -0,0 +1,328 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+import logging
+import pymysql
+
+logging.basicConfig(level=logging.INFO)
+
+# Errors after which a MySQL connection can no longer be trusted and must be replaced
+MYSQL_FATAL_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+# SQLite tuning for several processes sharing one database file
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 10000))  # milliseconds
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', 20000))
+
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_checkout(self, wait_time):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def incr(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "discarded": self.discarded,
+                "timeouts": self.timeouts,
+                "wait_time_total": round(self.wait_time_total, 6),
+                "wait_time_avg": round(self.wait_time_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_time_max": round(self.wait_time_max, 6),
+            }
+
+
+# Cursor proxy that flags the owning connection as broken on connection-level errors
+class TrackedCursor:
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def execute(self, *args, **kwargs):
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        except self._connection.fatal_errors:
+            self._connection.broken = True
+            raise
+
+    def executemany(self, *args, **kwargs):
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        except self._connection.fatal_errors:
+            self._connection.broken = True
+            raise
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# Connection handed out by get_db_connection(); close() gives it back to its pool
+class PooledConnection:
+    def __init__(self, pool, raw, fatal_errors=()):
+        self._pool = pool
+        self.raw = raw
+        self.fatal_errors = fatal_errors
+        self.broken = False
+        self.created_at = time.monotonic()
+        self.closed = False
+
+    def cursor(self, *args, **kwargs):
+        return TrackedCursor(self.raw.cursor(*args, **kwargs), self)
+
+    def commit(self):
+        try:
+            self.raw.commit()
+        except self.fatal_errors:
+            self.broken = True
+            raise
+
+    def rollback(self):
+        try:
+            self.raw.rollback()
+        except self.fatal_errors:
+            self.broken = True
+            raise
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._pool.release(self)
+
+    def __del__(self):
+        # Handlers that return early without close() must not leak their pool slot
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class MySQLPool:
+    def __init__(self, connect_kwargs, max_size=10, timeout=30, recycle=3600):
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.stats = PoolStats()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        raw = pymysql.connect(cursorclass=pymysql.cursors.DictCursor, **self.connect_kwargs)
+        self.stats.incr('created')
+        return raw
+
+    def _is_healthy(self, raw, created_at):
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            return False
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw):
+        self.stats.incr('discarded')
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.stats.incr('timeouts')
+            raise TimeoutError(f"Timed out after {self.timeout}s waiting for a database connection")
+
+        try:
+            raw = None
+            while raw is None:
+                try:
+                    raw, created_at = self._idle.get_nowait()
+                except queue.Empty:
+                    raw, created_at = self._connect(), time.monotonic()
+                    break
+                if not self._is_healthy(raw, created_at):
+                    self._discard(raw)
+                    raw = None
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        self.stats.record_checkout(time.monotonic() - started)
+        conn = PooledConnection(self, raw, MYSQL_FATAL_ERRORS)
+        conn.created_at = created_at
+        return conn
+
+    def release(self, conn):
+        try:
+            if not conn.broken:
+                try:
+                    # Never hand out a connection with a half-finished transaction
+                    conn.raw.rollback()
+                except Exception:
+                    conn.broken = True
+            if conn.broken:
+                self._discard(conn.raw)
+            else:
+                self._idle.put((conn.raw, conn.created_at))
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def status(self):
+        with self._lock:
+            in_use = self._in_use
+        idle = self._idle.qsize()
+        return {
+            "type": "mysql",
+            "max_size": self.max_size,
+            "size": in_use + idle,
+            "in_use": in_use,
+            "idle": idle,
+            **self.stats.snapshot(),
+        }
+
+
+class ThreadConnection:
+    def __init__(self, raw):
+        self.raw = raw
+        self.refs = 0
+
+
+# SQLite connections are bound to the thread that opened them, so each thread keeps one
+# and nested get_db_connection() calls on the same thread share it.
+class SQLitePool:
+    def __init__(self, database):
+        self.database = database
+        self.stats = PoolStats()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def _connect(self):
+        raw = sqlite3.connect(self.database, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        raw.row_factory = sqlite3.Row  # Enable name-based column access
+        # WAL lets readers run alongside the single writer; the rest trades a little
+        # durability on power loss (never corruption) for far fewer fsyncs.
+        raw.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+        raw.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        raw.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+        raw.execute('PRAGMA temp_store=MEMORY')
+        raw.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+        self.stats.incr('created')
+        with self._lock:
+            self._open += 1
+        holder = ThreadConnection(raw)
+        weakref.finalize(holder, self._forget, raw)
+        return holder
+
+    def _forget(self, raw):
+        with self._lock:
+            self._open -= 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        started = time.monotonic()
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            holder = self._connect()
+            self._local.holder = holder
+        holder.refs += 1
+        self.stats.record_checkout(time.monotonic() - started)
+        return PooledConnection(self, holder.raw, (sqlite3.ProgrammingError,))
+
+    def release(self, conn):
+        holder = getattr(self._local, 'holder', None)
+        if holder is None or holder.raw is not conn.raw:
+            return
+        holder.refs -= 1
+        if conn.broken:
+            self._local.holder = None
+            self.stats.incr('discarded')
+        elif holder.refs == 0 and conn.raw.in_transaction:
+            # Outermost user on this thread is done; drop anything left uncommitted
+            conn.raw.rollback()
+
+    def status(self):
+        with self._lock:
+            size = self._open
+        return {
+            "type": "sqlite",
+            "size": size,
+            **self.stats.snapshot(),
+        }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(db_type, db_name, host, port, user, password):
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            # Rebuild after fork so worker processes never share sockets with the parent
+            if _pool is None or _pool_pid != pid:
+                if db_type == 'sqlite':
+                    _pool = SQLitePool(db_name)
+                elif db_type == 'mysql':
+                    _pool = MySQLPool(
+                        {
+                            "host": host,
+                            "port": int(port),
+                            "user": user,
+                            "password": password,
+                            "database": db_name,
+                        },
+                        max_size=int(os.getenv('DB_POOL_SIZE', 10)),
+                        timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+                        recycle=float(os.getenv('DB_POOL_RECYCLE', 3600)),
+                    )
+                else:
+                    raise ValueError(f"Unsupported DB_TYPE: {db_type}")
+                _pool_pid = pid
+                logging.info(f"Database connection pool created for {db_type}")
+    return _pool
+
+
+def get_pool_status():
+    if _pool is None or _pool_pid != os.getpid():
+        return {"size": 0}
+    return _pool.status()
@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import logging
+from concurrent.futures import Future
+from utils.db import get_db_connection, DB_TYPE
+
+logging.basicConfig(level=logging.INFO)
+
+# Maximum number of queued writes applied in one SQLite transaction
+SQLITE_WRITE_BATCH = int(os.getenv('SQLITE_WRITE_BATCH', 200))
+# Seconds a caller waits for its write to be applied before giving up
+SQLITE_WRITE_TIMEOUT = float(os.getenv('SQLITE_WRITE_TIMEOUT', 30))
+
+
+class WriteRequest:
+    def __init__(self, query, params, many):
+        self.query = query
+        self.params = params
+        self.many = many
+        self.future = Future()
+
+
+# SQLite allows one writer at a time, so every write from this process goes through a
+# single thread that coalesces whatever is queued into one transaction. Readers keep
+# using their own connections and run in parallel thanks to WAL.
+class SQLiteWriter:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, query, params, many):
+        request = WriteRequest(query, params, many)
+        self._queue.put(request)
+        return request.future
+
+    def _drain(self):
+        batch = [self._queue.get()]
+        while len(batch) < SQLITE_WRITE_BATCH:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain()
+            try:
+                self._apply(batch)
+            except Exception as e:
+                logging.error(f"SQLite writer failed to apply {len(batch)} write(s): {e}")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _apply(self, batch):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            results = []
+            for index, request in enumerate(batch):
+                # A savepoint per write keeps one bad statement from discarding the rest
+                cursor.execute(f'SAVEPOINT write_{index}')
+                try:
+                    if request.many:
+                        cursor.executemany(request.query, request.params)
+                    else:
+                        cursor.execute(request.query, request.params)
+                    results.append((request, cursor.rowcount, None))
+                    cursor.execute(f'RELEASE SAVEPOINT write_{index}')
+                except Exception as e:
+                    cursor.execute(f'ROLLBACK TO SAVEPOINT write_{index}')
+                    cursor.execute(f'RELEASE SAVEPOINT write_{index}')
+                    results.append((request, None, e))
+            conn.commit()
+        finally:
+            conn.close()
+
+        for request, rowcount, error in results:
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(rowcount)
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_sqlite_writer():
+    global _writer, _writer_pid
+    pid = os.getpid()
+    if _writer is None or _writer_pid != pid:
+        with _writer_lock:
+            if _writer is None or _writer_pid != pid:
+                _writer = SQLiteWriter()
+                _writer_pid = pid
+    return _writer
+
+
+def log_write_error(future):
+    error = future.exception()
+    if error is not None:
+        logging.error(f"Background database write failed: {error}")
+
+
+# Run an INSERT/UPDATE/DELETE and return the affected row count. With SQLite the statement is
+# queued to the writer thread; pass wait=False for fire-and-forget writes such as heartbeats.
+# many=True treats params as a sequence of parameter tuples for executemany.
+def execute_write(query, params=(), many=False, wait=True):
+    if DB_TYPE == 'sqlite':
+        future = get_sqlite_writer().submit(query, params, many)
+        if not wait:
+            future.add_done_callback(log_write_error)
+            return None
+        return future.result(timeout=SQLITE_WRITE_TIMEOUT)
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if many:
+            cursor.executemany(query, params)
+        else:
+            cursor.execute(query, params)
+        rowcount = cursor.rowcount
+        conn.commit()
+        cursor.close()
+        return rowcount
+    finally:
+        conn.close()
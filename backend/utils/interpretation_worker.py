@@ -0,0 +1,88 @@
+import os
+import time
+import logging
+import threading
+from utils.redis_connection import get_redis_connection
+from utils.langchain_integration import interpret_result
+from utils.task_notify import notify_result_ready
+from utils.task_sync import add_task_event
+from utils.task_output import decode_output
+
+logging.basicConfig(level=logging.INFO)
+
+# Task ids whose results still need an LLM interpretation. report-result pushes onto the queue
+# and the scheduler's workers move each id to the processing list while they work on it, so
+# ids held by a worker that dies are put back on the next start.
+INTERPRETATION_QUEUE = 'interpretation_queue'
+INTERPRETATION_PROCESSING = 'interpretation_processing'
+
+# Number of concurrent LLM calls made by the scheduler process
+INTERPRETATION_WORKERS = int(os.getenv('INTERPRETATION_WORKERS', 4))
+INTERPRETATION_MAX_ATTEMPTS = int(os.getenv('INTERPRETATION_MAX_ATTEMPTS', 3))
+
+def attempts_key(task_id):
+    return f'interpretation_attempts:{task_id}'
+
+def interpret_task(redis, task_id):
+    result_key = f'result:{task_id}'
+    result = redis.hgetall(result_key)
+    if not result:
+        return
+    input_text = result.get(b'input', b'').decode()
+    output = decode_output(result.get(b'output', b'').decode(), result.get(b'output_encoding', b'').decode())
+    error = result.get(b'error', b'').decode()
+
+    try:
+        interpretation = interpret_result(input_text, output, error) or ""
+    except Exception as e:
+        attempts = redis.incr(attempts_key(task_id))
+        redis.expire(attempts_key(task_id), 86400)
+        if attempts < INTERPRETATION_MAX_ATTEMPTS:
+            logging.warning(f"Interpretation of task {task_id} failed (attempt {attempts}), retrying: {e}")
+            redis.lpush(INTERPRETATION_QUEUE, task_id)
+        else:
+            logging.error(f"Interpretation of task {task_id} failed after {attempts} attempts: {e}")
+            pipe = redis.pipeline()
+            pipe.hset(result_key, mapping={"interpretation_status": "failed", "interpretation_error": str(e)})
+            pipe.delete(attempts_key(task_id))
+            notify_result_ready(pipe, task_id)
+            add_task_event(pipe, task_id, 'interpretation_failed')
+            pipe.execute()
+        return
+
+    pipe = redis.pipeline()
+    pipe.hset(result_key, mapping={"interpretation": interpretation, "interpretation_status": "completed"})
+    pipe.delete(attempts_key(task_id))
+    notify_result_ready(pipe, task_id)
+    add_task_event(pipe, task_id, 'interpreted')
+    pipe.execute()
+    logging.info(f"Interpreted result of task {task_id}")
+
+def process_interpretations():
+    redis = get_redis_connection()
+    while True:
+        try:
+            task_id = redis.brpoplpush(INTERPRETATION_QUEUE, INTERPRETATION_PROCESSING, timeout=5)
+            if not task_id:
+                continue
+            try:
+                interpret_task(redis, task_id.decode())
+            finally:
+                redis.lrem(INTERPRETATION_PROCESSING, 1, task_id)
+        except Exception as e:
+            logging.error(f"Interpretation worker error: {e}")
+            time.sleep(5)
+
+def requeue_interrupted_interpretations(redis):
+    count = 0
+    while redis.rpoplpush(INTERPRETATION_PROCESSING, INTERPRETATION_QUEUE):
+        count += 1
+    if count:
+        logging.info(f"Requeued {count} interrupted interpretation(s)")
+
+def start_interpretation_workers():
+    requeue_interrupted_interpretations(get_redis_connection())
+    for index in range(INTERPRETATION_WORKERS):
+        worker_thread = threading.Thread(target=process_interpretations, name=f'interpretation-{index}')
+        worker_thread.daemon = True
+        worker_thread.start()
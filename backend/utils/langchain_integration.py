@@ -1,21 +1,25 @@
-import json
 import logging
 import re
 import os
 import uuid
 from datetime import datetime
-import time
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from utils.langchain_llm import get_llm
 from utils.db import get_db_connection, DB_TYPE
 from utils.redis_connection import get_redis_connection
+from utils.agent_cache import get_agent
+from utils.task_store import index_task, write_task, task_queue_key
+from utils.task_notify import TASK_READY_CHANNEL, wait_for_result
+from utils.script_cache import get_script
+from utils.task_output import decode_output
 
 logging.basicConfig(level=logging.INFO)
 
 redis_conn = get_redis_connection()
 
 # Define the prompt templates for different types of scripts
+# Bump SCRIPT_PROMPT_VERSION in utils/script_cache.py when editing them
 bash_template = PromptTemplate.from_template("""
 You are a helpful assistant that converts natural language commands into Bash scripts. 
 Make sure to provide a complete and executable Bash script. The script should only run on the local computer and must not include any remote commands or SSH instructions. Scripts Must Generated in English.
@@ -62,11 +66,9 @@ def extract_script_from_response(response_text: str, os_type: str) -> str:
     logging.warning("No code block found in the response. Returning the full response.")
     return response_text.strip()
 
-def convert_natural_language_to_script(command_text: str, os_type: str) -> str:
-    llm = get_llm()
-    if not llm:
-        raise ValueError("LLM configuration not set. Please set the configuration using the admin settings page.")
-
+# Generated scripts are cached once approved, see utils/script_cache.py. use_cache=False skips the
+# cache for one-off commands such as alert verification.
+def convert_natural_language_to_script(command_text: str, os_type: str, use_cache: bool = True) -> str:
     if os_type.lower() == 'windows':
         prompt = powershell_template
     elif os_type.lower() in ['linux', 'darwin']:
@@ -74,6 +76,16 @@ def convert_natural_language_to_script(command_text: str, os_type: str) -> str:
     else:
         raise ValueError("Invalid OS type. Please specify 'windows' or 'linux' or 'darwin'.")
 
+    # Pinned and previously generated scripts are served without calling the LLM
+    cached_script = get_script(command_text, os_type) if use_cache else None
+    if cached_script is not None:
+        logging.info(f"Script cache hit for command: {command_text}")
+        return cached_script
+
+    llm = get_llm()
+    if not llm:
+        raise ValueError("LLM configuration not set. Please set the configuration using the admin settings page.")
+
     input_data = {"command": command_text, "os_type": os_type}
     chain = prompt | llm
     response = chain.invoke(input_data)
@@ -82,9 +94,7 @@ def convert_natural_language_to_script(command_text: str, os_type: str) -> str:
     script_code = parser.parse(response.content)
     logging.info(f"Extracted Script Code: {script_code}")
 
-    clean_script = extract_script_from_response(script_code, os_type)
-    
-    return clean_script
+    return extract_script_from_response(script_code, os_type)
 
 def interpret_result(command_text: str, output: str, error: str) -> str:
     llm = get_llm()
@@ -124,25 +134,13 @@ def find_agent_id(message: str) -> str:
 
 # Tool to generate verification script
 def generate_verification_script_tool(message: str) -> str:
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        query = """
-        SELECT os_type FROM agents WHERE agent_id = %s
-        """ if DB_TYPE == 'mysql' else """
-        SELECT os_type FROM agents WHERE agent_id = ?
-        """
-        cursor.execute(query, (message,))
-        row = cursor.fetchone()
-    finally:
-        conn.close()
-
-    if not row:
+    agent = get_agent(message)
+    if not agent:
         return "Agent not found in the database."
 
-    os_type = row['os_type']
+    os_type = agent['os_type']
     verification_command = f"Alert Message: {message}. Please generate a script to verify this message on the local computer."
-    return convert_natural_language_to_script(verification_command, os_type)
+    return convert_natural_language_to_script(verification_command, os_type, use_cache=False)
 
 def execute_script_and_get_result(agent_id: str, script: str) -> str:
     redis_conn = get_redis_connection()
@@ -155,25 +153,24 @@ def execute_script_and_get_result(agent_id: str, script: str) -> str:
         "timestamp": datetime.now().isoformat(),
         "status": "approved",
         "approved_at": datetime.now().isoformat(),
+        "priority": "high"
     }
 
-    # Add the task to the agent's task queue in Redis
-    redis_conn.set(f'task:{task_id}', json.dumps(task_data))
-    redis_conn.lpush(f'task_queue:{agent_id}', json.dumps(task_data))
-
-    # Wait for the agent to execute the task and return the result
-    result_key = f"result:{task_id}"
-    for _ in range(10):  # Retry 10 times with a delay
-        result = redis_conn.hgetall(result_key)
-        if result:
-            output = result.get(b'output', b'').decode()
-            error = result.get(b'error', b'').decode()
-            interpretation = result.get(b'interpretation', b'').decode()
-            return {
-                "output": output,
-                "error": error,
-                "interpretation": interpretation,
-            }
-        time.sleep(5)  # Wait for 5 seconds before retrying
-
-    return "No response from agent"
\ No newline at end of file
+    # Add the task to the agent's task queue in Redis, ahead of routine work since a caller is waiting on it
+    pipe = redis_conn.pipeline()
+    write_task(pipe, task_data)
+    pipe.lpush(task_queue_key(agent_id, 'high'), task_id)
+    index_task(pipe, task_data)
+    pipe.publish(TASK_READY_CHANNEL, agent_id)
+    pipe.execute()
+
+    # Block until the interpretation worker signals that the result is final
+    if not wait_for_result(redis_conn, task_id):
+        return "No response from agent"
+
+    result = redis_conn.hgetall(f"result:{task_id}")
+    return {
+        "output": decode_output(result.get(b'output', b'').decode(), result.get(b'output_encoding', b'').decode()),
+        "error": result.get(b'error', b'').decode(),
+        "interpretation": result.get(b'interpretation', b'').decode(),
+    }
\ No newline at end of file
@@ -0,0 +1,385 @@
+import json
+import logging
+import time
+import uuid
+from werkzeug.security import generate_password_hash
+from utils.db import get_db_connection, DB_TYPE
+
+logging.basicConfig(level=logging.INFO)
+
+# Name of the MySQL advisory lock that keeps concurrent deploys from migrating at the same time
+MIGRATION_LOCK = 'nerdyops_schema_migration'
+
+def create_base_tables(cursor):
+    if DB_TYPE == 'sqlite':
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agents (
+                agent_id TEXT PRIMARY KEY,
+                os_type TEXT,
+                status TEXT,
+                computer_name TEXT,
+                private_ip TEXT,
+                shell_version TEXT,
+                last_update_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                username TEXT UNIQUE,
+                email TEXT UNIQUE,
+                password TEXT,
+                role TEXT
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_pats (
+                pat_id TEXT PRIMARY KEY,
+                token TEXT UNIQUE,
+                expiry_date TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                user_id TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (username)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS api_keys (
+                key_name TEXT PRIMARY KEY,
+                key_value TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS completed_tasks (
+                task_id TEXT PRIMARY KEY,
+                agent_id TEXT,
+                input TEXT,
+                script_code TEXT,
+                status TEXT,
+                submitted_at TIMESTAMP,
+                approved_at TIMESTAMP,
+                completed_at TIMESTAMP,
+                output TEXT,
+                error TEXT,
+                interpretation TEXT,
+                submitted_by TEXT,
+                approved_by TEXT,
+                rejected_by TEXT
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS config (
+                config_key TEXT PRIMARY KEY,
+                config_value TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agent_monitoring_settings (
+                agent_id TEXT PRIMARY KEY,
+                check_schedule BOOLEAN,
+                check_ping TEXT,
+                running_process TEXT,
+                listen_port TEXT,
+                FOREIGN KEY (agent_id) REFERENCES agents(agent_id)
+            )
+        ''')
+    elif DB_TYPE == 'mysql':
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agents (
+                agent_id VARCHAR(255) PRIMARY KEY,
+                os_type VARCHAR(255),
+                status VARCHAR(255),
+                computer_name VARCHAR(255),
+                private_ip VARCHAR(255),
+                shell_version VARCHAR(512),
+                last_update_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id VARCHAR(255) PRIMARY KEY,
+                username VARCHAR(255) UNIQUE,
+                email VARCHAR(255) UNIQUE,
+                password VARCHAR(255),
+                role VARCHAR(255)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_pats (
+                pat_id VARCHAR(255) PRIMARY KEY,
+                token VARCHAR(255) UNIQUE,
+                expiry_date TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                user_id VARCHAR(255),
+                FOREIGN KEY (user_id) REFERENCES users (username)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS api_keys (
+                key_name VARCHAR(255) PRIMARY KEY,
+                key_value VARCHAR(255) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS completed_tasks (
+                task_id VARCHAR(255) PRIMARY KEY,
+                agent_id VARCHAR(255),
+                input TEXT,
+                script_code TEXT,
+                status VARCHAR(255),
+                submitted_at TIMESTAMP,
+                approved_at TIMESTAMP,
+                completed_at TIMESTAMP,
+                output TEXT,
+                error TEXT,
+                interpretation TEXT,
+                submitted_by VARCHAR(255),
+                approved_by VARCHAR(255),
+                rejected_by VARCHAR(255)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS config (
+                config_key VARCHAR(255) PRIMARY KEY,
+                config_value TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agent_monitoring_settings (
+                agent_id VARCHAR(255) PRIMARY KEY,
+                check_schedule BOOLEAN,
+                check_ping VARCHAR(255),
+                running_process VARCHAR(255),
+                listen_port VARCHAR(255),
+                FOREIGN KEY (agent_id) REFERENCES agents(agent_id)
+            )
+        ''')
+
+def seed_defaults(cursor):
+    # Create the default admin user if it doesn't exist
+    query = 'SELECT * FROM users WHERE username = %s' if DB_TYPE == 'mysql' else 'SELECT * FROM users WHERE username = ?'
+    cursor.execute(query, ('admin',))
+    admin_user = cursor.fetchone()
+
+    if not admin_user:
+        # Hash the default admin password
+        hashed_password = generate_password_hash('admin', method='pbkdf2:sha256')
+        query = '''
+            INSERT INTO users (user_id, username, email, password, role)
+            VALUES (%s, %s, %s, %s, %s)
+        ''' if DB_TYPE == 'mysql' else '''
+            INSERT INTO users (user_id, username, email, password, role)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        cursor.execute(query, (str(uuid.uuid4()), 'admin', 'admin@admin.com', hashed_password, 'admin'))
+
+    defaults = {
+        'llm': {
+            'provider': 'openai',  # Default provider
+            'api_key': 'your_openai_api_key',
+            'model': 'gpt-4o',  # Default model
+            'temperature': 0.7,  # Default temperature
+            'azure': {
+                'api_version': '2023-12-01-preview',
+                'endpoint': 'https://your-resource-name.openai.azure.com',
+                'api_key': 'your_azure_openai_api_key'
+            }
+        },
+        'embedding': {
+            'provider': 'openai',  # Default provider
+            'api_key': 'your_openai_api_key',
+            'model': 'text-embedding-ada-002',  # Default model
+            'azure': {
+                'api_version': '2024-05-01-preview',
+                'endpoint': 'https://your-resource-name.openai.azure.com',
+                'api_key': 'your_azure_openai_api_key'
+            }
+        }
+    }
+
+    select_query = 'SELECT key_value FROM api_keys WHERE key_name = %s' if DB_TYPE == 'mysql' else 'SELECT key_value FROM api_keys WHERE key_name = ?'
+    upsert_query = '''
+        INSERT INTO api_keys (key_name, key_value)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE key_value = VALUES(key_value)
+    ''' if DB_TYPE == 'mysql' else '''
+        INSERT INTO api_keys (key_name, key_value)
+        VALUES (?, ?)
+        ON CONFLICT(key_name)
+        DO UPDATE SET key_value = excluded.key_value
+    '''
+    # Insert the LLM and embedding configuration if it's empty
+    for key_name, config in defaults.items():
+        cursor.execute(select_query, (key_name,))
+        row = cursor.fetchone()
+        if not row or not row['key_value']:
+            cursor.execute(upsert_query, (key_name, json.dumps(config)))
+
+def create_index(cursor, name, table, columns):
+    # MySQL has no CREATE INDEX IF NOT EXISTS; the version table guarantees it only runs once there
+    if DB_TYPE == 'mysql':
+        cursor.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+    else:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+def add_hot_path_indexes(cursor):
+    # Task history per agent and overall, newest first
+    create_index(cursor, 'idx_completed_tasks_agent_completed', 'completed_tasks', 'agent_id, completed_at')
+    create_index(cursor, 'idx_completed_tasks_completed', 'completed_tasks', 'completed_at')
+    # Liveness checks scan agents by status and heartbeat age
+    create_index(cursor, 'idx_agents_status_last_update', 'agents', 'status, last_update_date')
+    # PAT listing and counting per user
+    create_index(cursor, 'idx_user_pats_user', 'user_pats', 'user_id')
+
+def add_task_history_indexes(cursor):
+    # Keyset pagination over (completed_at, task_id), optionally filtered by submitter or status
+    create_index(cursor, 'idx_completed_tasks_completed_task', 'completed_tasks', 'completed_at, task_id')
+    create_index(cursor, 'idx_completed_tasks_submitter_completed', 'completed_tasks', 'submitted_by, completed_at')
+    create_index(cursor, 'idx_completed_tasks_status_completed', 'completed_tasks', 'status, completed_at')
+
+def add_output_encoding(cursor):
+    # Large outputs are stored compressed; output_encoding says how to read the column back
+    if DB_TYPE == 'mysql':
+        cursor.execute("ALTER TABLE completed_tasks ADD COLUMN output_encoding VARCHAR(32) NOT NULL DEFAULT ''")
+        cursor.execute('ALTER TABLE completed_tasks MODIFY output MEDIUMTEXT')
+    else:
+        cursor.execute("ALTER TABLE completed_tasks ADD COLUMN output_encoding TEXT NOT NULL DEFAULT ''")
+
+def add_agent_registry(cursor):
+    # Free-form labels for filtering the fleet, many per agent
+    if DB_TYPE == 'mysql':
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agent_tags (
+                agent_id VARCHAR(255) NOT NULL,
+                tag VARCHAR(255) NOT NULL,
+                PRIMARY KEY (agent_id, tag)
+            )
+        ''')
+    else:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agent_tags (
+                agent_id TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                PRIMARY KEY (agent_id, tag)
+            )
+        ''')
+    create_index(cursor, 'idx_agent_tags_tag', 'agent_tags', 'tag, agent_id')
+    # Keyset pagination of the agent registry on each sort column, with agent_id as tie-breaker.
+    # Names and IPs are never NULL from here on so they compare in cursors.
+    cursor.execute("UPDATE agents SET computer_name = '' WHERE computer_name IS NULL")
+    cursor.execute("UPDATE agents SET private_ip = '' WHERE private_ip IS NULL")
+    create_index(cursor, 'idx_agents_computer_name', 'agents', 'computer_name, agent_id')
+    create_index(cursor, 'idx_agents_private_ip', 'agents', 'private_ip, agent_id')
+    create_index(cursor, 'idx_agents_last_update', 'agents', 'last_update_date, agent_id')
+    create_index(cursor, 'idx_agents_os_type', 'agents', 'os_type, agent_id')
+
+# Ordered list of (version, description, migration). Never edit or reorder an applied entry;
+# append a new one instead.
+MIGRATIONS = [
+    (1, 'Create base tables', create_base_tables),
+    (2, 'Seed default admin user and LLM configuration', seed_defaults),
+    (3, 'Add indexes for task history, agent liveness and PAT lookups', add_hot_path_indexes),
+    (4, 'Add indexes for paginated task history', add_task_history_indexes),
+    (5, 'Add output encoding for compressed task output', add_output_encoding),
+    (6, 'Add agent tags and indexes for the agent registry query', add_agent_registry),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def create_schema_version_table(cursor):
+    if DB_TYPE == 'mysql':
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    else:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+def get_schema_version():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT MAX(version) AS version FROM schema_version')
+        row = cursor.fetchone()
+        return (row['version'] or 0) if row else 0
+    except Exception:
+        # The version table doesn't exist yet, so nothing has been applied
+        return 0
+    finally:
+        conn.close()
+
+def run_migrations():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if DB_TYPE == 'mysql':
+            cursor.execute('SELECT GET_LOCK(%s, 60) AS acquired', (MIGRATION_LOCK,))
+            if not cursor.fetchone()['acquired']:
+                raise RuntimeError("Timed out waiting for another migration run to finish")
+
+        try:
+            create_schema_version_table(cursor)
+            conn.commit()
+
+            cursor.execute('SELECT version FROM schema_version')
+            applied = {row['version'] for row in cursor.fetchall()}
+
+            insert_query = 'INSERT INTO schema_version (version, description) VALUES (%s, %s)' if DB_TYPE == 'mysql' else 'INSERT INTO schema_version (version, description) VALUES (?, ?)'
+            for version, description, migration in MIGRATIONS:
+                if version in applied:
+                    continue
+                logging.info(f"Applying migration {version}: {description}")
+                migration(cursor)
+                cursor.execute(insert_query, (version, description))
+                conn.commit()
+        finally:
+            if DB_TYPE == 'mysql':
+                cursor.execute('SELECT RELEASE_LOCK(%s)', (MIGRATION_LOCK,))
+    finally:
+        conn.close()
+
+    logging.info(f"Database schema is at version {LATEST_VERSION}")
+
+# Run migrations, retrying while the database is still starting up (e.g. in docker-compose)
+def run_migrations_with_retry(retries=0, delay=2):
+    for attempt in range(retries + 1):
+        try:
+            run_migrations()
+            return
+        except Exception as e:
+            if attempt == retries:
+                raise
+            logging.warning(f"Migration attempt {attempt + 1} failed: {e}. Retrying in {delay}s...")
+            time.sleep(delay)
+
+# Cheap startup check for workers: compare the stored version against the code's latest
+def check_schema_version():
+    version = get_schema_version()
+    if version < LATEST_VERSION:
+        logging.error(f"Database schema is at version {version} but {LATEST_VERSION} is required. Run 'python manage.py migrate'.")
+        return False
+    return True
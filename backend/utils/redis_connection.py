@@ -1,9 +1,14 @@
 import os
 from redis import Redis
+from redis.commands.core import Script
 from utils.db import get_db_connection
+from utils.config_cache import get_cached
 
-# Get Redis configuration from the database
+# Get Redis configuration from the database (cached per process)
 def get_redis_config_from_db():
+    return get_cached('config', 'redis', load_redis_config_from_db)
+
+def load_redis_config_from_db():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT config_key, config_value FROM config WHERE config_key IN ("redis_host", "redis_port", "redis_password")')
@@ -41,3 +46,8 @@ def get_redis_url():
         redis_port = int(redis_config.get('redis_port', 6379))
         redis_password = redis_config.get('redis_password', None)
         return f'redis://:{redis_password}@{redis_host}:{redis_port}/0' if redis_password else f'redis://{redis_host}:{redis_port}/0'
+
+# Lua script loaded once per process and run on whichever connection is passed as client=.
+# The SHA is computed from the source here, and redis-py loads the script on its first NOSCRIPT.
+def load_script(source):
+    return Script(None, source.encode())
@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from datetime import datetime
+from utils.db import get_api_key
+from utils.redis_connection import get_redis_connection, load_script
+
+logging.basicConfig(level=logging.INFO)
+
+redis = get_redis_connection()
+
+# Generated scripts, keyed by the normalized command, os_type, LLM model and prompt version so a
+# model or template change never serves a script produced by the old one. A script is only
+# stored once an operator approves a task that runs it, and dropped again when one is rejected,
+# so a rejected script is regenerated on resubmission instead of served from the cache. Entries
+# expire SCRIPT_CACHE_TTL seconds after their last hit, so commands that keep coming back stay
+# cached.
+SCRIPT_CACHE_TTL = int(os.getenv('SCRIPT_CACHE_TTL', 604800))
+
+# Bump whenever bash_template or powershell_template change
+SCRIPT_PROMPT_VERSION = 1
+
+# Pinned scripts are approved by an operator and never expire. They are keyed by command and
+# os_type only, so they keep answering across model and prompt changes.
+PINNED_SET = 'script_cache:pinned'
+STATS_KEY = 'script_cache:stats'
+ENTRY_PREFIX = 'script_cache:entry:'
+PINNED_PREFIX = 'script_cache:pin:'
+
+# Delete a cached entry only if it still holds the given script
+# KEYS[1] entry key; ARGV[1] script
+EVICT_SCRIPT = load_script("""
+if redis.call('HGET', KEYS[1], 'script') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+# Only whitespace is normalized: paths, service names and arguments are often case sensitive
+def normalize_command(command_text):
+    return re.sub(r'\s+', ' ', command_text).strip()
+
+def current_model():
+    llm_config = get_api_key('llm')
+    if not llm_config:
+        return ''
+    config = json.loads(llm_config)
+    return f"{config.get('provider')}:{config.get('model', 'gpt-4o')}"
+
+def pin_hash(command_text, os_type):
+    key = json.dumps([normalize_command(command_text), os_type.lower()])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def entry_hash(command_text, os_type, model):
+    key = json.dumps([normalize_command(command_text), os_type.lower(), model, SCRIPT_PROMPT_VERSION])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def get_script(command_text, os_type):
+    pinned_key = PINNED_PREFIX + pin_hash(command_text, os_type)
+    entry_key = ENTRY_PREFIX + entry_hash(command_text, os_type, current_model())
+    pipe = redis.pipeline()
+    pipe.hget(pinned_key, 'script')
+    pipe.hget(entry_key, 'script')
+    pinned, cached = pipe.execute()
+
+    pipe = redis.pipeline()
+    if pinned is not None:
+        pipe.hincrby(STATS_KEY, 'pinned_hits', 1)
+        pipe.hincrby(pinned_key, 'hits', 1)
+        script = pinned.decode()
+    elif cached is not None:
+        pipe.hincrby(STATS_KEY, 'hits', 1)
+        pipe.hincrby(entry_key, 'hits', 1)
+        pipe.expire(entry_key, SCRIPT_CACHE_TTL)
+        script = cached.decode()
+    else:
+        pipe.hincrby(STATS_KEY, 'misses', 1)
+        script = None
+    pipe.execute()
+    return script
+
+def store_script(command_text, os_type, script):
+    model = current_model()
+    entry_key = ENTRY_PREFIX + entry_hash(command_text, os_type, model)
+    pipe = redis.pipeline()
+    pipe.hset(entry_key, mapping={
+        "command": normalize_command(command_text),
+        "os_type": os_type.lower(),
+        "model": model,
+        "prompt_version": SCRIPT_PROMPT_VERSION,
+        "script": script
+    })
+    # Approving a task that was served from the cache keeps the entry's history
+    pipe.hsetnx(entry_key, 'created_at', datetime.now().isoformat())
+    pipe.hsetnx(entry_key, 'hits', 0)
+    pipe.expire(entry_key, SCRIPT_CACHE_TTL)
+    pipe.execute()
+
+def evict_script(command_text, os_type, script):
+    entry_key = ENTRY_PREFIX + entry_hash(command_text, os_type, current_model())
+    return bool(EVICT_SCRIPT(keys=[entry_key], args=[script], client=redis))
+
+def pin_script(command_text, os_type, script, pinned_by, task_id=None):
+    script_hash = pin_hash(command_text, os_type)
+    pinned = {
+        "command": normalize_command(command_text),
+        "os_type": os_type.lower(),
+        "script": script,
+        "pinned_by": pinned_by,
+        "pinned_at": datetime.now().isoformat(),
+        "task_id": task_id or "",
+        "hits": 0
+    }
+    pipe = redis.pipeline()
+    pipe.delete(PINNED_PREFIX + script_hash)
+    pipe.hset(PINNED_PREFIX + script_hash, mapping=pinned)
+    pipe.sadd(PINNED_SET, script_hash)
+    pipe.execute()
+    logging.info(f"Pinned script for '{pinned['command']}' ({pinned['os_type']}) by {pinned_by}")
+    return script_hash
+
+def unpin_script(script_hash):
+    pipe = redis.pipeline()
+    pipe.delete(PINNED_PREFIX + script_hash)
+    pipe.srem(PINNED_SET, script_hash)
+    deleted, _ = pipe.execute()
+    return bool(deleted)
+
+def get_pinned_scripts():
+    script_hashes = [script_hash.decode() for script_hash in redis.smembers(PINNED_SET)]
+    pipe = redis.pipeline()
+    for script_hash in script_hashes:
+        pipe.hgetall(PINNED_PREFIX + script_hash)
+    pinned = []
+    for script_hash, data in zip(script_hashes, pipe.execute()):
+        if data:
+            entry = {k.decode(): v.decode() for k, v in data.items()}
+            entry['hash'] = script_hash
+            entry['hits'] = int(entry.get('hits', 0))
+            pinned.append(entry)
+    return sorted(pinned, key=lambda entry: entry['pinned_at'])
+
+# Drop every generated script. Pinned scripts stay unless include_pinned is set.
+def purge_scripts(include_pinned=False):
+    count = 0
+    batch = []
+    for key in redis.scan_iter(match=ENTRY_PREFIX + '*', count=500):
+        batch.append(key)
+        if len(batch) >= 500:
+            count += redis.delete(*batch)
+            batch = []
+    if batch:
+        count += redis.delete(*batch)
+
+    if include_pinned:
+        script_hashes = [script_hash.decode() for script_hash in redis.smembers(PINNED_SET)]
+        pipe = redis.pipeline()
+        for script_hash in script_hashes:
+            pipe.delete(PINNED_PREFIX + script_hash)
+        pipe.delete(PINNED_SET)
+        count += sum(pipe.execute()[:-1])
+    logging.info(f"Purged {count} cached script(s)")
+    return count
+
+def get_cache_stats():
+    stats = redis.hgetall(STATS_KEY)
+    hits = int(stats.get(b'hits', 0))
+    pinned_hits = int(stats.get(b'pinned_hits', 0))
+    misses = int(stats.get(b'misses', 0))
+    lookups = hits + pinned_hits + misses
+    return {
+        "hits": hits,
+        "pinned_hits": pinned_hits,
+        "misses": misses,
+        "hit_rate": round((hits + pinned_hits) / lookups, 4) if lookups else 0,
+        "pinned_scripts": redis.scard(PINNED_SET),
+        "ttl": SCRIPT_CACHE_TTL,
+        "prompt_version": SCRIPT_PROMPT_VERSION
+    }
+
+def reset_cache_stats():
+    redis.delete(STATS_KEY)
@@ -5,6 +5,7 @@ import threading
 from time import sleep
 from utils.redis_connection import get_redis_connection
 from utils.db import get_db_connection, get_api_key, DB_TYPE
+from utils.config_cache import get_cached, publish_invalidation
 
 logging.basicConfig(level=logging.INFO)
 
@@ -34,11 +35,15 @@ def save_slack_service_hook(db_conn, webhook_url):
     '''
     cursor.execute(query, ('slack_webhook_url', webhook_url))
     db_conn.commit()
+    publish_invalidation('api_keys', 'slack_webhook_url')
 
 def get_slack_service_hook():
     return get_api_key('slack_webhook_url')
 
 def get_notification_settings():
+    return get_cached('config', 'slack_notification_settings', load_notification_settings)
+
+def load_notification_settings():
     conn = get_db_connection()
     cursor = conn.cursor()
     query = 'SELECT config_key, config_value FROM config WHERE config_key LIKE %s' if DB_TYPE == 'mysql' else 'SELECT config_key, config_value FROM config WHERE config_key LIKE ?'
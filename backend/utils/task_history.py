@@ -0,0 +1,100 @@
+import json
+import base64
+from datetime import datetime
+from utils.db import get_db_connection, DB_TYPE
+from utils.task_output import decode_output
+
+# Columns a caller may request from completed_tasks
+HISTORY_FIELDS = [
+    'task_id', 'agent_id', 'input', 'script_code', 'status',
+    'submitted_at', 'approved_at', 'completed_at',
+    'output', 'error', 'interpretation',
+    'submitted_by', 'approved_by', 'rejected_by'
+]
+# List views get everything except the large script/output columns unless they ask for them
+DEFAULT_HISTORY_FIELDS = [
+    'task_id', 'agent_id', 'input', 'status',
+    'submitted_at', 'approved_at', 'completed_at',
+    'submitted_by', 'approved_by'
+]
+MAX_HISTORY_LIMIT = 500
+
+def encode_cursor(completed_at, task_id):
+    payload = json.dumps([serialize_value(completed_at), task_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        completed_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    return completed_at, task_id
+
+def serialize_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def parse_fields(fields_param):
+    if not fields_param:
+        return list(DEFAULT_HISTORY_FIELDS)
+    fields = [field.strip() for field in fields_param.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+# Keyset-paginated read over completed_tasks, newest first, ordered by (completed_at, task_id).
+# Returns (tasks, next_cursor); next_cursor is None on the last page.
+def query_task_history(fields, limit=50, cursor=None, agent_id=None, submitted_by=None, status=None, since=None, until=None):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    conditions = ['completed_at IS NOT NULL']
+    params = []
+
+    for column, value in (('agent_id', agent_id), ('submitted_by', submitted_by), ('status', status)):
+        if value:
+            conditions.append(f'{column} = {placeholder}')
+            params.append(value)
+    if since:
+        conditions.append(f'completed_at >= {placeholder}')
+        params.append(since)
+    if until:
+        conditions.append(f'completed_at < {placeholder}')
+        params.append(until)
+    if cursor:
+        cursor_completed_at, cursor_task_id = decode_cursor(cursor)
+        conditions.append(f'(completed_at < {placeholder} OR (completed_at = {placeholder} AND task_id < {placeholder}))')
+        params.extend([cursor_completed_at, cursor_completed_at, cursor_task_id])
+
+    # The sort key is always selected so the next cursor can be built from the last row, and the
+    # output encoding whenever output is, so compressed output can be decoded
+    columns = list(dict.fromkeys(fields + ['completed_at', 'task_id'] + (['output_encoding'] if 'output' in fields else [])))
+    query = f'''
+        SELECT {', '.join(columns)} FROM completed_tasks
+        WHERE {' AND '.join(conditions)}
+        ORDER BY completed_at DESC, task_id DESC
+        LIMIT {placeholder}
+    '''
+    params.append(limit + 1)
+
+    conn = get_db_connection()
+    try:
+        db_cursor = conn.cursor()
+        db_cursor.execute(query, params)
+        rows = db_cursor.fetchall()
+        db_cursor.close()
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['completed_at'], rows[-1]['task_id'])
+
+    tasks = []
+    for row in rows:
+        task = {field: serialize_value(row[field]) for field in fields}
+        if 'output' in task:
+            task['output'] = decode_output(row['output'], row['output_encoding'])
+        tasks.append(task)
+    return tasks, next_cursor
@@ -0,0 +1,93 @@
+import os
+import time
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+# Agent ids are published here whenever a task lands on their queue, so long-polling requests
+# wake up immediately. Every process holds a single subscription and fans messages out to its
+# local waiters, so thousands of idle polls cost no Redis connections of their own.
+TASK_READY_CHANNEL = 'task_ready'
+
+# Seconds /poll-task waits for a task when the agent doesn't pass a timeout
+TASK_POLL_TIMEOUT = float(os.getenv('TASK_POLL_TIMEOUT', 25))
+TASK_POLL_MAX_TIMEOUT = float(os.getenv('TASK_POLL_MAX_TIMEOUT', 60))
+
+# A token is pushed onto result_ready:{task_id} once a task's result is final (reported and
+# interpreted). Waiters block on the list with BLPOP, and since the token stays until the key
+# expires, a result that lands before the waiter starts is not missed.
+RESULT_READY_TTL = 300
+RESULT_WAIT_TIMEOUT = int(os.getenv('RESULT_WAIT_TIMEOUT', 50))
+
+_waiters = {}
+_lock = threading.Lock()
+_listener_pid = None
+
+
+def wake_waiters(agent_id):
+    with _lock:
+        events = list(_waiters.get(agent_id, ()))
+    for event in events:
+        event.set()
+
+
+def listen_for_ready_tasks():
+    from utils.redis_connection import get_redis_connection
+    while True:
+        try:
+            pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(TASK_READY_CHANNEL)
+            for message in pubsub.listen():
+                wake_waiters(message['data'].decode())
+        except Exception as e:
+            logging.error(f"Task ready listener error: {e}")
+            time.sleep(5)
+
+
+def ensure_ready_listener():
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+        _waiters.clear()
+    listener_thread = threading.Thread(target=listen_for_ready_tasks, name='task-ready-listener')
+    listener_thread.daemon = True
+    listener_thread.start()
+
+
+# Register interest in an agent's queue. Register before checking the queue and wait on the
+# returned event afterwards, so a task approved in between is not missed.
+def add_waiter(agent_id):
+    ensure_ready_listener()
+    event = threading.Event()
+    with _lock:
+        _waiters.setdefault(agent_id, set()).add(event)
+    return event
+
+
+def remove_waiter(agent_id, event):
+    with _lock:
+        events = _waiters.get(agent_id)
+        if events:
+            events.discard(event)
+            if not events:
+                del _waiters[agent_id]
+
+
+def result_ready_key(task_id):
+    return f'result_ready:{task_id}'
+
+
+def notify_result_ready(pipe, task_id):
+    pipe.rpush(result_ready_key(task_id), 1)
+    pipe.expire(result_ready_key(task_id), RESULT_READY_TTL)
+
+
+# Block until the task's result is final or the deadline passes; returns False on timeout
+def wait_for_result(redis, task_id, timeout=RESULT_WAIT_TIMEOUT):
+    return redis.blpop(result_ready_key(task_id), timeout=max(1, int(timeout))) is not None
@@ -0,0 +1,55 @@
+import os
+import zlib
+import base64
+
+# Script output above OUTPUT_COMPRESS_THRESHOLD bytes is stored zlib-compressed (base64, so it
+# fits the JSON passed to the Lua scripts and the TEXT column) in result:{id} and
+# completed_tasks.output, with output_encoding recording how to read it back. Output beyond
+# OUTPUT_MAX_BYTES is cut off with a truncation marker before it is stored.
+OUTPUT_COMPRESS_THRESHOLD = int(os.getenv('OUTPUT_COMPRESS_THRESHOLD', 8192))
+OUTPUT_MAX_BYTES = int(os.getenv('OUTPUT_MAX_BYTES', 1048576))
+OUTPUT_ENCODING = 'zlib+base64'
+
+# Largest decompressed request body accepted from an agent sending gzip
+MAX_REQUEST_BYTES = OUTPUT_MAX_BYTES * 4
+
+def truncate_output(text):
+    data = text.encode()
+    if len(data) <= OUTPUT_MAX_BYTES:
+        return text
+    omitted = len(data) - OUTPUT_MAX_BYTES
+    return data[:OUTPUT_MAX_BYTES].decode(errors='ignore') + f"\n... [output truncated: {omitted} of {len(data)} bytes omitted]"
+
+# Returns (stored value, output_encoding); the encoding is '' for plain text
+def encode_output(text):
+    text = text or ""
+    data = text.encode()
+    if len(data) < OUTPUT_COMPRESS_THRESHOLD:
+        return text, ''
+    encoded = base64.b64encode(zlib.compress(data)).decode()
+    if len(encoded) >= len(data):
+        return text, ''
+    return encoded, OUTPUT_ENCODING
+
+def decode_output(value, encoding):
+    if encoding == OUTPUT_ENCODING and value:
+        return zlib.decompress(base64.b64decode(value)).decode()
+    return value or ""
+
+# Cap and encode the output of a result dict about to be stored
+def encode_result(result):
+    output, encoding = encode_output(truncate_output(result.get('output') or ""))
+    return dict(result, output=output, output_encoding=encoding)
+
+# Decode the output of a stored result or task dict in place, dropping the encoding field
+def decode_result(result):
+    result['output'] = decode_output(result.get('output'), result.pop('output_encoding', ''))
+    return result
+
+# Body of a request an agent may have sent with Content-Encoding: gzip
+def decompress_request_body(body):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(body, MAX_REQUEST_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Decompressed request body is too large")
+    return data
@@ -0,0 +1,161 @@
+import json
+import uuid
+import logging
+from datetime import datetime
+from croniter import croniter
+from redis.exceptions import WatchError
+from utils.agent_cache import get_agents_by_id, query_agents
+from utils.task_notify import TASK_READY_CHANNEL
+from utils.task_store import FETCH_BATCH_SIZE, task_key, task_queue_key, write_task, index_task
+
+logging.basicConfig(level=logging.INFO)
+
+# A schedule runs one command on a cron expression, on a list of agents or on whichever agents
+# match its selector when it comes due. It is reviewed once like a fleet job, with the scripts
+# generated at submission; after approval the scheduler creates its tasks already approved at
+# every run. Due times are kept in SCHEDULES_DUE, so each tick only reads the schedules that
+# are due. Runs missed while the scheduler was down are skipped rather than made up.
+SCHEDULES = 'schedules'  # SET of schedule_ids
+SCHEDULES_DUE = 'schedules:due'  # ZSET schedule_id -> next run
+
+def schedule_key(schedule_id):
+    return f'schedule:{schedule_id}'
+
+def is_valid_cron(expression):
+    return croniter.is_valid(expression)
+
+def next_run(expression, after):
+    return croniter(expression, after).get_next(datetime)
+
+def create_pending_schedule(pipe, schedule, notification_key, notification):
+    pipe.set(schedule_key(schedule['schedule_id']), json.dumps(schedule))
+    pipe.sadd(SCHEDULES, schedule['schedule_id'])
+    pipe.rpush(notification_key, json.dumps(notification))
+
+def get_schedules(redis):
+    schedule_ids = redis.smembers(SCHEDULES)
+    if not schedule_ids:
+        return []
+    schedules = [json.loads(data) for data in redis.mget([schedule_key(schedule_id.decode()) for schedule_id in schedule_ids]) if data]
+    return sorted(schedules, key=lambda schedule: schedule['submitted_at'])
+
+# Approve or reject a pending schedule. Approval puts it on the due ZSET at its next run.
+# Returns (outcome, schedule) like the task transitions.
+def decide_schedule(redis, schedule_id, status, updates):
+    key = schedule_key(schedule_id)
+    with redis.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                data = pipe.get(key)
+                if not data:
+                    return 'not_found', None
+                schedule = json.loads(data)
+                if schedule['status'] != 'pending':
+                    return 'conflict', schedule
+                schedule.update(updates, status=status)
+                pipe.multi()
+                if status == 'approved':
+                    run_at = next_run(schedule['cron'], datetime.now())
+                    schedule['next_run_at'] = run_at.isoformat()
+                    pipe.zadd(SCHEDULES_DUE, {schedule_id: run_at.timestamp()})
+                pipe.set(key, json.dumps(schedule))
+                pipe.execute()
+                return 'ok', schedule
+            except WatchError:
+                continue
+
+def delete_schedule(redis, schedule_id):
+    pipe = redis.pipeline()
+    pipe.delete(schedule_key(schedule_id))
+    pipe.srem(SCHEDULES, schedule_id)
+    pipe.zrem(SCHEDULES_DUE, schedule_id)
+    deleted, _, _ = pipe.execute()
+    return bool(deleted)
+
+def schedule_agents(schedule):
+    if schedule.get('agent_ids'):
+        return [agent for agent in get_agents_by_id(schedule['agent_ids']).values() if agent]
+    selector = schedule.get('selector') or {}
+    return query_agents(os_type=selector.get('os_type'), status=selector.get('status'))
+
+# Create one run of a schedule. Agents still holding an unfinished task from the previous run
+# are skipped, so an offline agent doesn't pile up a backlog of the same check.
+def run_schedule(redis, schedule_id, now):
+    key = schedule_key(schedule_id)
+    with redis.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            data = pipe.get(key)
+            if not data:
+                pipe.multi()
+                pipe.zrem(SCHEDULES_DUE, schedule_id)
+                pipe.execute()
+                return 0
+            schedule = json.loads(data)
+            agents = schedule_agents(schedule)
+
+            last_tasks = schedule.get('last_tasks') or {}
+            previous = [(agent['agent_id'], last_tasks[agent['agent_id']]) for agent in agents if agent['agent_id'] in last_tasks]
+            statuses = redis.pipeline(transaction=False)
+            for _, task_id in previous:
+                statuses.hget(task_key(task_id), 'status')
+            busy = {agent_id for (agent_id, _), status in zip(previous, statuses.execute()) if status == b'approved'}
+
+            timestamp = now.isoformat()
+            tasks = []
+            for agent in agents:
+                script_code = schedule['scripts'].get(agent['os_type'])
+                if agent['agent_id'] in busy or not script_code:
+                    continue
+                tasks.append({
+                    "task_id": str(uuid.uuid4()),
+                    "schedule_id": schedule_id,
+                    "input": schedule['input'],
+                    "script_code": script_code,
+                    "agent_id": agent['agent_id'],
+                    "timestamp": timestamp,
+                    "status": "approved",
+                    "submitted_at": timestamp,
+                    "submitted_by": schedule['submitted_by'],
+                    "approved_at": timestamp,
+                    "approved_by": schedule['approved_by'],
+                    "priority": schedule['priority']
+                })
+            skipped = len(agents) - len(busy) - len(tasks)
+            if busy or skipped:
+                logging.info(f"Schedule {schedule_id}: skipped {len(busy)} agent(s) with a task still queued and {skipped} without a script for their OS")
+
+            run_at = next_run(schedule['cron'], now)
+            last_tasks = {agent_id: task_id for agent_id, task_id in last_tasks.items() if agent_id in busy}
+            last_tasks.update({task['agent_id']: task['task_id'] for task in tasks})
+            schedule.update(last_run_at=timestamp, next_run_at=run_at.isoformat(), run_count=schedule.get('run_count', 0) + 1, last_tasks=last_tasks)
+
+            pipe.multi()
+            for task in tasks:
+                write_task(pipe, task)
+                index_task(pipe, task)
+                pipe.lpush(task_queue_key(task['agent_id'], task['priority']), task['task_id'])
+                pipe.publish(TASK_READY_CHANNEL, task['agent_id'])
+            pipe.set(key, json.dumps(schedule))
+            pipe.zadd(SCHEDULES_DUE, {schedule_id: run_at.timestamp()})
+            pipe.execute()
+            return len(tasks)
+        except WatchError:
+            # Changed or deleted meanwhile, picked up again on the next tick if still due
+            return 0
+
+# Start every schedule that has come due, up to one batch per call. Returns the number of
+# schedules looked at.
+def run_due_schedules(redis):
+    now = datetime.now()
+    schedule_ids = redis.zrangebyscore(SCHEDULES_DUE, '-inf', now.timestamp(), start=0, num=FETCH_BATCH_SIZE)
+    for schedule_id in schedule_ids:
+        schedule_id = schedule_id.decode()
+        try:
+            created = run_schedule(redis, schedule_id, now)
+            if created:
+                logging.info(f"Schedule {schedule_id} queued {created} task(s)")
+        except Exception as e:
+            logging.error(f"Error running schedule {schedule_id}: {e}")
+    return len(schedule_ids)
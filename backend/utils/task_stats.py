@@ -0,0 +1,141 @@
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from utils.db import get_db_connection
+
+logging.basicConfig(level=logging.INFO)
+
+# Counters are hashes with total/success/failure fields, bumped atomically when a task
+# completes (see COMPLETE_SCRIPT in utils/task_transitions.py)
+GLOBAL_STATS_KEY = 'task_stats:global'
+STATS_FIELDS = ('total', 'success', 'failure')
+
+HOURLY_RETENTION_DAYS = int(os.getenv('TASK_STATS_HOURLY_RETENTION_DAYS', 8))
+DAILY_RETENTION_DAYS = int(os.getenv('TASK_STATS_DAILY_RETENTION_DAYS', 400))
+
+BUCKET_FORMATS = {
+    'hour': '%Y%m%d%H',
+    'day': '%Y%m%d',
+}
+BUCKET_STEPS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+DEFAULT_SERIES_POINTS = {
+    'hour': 24,
+    'day': 30,
+}
+MAX_SERIES_POINTS = 1000
+
+def agent_stats_key(agent_id):
+    return f'task_stats:agent:{agent_id}'
+
+def user_stats_key(username):
+    return f'task_stats:user:{username}'
+
+def bucket_stats_key(bucket, moment):
+    return f'task_stats:{bucket}:{moment.strftime(BUCKET_FORMATS[bucket])}'
+
+def parse_moment(timestamp):
+    if isinstance(timestamp, datetime):
+        return timestamp
+    if timestamp:
+        try:
+            return datetime.fromisoformat(str(timestamp))
+        except ValueError:
+            pass
+    return datetime.now()
+
+# Every counter key a completed task contributes to
+def stats_keys_for(agent_id, submitted_by, completed_at):
+    moment = parse_moment(completed_at)
+    keys = [GLOBAL_STATS_KEY, bucket_stats_key('hour', moment), bucket_stats_key('day', moment)]
+    if agent_id:
+        keys.append(agent_stats_key(agent_id))
+    if submitted_by:
+        keys.append(user_stats_key(submitted_by))
+    return keys
+
+def to_counts(data):
+    counts = {field: 0 for field in STATS_FIELDS}
+    for key, value in data.items():
+        key = key.decode() if isinstance(key, bytes) else key
+        if key in counts:
+            counts[key] = int(value)
+    return counts
+
+def get_task_stats(redis, agent_id=None, submitted_by=None, bucket=None, since=None, until=None):
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(GLOBAL_STATS_KEY)
+    if agent_id:
+        pipe.hgetall(agent_stats_key(agent_id))
+    if submitted_by:
+        pipe.hgetall(user_stats_key(submitted_by))
+
+    moments = []
+    if bucket:
+        if bucket not in BUCKET_FORMATS:
+            raise ValueError("bucket must be 'hour' or 'day'")
+        step = BUCKET_STEPS[bucket]
+        end = parse_moment(until) if until else datetime.now()
+        start = parse_moment(since) if since else end - step * (DEFAULT_SERIES_POINTS[bucket] - 1)
+        if (end - start) / step > MAX_SERIES_POINTS:
+            raise ValueError(f"Time range covers more than {MAX_SERIES_POINTS} buckets")
+        moment = start
+        while moment <= end:
+            moments.append(moment)
+            pipe.hgetall(bucket_stats_key(bucket, moment))
+            moment += step
+
+    replies = iter(pipe.execute())
+    stats = {"global": to_counts(next(replies))}
+    if agent_id:
+        stats["agent"] = to_counts(next(replies))
+    if submitted_by:
+        stats["user"] = to_counts(next(replies))
+    if bucket:
+        stats["series"] = [
+            {"bucket": moment.strftime(BUCKET_FORMATS[bucket]), **to_counts(next(replies))}
+            for moment in moments
+        ]
+    return stats
+
+# One-off rebuild of every counter from the completed_tasks table. Tasks completed since the
+# last Redis-to-DB sync are not in the table yet, so run this right after a sync cycle.
+def backfill_task_stats(redis, batch_size=1000):
+    logging.info("Backfilling task statistics from completed_tasks...")
+    counters = defaultdict(lambda: defaultdict(int))
+    count = 0
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT agent_id, submitted_by, error, completed_at FROM completed_tasks WHERE status = 'completed'")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                outcome = 'failure' if row['error'] else 'success'
+                for key in stats_keys_for(row['agent_id'], row['submitted_by'], row['completed_at']):
+                    counters[key]['total'] += 1
+                    counters[key][outcome] += 1
+                count += 1
+        cursor.close()
+    finally:
+        conn.close()
+
+    pipe = redis.pipeline()
+    for key in redis.scan_iter(match='task_stats:*', count=1000):
+        pipe.delete(key)
+    for key, values in counters.items():
+        pipe.hset(key, mapping=dict(values))
+        if key.startswith('task_stats:hour:'):
+            pipe.expire(key, HOURLY_RETENTION_DAYS * 86400)
+        elif key.startswith('task_stats:day:'):
+            pipe.expire(key, DAILY_RETENTION_DAYS * 86400)
+    pipe.execute()
+
+    logging.info(f"Backfilled statistics for {count} tasks into {len(counters)} counters")
+    return count
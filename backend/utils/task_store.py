@@ -0,0 +1,356 @@
+import os
+import json
+import logging
+from datetime import datetime
+from utils.db import get_db_connection, DB_TYPE
+from utils.task_stats import GLOBAL_STATS_KEY, to_counts
+from utils.task_output import encode_output, decode_output, decode_result
+
+logging.basicConfig(level=logging.INFO)
+
+# Secondary indexes over task:* / result:* kept up to date at write time so that read
+# paths never have to scan the keyspace.
+COMPLETED_INDEX = 'tasks:completed'  # ZSET task_id -> completed_at
+FAILED_INDEX = 'tasks:failed'  # SET of completed task_ids that reported an error
+PENDING_QUEUE = 'pending_tasks'  # LIST of task_ids awaiting review, newest first
+PENDING_JOBS = 'pending_jobs'  # LIST of fleet job_ids awaiting review, newest first
+INDEXES_BUILT_KEY = 'tasks:indexes_built'
+# Bump when a new index is added so existing deployments rebuild once on scheduler start
+INDEX_VERSION = 2
+
+# Number of tasks fetched per pipeline round trip when walking an index
+FETCH_BATCH_SIZE = 500
+
+# Completed tasks stay in Redis for TASK_HOT_TTL seconds after completion once they are
+# persisted to completed_tasks; older ones are read from the table. The scheduler prunes them
+# from the indexes and agent_tasks lists when the window ends, and the keys carry
+# TASK_PRUNE_GRACE extra seconds of TTL so they still go away if the scheduler is not running.
+TASK_HOT_TTL = int(os.getenv('TASK_HOT_TTL', 86400))
+TASK_PRUNE_GRACE = 3600
+# Seconds a task read back from the table is cached again in Redis (0 to disable)
+TASK_REWARM_TTL = int(os.getenv('TASK_REWARM_TTL', 3600))
+EXPIRING_INDEX = 'tasks:expiring'  # ZSET task_id -> end of its hot window
+
+# Tasks handed to an agent are leased: they sit in TASK_LEASES until the agent reports a result.
+# The scheduler puts tasks whose lease ran out back at the front of their queue, and completes
+# them with an error once the lease has expired TASK_LEASE_MAX_ATTEMPTS times.
+TASK_LEASES = 'task_leases'  # ZSET task_id -> lease deadline
+TASK_LEASE_TIMEOUT = int(os.getenv('TASK_LEASE_TIMEOUT', 300))
+TASK_LEASE_MAX_TIMEOUT = int(os.getenv('TASK_LEASE_MAX_TIMEOUT', 3600))
+TASK_LEASE_MAX_BATCH = int(os.getenv('TASK_LEASE_MAX_BATCH', 20))
+TASK_LEASE_MAX_ATTEMPTS = int(os.getenv('TASK_LEASE_MAX_ATTEMPTS', 3))
+
+# Approved tasks wait on one queue per agent and priority, and agents drain them in this order.
+# Tasks submitted with a run_at in the future wait in SCHEDULED_TASKS until the scheduler moves
+# them onto their queue.
+TASK_PRIORITIES = ('high', 'normal', 'low')
+SCHEDULED_TASKS = 'tasks:scheduled'  # ZSET task_id -> run_at
+
+def status_index_key(status):
+    return f'tasks:status:{status}'  # SET of task_ids
+
+def agent_index_key(agent_id):
+    return f'tasks:agent:{agent_id}'  # ZSET task_id -> submitted_at
+
+# Normal priority keeps the original task_queue:{agent_id} key
+def task_queue_key(agent_id, priority='normal'):
+    if priority == 'normal':
+        return f'task_queue:{agent_id}'  # LIST of approved task_ids, popped from the right
+    return f'task_queue:{agent_id}:{priority}'
+
+def pending_index_key(agent_id):
+    return f'pending_tasks:{agent_id}'  # LIST of the agent's task_ids awaiting review
+
+# A fleet job fans one command out to many agents; its child tasks are reviewed through the job
+def job_key(job_id):
+    return f'job:{job_id}'
+
+def job_tasks_key(job_id):
+    return f'job_tasks:{job_id}'  # LIST of the job's child task_ids
+
+# Tasks are hashes, so transitions write only the fields they change and readers fetch only the
+# fields they need. Queues and lists refer to tasks by id.
+def task_key(task_id):
+    return f'task:{task_id}'
+
+def to_hash_fields(task):
+    return {field: value if isinstance(value, str) else json.dumps(value) for field, value in task.items() if value is not None}
+
+def write_task(pipe, task):
+    pipe.hset(task_key(task['task_id']), mapping=to_hash_fields(task))
+
+# Queue a newly submitted task onto the global and per-agent review lists
+def add_pending(pipe, task):
+    pipe.lpush(PENDING_QUEUE, task['task_id'])
+    pipe.lpush(pending_index_key(task['agent_id']), task['task_id'])
+
+# Task hashes for task_ids in one pipelined round trip, skipping tasks that are gone
+def fetch_tasks(redis, task_ids):
+    pipe = redis.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.hgetall(task_key(task_id.decode() if isinstance(task_id, bytes) else task_id))
+    return [decode_hash(task_data) for task_data in pipe.execute() if task_data]
+
+# Pending tasks for one agent: one LRANGE on its own list and one pipelined read of the tasks
+def get_pending_tasks_for_agent(redis, agent_id):
+    task_ids = redis.lrange(pending_index_key(agent_id), 0, -1)
+    if not task_ids:
+        return []
+    return [task for task in fetch_tasks(redis, task_ids) if task.get('status') == 'pending']
+
+def to_score(timestamp):
+    if not timestamp:
+        return datetime.now().timestamp()
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    try:
+        return datetime.fromisoformat(str(timestamp)).timestamp()
+    except ValueError:
+        return datetime.now().timestamp()
+
+# Queue index updates for a task moving from old_status to its current status
+def index_task(pipe, task, old_status=None):
+    task_id = task['task_id']
+    status = task.get('status')
+    if old_status and old_status != status:
+        pipe.srem(status_index_key(old_status), task_id)
+    if status:
+        pipe.sadd(status_index_key(status), task_id)
+    if task.get('agent_id'):
+        pipe.zadd(agent_index_key(task['agent_id']), {task_id: to_score(task.get('submitted_at') or task.get('timestamp'))})
+    if status == 'completed':
+        pipe.zadd(COMPLETED_INDEX, {task_id: to_score(task.get('completed_at'))})
+
+def index_task_outcome(pipe, task_id, error):
+    if error:
+        pipe.sadd(FAILED_INDEX, task_id)
+    else:
+        pipe.srem(FAILED_INDEX, task_id)
+
+def decode_hash(data):
+    return {k.decode(): v.decode() for k, v in data.items()}
+
+# Fetch task and result hashes for task_ids in pipelined batches, merged like the
+# original KEYS-based readers did. Tasks whose task:* key is gone are skipped. Output is left as
+# stored (see decode_result) so the database sync can write it without recompressing.
+def fetch_tasks_with_results(redis, task_ids, status=None):
+    tasks = []
+    for start in range(0, len(task_ids), FETCH_BATCH_SIZE):
+        batch = [t.decode() if isinstance(t, bytes) else t for t in task_ids[start:start + FETCH_BATCH_SIZE]]
+        pipe = redis.pipeline(transaction=False)
+        for task_id in batch:
+            pipe.hgetall(task_key(task_id))
+            pipe.hgetall(f'result:{task_id}')
+        replies = pipe.execute()
+        for index in range(len(batch)):
+            task_data, result_data = replies[2 * index], replies[2 * index + 1]
+            if not task_data:
+                continue
+            task = decode_hash(task_data)
+            if status and task.get('status') != status:
+                continue
+            task.update(decode_hash(result_data))
+            tasks.append(task)
+    return tasks
+
+def get_completed_task_ids(redis, start=0, end=-1, newest_first=True):
+    if newest_first:
+        return redis.zrevrange(COMPLETED_INDEX, start, end)
+    return redis.zrange(COMPLETED_INDEX, start, end)
+
+def get_completed_tasks(redis, start=0, end=-1):
+    tasks = fetch_tasks_with_results(redis, get_completed_task_ids(redis, start, end), status='completed')
+    return [decode_result(task) for task in tasks]
+
+# Counted from the all-time counters, since the indexes only cover the hot window
+def get_task_outcome_counts(redis):
+    counts = to_counts(redis.hgetall(GLOBAL_STATS_KEY))
+    return counts['success'], counts['failure']
+
+# Start the hot window of tasks that have been persisted to completed_tasks
+def schedule_task_expiry(pipe, tasks):
+    now = datetime.now().timestamp()
+    for task in tasks:
+        expires_at = max(to_score(task.get('completed_at')) + TASK_HOT_TTL, now)
+        pipe.zadd(EXPIRING_INDEX, {task['task_id']: expires_at})
+        pipe.expireat(f"task:{task['task_id']}", int(expires_at + TASK_PRUNE_GRACE))
+        pipe.expireat(f"result:{task['task_id']}", int(expires_at + TASK_PRUNE_GRACE))
+
+# Drop tasks whose hot window has ended from Redis: their keys, index entries and their entry
+# in the agent's agent_tasks list. That list is ordered by completion, not by the end of the hot
+# window, so entries are removed by value.
+def prune_expired_tasks(redis):
+    task_ids = redis.zrangebyscore(EXPIRING_INDEX, '-inf', datetime.now().timestamp(), start=0, num=FETCH_BATCH_SIZE)
+    if not task_ids:
+        return 0
+    task_ids = [task_id.decode() for task_id in task_ids]
+    pipe = redis.pipeline(transaction=False)
+    agent_pipe = redis.pipeline(transaction=False)
+    for task_id in task_ids:
+        agent_pipe.hget(task_key(task_id), 'agent_id')
+    for task_id, agent_id in zip(task_ids, agent_pipe.execute()):
+        if agent_id:
+            agent_id = agent_id.decode()
+            pipe.zrem(agent_index_key(agent_id), task_id)
+            pipe.lrem(f'agent_tasks:{agent_id}', 0, task_id)
+        pipe.delete(task_key(task_id), f'result:{task_id}')
+        pipe.zrem(COMPLETED_INDEX, task_id)
+        pipe.srem(FAILED_INDEX, task_id)
+        pipe.srem(status_index_key('completed'), task_id)
+        pipe.zrem(EXPIRING_INDEX, task_id)
+    pipe.execute()
+    logging.info(f"Pruned {len(task_ids)} task(s) past their hot window from Redis")
+    return len(task_ids)
+
+def serialize_timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def task_from_row(row):
+    return {
+        "task_id": row['task_id'],
+        "agent_id": row['agent_id'],
+        "input": row['input'],
+        "script_code": row['script_code'],
+        "status": row['status'],
+        "submitted_at": serialize_timestamp(row['submitted_at']),
+        "approved_at": serialize_timestamp(row['approved_at']),
+        "completed_at": serialize_timestamp(row['completed_at']),
+        "output": decode_output(row['output'], row['output_encoding']),
+        "error": row['error'],
+        "interpretation": row['interpretation'],
+        "submitted_by": row['submitted_by'],
+        "approved_by": row['approved_by']
+    }
+
+def query_persisted_tasks(where='', params=(), limit=None):
+    query = f'SELECT * FROM completed_tasks {where} ORDER BY completed_at DESC'
+    if limit is not None:
+        query += f" LIMIT {'%s' if DB_TYPE == 'mysql' else '?'}"
+        params = tuple(params) + (limit,)
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return [task_from_row(row) for row in rows]
+
+# Read a task that has left Redis back from completed_tasks, caching it again for
+# TASK_REWARM_TTL seconds when rewarm is set. It is not put back into the indexes.
+def load_persisted_task(redis, task_id, rewarm=True):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    tasks = query_persisted_tasks(f'WHERE task_id = {placeholder}', (task_id,))
+    if not tasks:
+        return None
+    task = tasks[0]
+    if rewarm and TASK_REWARM_TTL > 0:
+        result_fields = ('output', 'error', 'interpretation')
+        task_data = {field: value for field, value in task.items() if field not in result_fields}
+        result = {field: task[field] or '' for field in result_fields}
+        result['output'], result['output_encoding'] = encode_output(task['output'])
+        result.update(input=task['input'], command=task['script_code'], interpretation_status='completed')
+        pipe = redis.pipeline()
+        pipe.delete(task_key(task_id), f'result:{task_id}')
+        write_task(pipe, task_data)
+        pipe.expire(task_key(task_id), TASK_REWARM_TTL)
+        pipe.hset(f'result:{task_id}', mapping=result)
+        pipe.expire(f'result:{task_id}', TASK_REWARM_TTL)
+        pipe.execute()
+    return task
+
+def hot_window_start():
+    return datetime.fromtimestamp(datetime.now().timestamp() - TASK_HOT_TTL).isoformat()
+
+# Up to limit persisted tasks completed before the hot window, optionally of one agent, newest
+# first. Tasks completed within the window are still in Redis, so their rows are not read.
+def query_cold_tasks(limit, agent_id=None):
+    placeholder = '%s' if DB_TYPE == 'mysql' else '?'
+    conditions = [f'completed_at < {placeholder}']
+    params = [hot_window_start()]
+    if agent_id:
+        conditions.append(f'agent_id = {placeholder}')
+        params.append(agent_id)
+    return query_persisted_tasks(f"WHERE {' AND '.join(conditions)}", params, limit)
+
+# One-off rebuild of every index from existing task:* and result:* keys, walking the
+# keyspace incrementally with SCAN so Redis is never blocked.
+def rebuild_task_indexes(redis):
+    logging.info("Rebuilding task indexes...")
+    count = 0
+    for key in redis.scan_iter(match='task:*', count=FETCH_BATCH_SIZE):
+        task_data = redis.hgetall(key)
+        if not task_data:
+            continue
+        task = decode_hash(task_data)
+        pipe = redis.pipeline(transaction=False)
+        index_task(pipe, task)
+        if task.get('status') == 'completed':
+            index_task_outcome(pipe, task['task_id'], redis.hget(f"result:{task['task_id']}", 'error'))
+        pipe.execute()
+        count += 1
+    rebuild_pending_indexes(redis)
+    redis.set(INDEXES_BUILT_KEY, INDEX_VERSION)
+    logging.info(f"Indexed {count} tasks")
+    return count
+
+# Split the global pending list into per-agent lists, keeping its newest-first order
+def rebuild_pending_indexes(redis):
+    for key in redis.scan_iter(match='pending_tasks:*', count=FETCH_BATCH_SIZE):
+        redis.delete(key)
+    task_ids = redis.lrange(PENDING_QUEUE, 0, -1)
+    for start in range(0, len(task_ids), FETCH_BATCH_SIZE):
+        batch = task_ids[start:start + FETCH_BATCH_SIZE]
+        agent_pipe = redis.pipeline(transaction=False)
+        for task_id in batch:
+            agent_pipe.hget(task_key(task_id.decode()), 'agent_id')
+        pipe = redis.pipeline(transaction=False)
+        for task_id, agent_id in zip(batch, agent_pipe.execute()):
+            if agent_id:
+                pipe.rpush(pending_index_key(agent_id.decode()), task_id)
+        pipe.execute()
+
+def ensure_task_indexes(redis):
+    built = redis.get(INDEXES_BUILT_KEY)
+    if not built or not built.isdigit() or int(built) < INDEX_VERSION:
+        rebuild_task_indexes(redis)
+
+# Convert task:* keys stored as JSON strings into hashes, and the task_queue:* and
+# agent_tasks:* lists holding task JSON into lists of task ids. Safe to run repeatedly; keys
+# already converted are left alone.
+def migrate_task_hashes(redis):
+    logging.info("Converting task records to hashes...")
+    tasks = 0
+    for key in redis.scan_iter(match='task:*', count=FETCH_BATCH_SIZE):
+        with redis.pipeline() as pipe:
+            pipe.watch(key)
+            if pipe.type(key) != b'string':
+                pipe.unwatch()
+                continue
+            task_data, ttl = pipe.get(key), pipe.pttl(key)
+            pipe.multi()
+            pipe.delete(key)
+            pipe.hset(key, mapping=to_hash_fields(json.loads(task_data)))
+            if ttl > 0:
+                pipe.pexpire(key, ttl)
+            pipe.execute()
+        tasks += 1
+
+    lists = 0
+    for pattern in ('task_queue:*', 'agent_tasks:*'):
+        for key in redis.scan_iter(match=pattern, count=FETCH_BATCH_SIZE):
+            with redis.pipeline() as pipe:
+                pipe.watch(key)
+                items = pipe.lrange(key, 0, -1)
+                if not any(item.startswith(b'{') for item in items):
+                    pipe.unwatch()
+                    continue
+                task_ids = [json.loads(item)['task_id'] if item.startswith(b'{') else item.decode() for item in items]
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *task_ids)
+                pipe.execute()
+            lists += 1
+    logging.info(f"Converted {tasks} task record(s) and {lists} task list(s)")
+    return tasks, lists
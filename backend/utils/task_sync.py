@@ -0,0 +1,112 @@
+import os
+import time
+import logging
+from redis.exceptions import ResponseError
+from utils.db import DB_TYPE
+from utils.db_writer import execute_write
+from utils.redis_connection import get_redis_connection
+from utils.task_store import COMPLETED_INDEX, fetch_tasks_with_results, schedule_task_expiry
+
+logging.basicConfig(level=logging.INFO)
+
+# Task ids whose completed_tasks row needs writing are appended to this stream when a task
+# completes and again when its interpretation lands. The scheduler reads it through a consumer
+# group, upserts each batch with one executemany and only then acknowledges and deletes the
+# entries, so the group's delivery position is the checkpoint and a crash replays the batch.
+TASK_EVENTS_STREAM = 'task_events'
+TASK_SYNC_GROUP = 'db_sync'
+TASK_SYNC_CONSUMER = 'scheduler'
+
+TASK_SYNC_BATCH_SIZE = int(os.getenv('TASK_SYNC_BATCH_SIZE', 500))
+TASK_SYNC_BLOCK_MS = 5000
+
+if DB_TYPE == 'mysql':
+    UPSERT_COMPLETED_TASK = '''
+        INSERT INTO completed_tasks (task_id, agent_id, input, script_code, status, submitted_at, approved_at, completed_at, output, output_encoding, error, interpretation, submitted_by, approved_by, rejected_by)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+        agent_id=VALUES(agent_id),
+        input=VALUES(input),
+        script_code=VALUES(script_code),
+        status=VALUES(status),
+        submitted_at=VALUES(submitted_at),
+        approved_at=VALUES(approved_at),
+        completed_at=VALUES(completed_at),
+        output=VALUES(output),
+        output_encoding=VALUES(output_encoding),
+        error=VALUES(error),
+        interpretation=VALUES(interpretation),
+        submitted_by=VALUES(submitted_by),
+        approved_by=VALUES(approved_by),
+        rejected_by=VALUES(rejected_by)
+    '''
+else:  # sqlite
+    UPSERT_COMPLETED_TASK = '''
+        INSERT OR REPLACE INTO completed_tasks (task_id, agent_id, input, script_code, status, submitted_at, approved_at, completed_at, output, output_encoding, error, interpretation, submitted_by, approved_by, rejected_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+
+def add_task_event(pipe, task_id, event):
+    pipe.xadd(TASK_EVENTS_STREAM, {'task_id': task_id, 'event': event})
+
+# Create the consumer group on first start. Completed tasks from before the stream existed are
+# queued once so the table catches up with them.
+def ensure_sync_group(redis):
+    try:
+        redis.xgroup_create(TASK_EVENTS_STREAM, TASK_SYNC_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+        return
+    count = 0
+    pipe = redis.pipeline(transaction=False)
+    for task_id, _ in redis.zscan_iter(COMPLETED_INDEX, count=TASK_SYNC_BATCH_SIZE):
+        add_task_event(pipe, task_id, 'backfill')
+        count += 1
+        if count % TASK_SYNC_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+    if count:
+        logging.info(f"Queued {count} existing completed task(s) for database sync")
+
+def sync_task_events(redis, entries):
+    task_ids = list(dict.fromkeys(fields[b'task_id'].decode() for _, fields in entries))
+    tasks = fetch_tasks_with_results(redis, task_ids, status='completed')
+    rows = []
+    for task in tasks:
+        rows.append((
+            task['task_id'], task['agent_id'], task['input'], task['script_code'], task['status'],
+            task.get('submitted_at'), task.get('approved_at'), task.get('completed_at'),
+            task.get('output'), task.get('output_encoding', ''), task.get('error'), task.get('interpretation'),
+            task.get('submitted_by'), task.get('approved_by'), task.get('rejected_by')
+        ))
+    if rows:
+        execute_write(UPSERT_COMPLETED_TASK, rows, many=True)
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pipe = redis.pipeline()
+    # The hot window starts once the row holds the final result, interpretation included
+    schedule_task_expiry(pipe, [task for task in tasks if task.get('interpretation_status') != 'pending'])
+    pipe.xack(TASK_EVENTS_STREAM, TASK_SYNC_GROUP, *entry_ids)
+    pipe.xdel(TASK_EVENTS_STREAM, *entry_ids)
+    pipe.execute()
+    logging.info(f"Synced {len(rows)} completed task(s) to the database from {len(entries)} event(s)")
+
+def process_task_events():
+    redis = get_redis_connection()
+    ensure_sync_group(redis)
+    # '0' replays entries delivered but not acknowledged before a crash or failed write, '>' reads new ones
+    read_from = '0'
+    while True:
+        try:
+            reply = redis.xreadgroup(TASK_SYNC_GROUP, TASK_SYNC_CONSUMER, {TASK_EVENTS_STREAM: read_from},
+                                     count=TASK_SYNC_BATCH_SIZE, block=TASK_SYNC_BLOCK_MS)
+            entries = reply[0][1] if reply else []
+            if not entries:
+                read_from = '>'
+                continue
+            sync_task_events(redis, entries)
+        except Exception as e:
+            logging.error(f"Task sync error: {e}")
+            read_from = '0'
+            time.sleep(5)
@@ -0,0 +1,386 @@
+import json
+import time
+from utils.task_store import PENDING_QUEUE, PENDING_JOBS, COMPLETED_INDEX, FAILED_INDEX, TASK_LEASES, TASK_LEASE_TIMEOUT, TASK_PRIORITIES, SCHEDULED_TASKS, status_index_key, pending_index_key, job_key, job_tasks_key, task_queue_key, add_pending, index_task, write_task, to_score
+from utils.interpretation_worker import INTERPRETATION_QUEUE
+from utils.task_notify import TASK_READY_CHANNEL
+from utils.task_sync import TASK_EVENTS_STREAM
+from utils.task_output import encode_result, decode_output
+from utils.redis_connection import load_script
+from utils.task_stats import GLOBAL_STATS_KEY, HOURLY_RETENTION_DAYS, DAILY_RETENTION_DAYS, agent_stats_key, user_stats_key, bucket_stats_key, parse_moment
+
+SLACK_NOTIFICATIONS_KEY = 'slack_notifications'
+
+# Each lifecycle transition runs as one Lua script, so the status check and every write it
+# guards (task record, queues, indexes, counters, notification) happen atomically in a single
+# round trip. The scripts are loaded once per process and run by SHA.
+#
+# Not every key a script touches is declared in KEYS: per-agent and per-user keys, and the
+# records of tasks popped from queues or listed under a job, only become known inside the
+# script and are built there from the prefixes passed in ARGV. Redis only allows this on a
+# single node, so the task store needs a standalone Redis (or a replicated primary); Redis
+# Cluster and key-routing proxies are not supported. The MULTI pipelines that create tasks
+# span several hash slots as well.
+
+# Set the fields of a JSON object on a task hash
+SET_FIELDS = """
+local function set_fields(key, encoded)
+    local fields = {}
+    for field, value in pairs(cjson.decode(encoded)) do
+        table.insert(fields, field)
+        table.insert(fields, value)
+    end
+    if #fields > 0 then
+        redis.call('HSET', key, unpack(fields))
+    end
+end
+"""
+
+# Queue key of an agent for a task priority, see task_queue_key
+QUEUE_KEY = """
+local function queue_key(prefix, agent_id, priority)
+    if priority == 'high' or priority == 'low' then
+        return prefix .. agent_id .. ':' .. priority
+    end
+    return prefix .. agent_id
+end
+"""
+
+# Push an approved task onto its agent's queue for its priority and wake the agent, or park it
+# in the scheduled ZSET when its run_at is still ahead of now
+ENQUEUE = QUEUE_KEY + """
+local function enqueue(task_key, task_id, agent_id, queue_prefix, scheduled_key, now, channel)
+    local task = redis.call('HMGET', task_key, 'priority', 'run_at_score')
+    local run_at = tonumber(task[2])
+    if run_at and run_at > tonumber(now) then
+        redis.call('ZADD', scheduled_key, run_at, task_id)
+        return
+    end
+    redis.call('LPUSH', queue_key(queue_prefix, agent_id, task[1]), task_id)
+    redis.call('PUBLISH', channel, agent_id)
+end
+"""
+
+# Shared head of the status-changing scripts. Only the fields that change are written.
+# KEYS[1] task key, KEYS[2] old status index, KEYS[3] new status index
+# ARGV[1] task_id, ARGV[2] required current status, ARGV[3] JSON of fields to set on the task
+TRANSITION_HEAD = SET_FIELDS + """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status then
+    return {'not_found'}
+end
+if status ~= ARGV[2] then
+    return {'conflict', redis.call('HGETALL', KEYS[1])}
+end
+local agent_id = redis.call('HGET', KEYS[1], 'agent_id')
+set_fields(KEYS[1], ARGV[3])
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[1])
+"""
+
+# KEYS[4] global pending list, KEYS[5] Slack notification list, KEYS[6] scheduled tasks ZSET
+# ARGV[4] pending index prefix, ARGV[5] notification, ARGV[6] task queue prefix,
+# ARGV[7] task ready channel, ARGV[8] now
+APPROVE_SCRIPT = load_script(ENQUEUE + TRANSITION_HEAD + """
+redis.call('LREM', KEYS[4], 0, ARGV[1])
+redis.call('LREM', ARGV[4] .. agent_id, 0, ARGV[1])
+redis.call('RPUSH', KEYS[5], ARGV[5])
+enqueue(KEYS[1], ARGV[1], agent_id, ARGV[6], KEYS[6], ARGV[8], ARGV[7])
+return {'ok'}
+""")
+
+REJECT_SCRIPT = load_script(TRANSITION_HEAD + """
+redis.call('LREM', KEYS[4], 0, ARGV[1])
+redis.call('LREM', ARGV[4] .. agent_id, 0, ARGV[1])
+redis.call('RPUSH', KEYS[5], ARGV[5])
+return {'ok'}
+""")
+
+# KEYS[4] result hash, KEYS[5] completed index, KEYS[6] failed index,
+# KEYS[7] global stats, KEYS[8] hourly stats, KEYS[9] daily stats, KEYS[10] interpretation queue,
+# KEYS[11] task events stream, KEYS[12] lease ZSET
+# ARGV[4] JSON of result fields, ARGV[5] completed score, ARGV[6] '1' if the task failed,
+# ARGV[7] agent tasks prefix, ARGV[8] agent stats prefix, ARGV[9] user stats prefix,
+# ARGV[10] hourly stats TTL, ARGV[11] daily stats TTL
+COMPLETE_SCRIPT = load_script(TRANSITION_HEAD + """
+set_fields(KEYS[4], ARGV[4])
+redis.call('LPUSH', ARGV[7] .. agent_id, ARGV[1])
+redis.call('ZADD', KEYS[5], ARGV[5], ARGV[1])
+
+local outcome = 'success'
+if ARGV[6] == '1' then
+    outcome = 'failure'
+    redis.call('SADD', KEYS[6], ARGV[1])
+else
+    redis.call('SREM', KEYS[6], ARGV[1])
+end
+local stats_keys = {KEYS[7], KEYS[8], KEYS[9], ARGV[8] .. agent_id}
+local submitted_by = redis.call('HGET', KEYS[1], 'submitted_by')
+if submitted_by and submitted_by ~= '' then
+    table.insert(stats_keys, ARGV[9] .. submitted_by)
+end
+for _, key in ipairs(stats_keys) do
+    redis.call('HINCRBY', key, 'total', 1)
+    redis.call('HINCRBY', key, outcome, 1)
+end
+redis.call('EXPIRE', KEYS[8], ARGV[10])
+redis.call('EXPIRE', KEYS[9], ARGV[11])
+redis.call('LPUSH', KEYS[10], ARGV[1])
+redis.call('XADD', KEYS[11], '*', 'task_id', ARGV[1], 'event', 'completed')
+redis.call('ZREM', KEYS[12], ARGV[1])
+return {'ok'}
+""")
+
+# Approve or reject a fleet job and every child task still pending, in one step. On approval
+# the children are pushed onto their agents' queues and the agents are woken up.
+# KEYS[1] job key, KEYS[2] job tasks list, KEYS[3] pending jobs list, KEYS[4] pending status
+# index, KEYS[5] new status index, KEYS[6] Slack notification list, KEYS[7] scheduled tasks ZSET
+# ARGV[1] job_id, ARGV[2] JSON of fields to set on the job and its children, ARGV[3] notification,
+# ARGV[4] task key prefix, ARGV[5] task queue prefix ('' to not enqueue), ARGV[6] task ready channel,
+# ARGV[7] now
+DECIDE_JOB_SCRIPT = load_script(SET_FIELDS + ENQUEUE + """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return {'not_found'}
+end
+local job = cjson.decode(raw)
+if job['status'] ~= 'pending' then
+    return {'conflict', raw}
+end
+local updates = cjson.decode(ARGV[2])
+for field, value in pairs(updates) do
+    job[field] = value
+end
+local data = cjson.encode(job)
+redis.call('SET', KEYS[1], data)
+redis.call('LREM', KEYS[3], 0, ARGV[1])
+
+local count = 0
+for _, task_id in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    local task_key = ARGV[4] .. task_id
+    if redis.call('HGET', task_key, 'status') == 'pending' then
+        local agent_id = redis.call('HGET', task_key, 'agent_id')
+        set_fields(task_key, ARGV[2])
+        redis.call('SREM', KEYS[4], task_id)
+        redis.call('SADD', KEYS[5], task_id)
+        if ARGV[5] ~= '' then
+            enqueue(task_key, task_id, agent_id, ARGV[5], KEYS[7], ARGV[7], ARGV[6])
+        end
+        count = count + 1
+    end
+end
+redis.call('RPUSH', KEYS[6], ARGV[3])
+return {'ok', data, count}
+""")
+
+# Pop up to ARGV[5] of the agent's approved, not yet dispatched tasks, higher priority queues
+# first, skipping queue entries whose task was removed or already handed out. Each one is leased
+# until ARGV[4] and returned with its result hash.
+# KEYS[1..3] high, normal and low priority task queues, KEYS[4] lease ZSET
+# ARGV[1] task key prefix, ARGV[2] result key prefix, ARGV[3] dispatched_at, ARGV[4] lease deadline,
+# ARGV[5] maximum number of tasks
+LEASE_SCRIPT = load_script("""
+local leased = {}
+for queue = 1, 3 do
+    while #leased < tonumber(ARGV[5]) do
+        local task_id = redis.call('RPOP', KEYS[queue])
+        if not task_id then
+            break
+        end
+        local task_key = ARGV[1] .. task_id
+        local task = redis.call('HMGET', task_key, 'status', 'dispatched_at')
+        if task[1] == 'approved' and not task[2] then
+            redis.call('HSET', task_key, 'dispatched_at', ARGV[3])
+            redis.call('ZADD', KEYS[4], ARGV[4], task_id)
+            table.insert(leased, {redis.call('HGETALL', task_key), redis.call('HGETALL', ARGV[2] .. task_id)})
+        end
+    end
+end
+return leased
+""")
+
+# Put tasks whose lease ran out back on the end of their queue that is popped next, so they are
+# handed out again before newer work. Leases of tasks that are no longer awaiting a result are
+# dropped. Tasks that already used their last lease are returned untouched for the caller to fail.
+# KEYS[1] lease ZSET
+# ARGV[1] now, ARGV[2] batch size, ARGV[3] task key prefix, ARGV[4] task queue prefix,
+# ARGV[5] task ready channel, ARGV[6] maximum lease attempts
+REQUEUE_SCRIPT = load_script(QUEUE_KEY + """
+local requeued = 0
+local exhausted = {}
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+-- Newest lease first, so the oldest ends up at the end of the queue that is popped next
+for i = #expired, 1, -1 do
+    local task_id = expired[i]
+    local task_key = ARGV[3] .. task_id
+    local task = redis.call('HMGET', task_key, 'status', 'agent_id', 'lease_expirations', 'priority')
+    if task[1] ~= 'approved' then
+        redis.call('ZREM', KEYS[1], task_id)
+    elseif (tonumber(task[3]) or 0) + 1 >= tonumber(ARGV[6]) then
+        table.insert(exhausted, task_id)
+    else
+        redis.call('HINCRBY', task_key, 'lease_expirations', 1)
+        redis.call('HDEL', task_key, 'dispatched_at')
+        redis.call('RPUSH', queue_key(ARGV[4], task[2], task[4]), task_id)
+        redis.call('PUBLISH', ARGV[5], task[2])
+        redis.call('ZREM', KEYS[1], task_id)
+        requeued = requeued + 1
+    end
+end
+return {requeued, exhausted}
+""")
+
+# Move approved tasks whose run_at has come from the scheduled ZSET onto their agents' queues,
+# dropping entries of tasks that were removed. Returns the number of entries handled.
+# KEYS[1] scheduled tasks ZSET
+# ARGV[1] now, ARGV[2] batch size, ARGV[3] task key prefix, ARGV[4] task queue prefix,
+# ARGV[5] task ready channel
+PROMOTE_SCRIPT = load_script(QUEUE_KEY + """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, task_id in ipairs(due) do
+    local task = redis.call('HMGET', ARGV[3] .. task_id, 'status', 'agent_id', 'priority')
+    if task[1] == 'approved' then
+        redis.call('LPUSH', queue_key(ARGV[4], task[2], task[3]), task_id)
+        redis.call('PUBLISH', ARGV[5], task[2])
+    end
+    redis.call('ZREM', KEYS[1], task_id)
+end
+return #due
+""")
+
+
+def run_script(redis, script, keys, args):
+    return script(keys=keys, args=args, client=redis)
+
+
+def pairs_to_dict(values):
+    return {values[i].decode(): values[i + 1].decode() for i in range(0, len(values), 2)}
+
+
+# Results are (outcome, task) where outcome is 'ok', 'not_found' or 'conflict'; on conflict
+# task is the stored record so callers can report its current status.
+def to_outcome(reply):
+    outcome = reply[0].decode()
+    task = pairs_to_dict(reply[1]) if len(reply) > 1 else None
+    return outcome, task
+
+
+# Queue a new pending task together with its indexes and notification on a MULTI pipeline
+def create_pending_task(pipe, task, notification):
+    write_task(pipe, task)
+    add_pending(pipe, task)
+    index_task(pipe, task)
+    pipe.rpush(SLACK_NOTIFICATIONS_KEY, json.dumps(notification))
+
+
+def approve_pending_task(redis, task_id, updates, notification):
+    reply = run_script(
+        redis, APPROVE_SCRIPT,
+        keys=[f'task:{task_id}', status_index_key('pending'), status_index_key('approved'), PENDING_QUEUE, SLACK_NOTIFICATIONS_KEY, SCHEDULED_TASKS],
+        args=[task_id, 'pending', json.dumps(dict(updates, status='approved')), pending_index_key(''), json.dumps(notification), 'task_queue:', TASK_READY_CHANNEL, time.time()]
+    )
+    return to_outcome(reply)
+
+
+def reject_pending_task(redis, task_id, updates, notification):
+    reply = run_script(
+        redis, REJECT_SCRIPT,
+        keys=[f'task:{task_id}', status_index_key('pending'), status_index_key('rejected'), PENDING_QUEUE, SLACK_NOTIFICATIONS_KEY],
+        args=[task_id, 'pending', json.dumps(dict(updates, status='rejected')), pending_index_key(''), json.dumps(notification)]
+    )
+    return to_outcome(reply)
+
+
+# Create a pending fleet job and all of its child tasks on one MULTI pipeline. Children are
+# reviewed through the job, so they don't go on the per-task review lists.
+def create_pending_job(pipe, job, tasks, notification):
+    pipe.set(job_key(job['job_id']), json.dumps(job))
+    for task in tasks:
+        write_task(pipe, task)
+        index_task(pipe, task)
+    pipe.rpush(job_tasks_key(job['job_id']), *[task['task_id'] for task in tasks])
+    pipe.lpush(PENDING_JOBS, job['job_id'])
+    pipe.rpush(SLACK_NOTIFICATIONS_KEY, json.dumps(notification))
+
+
+# Returns (outcome, job, number of child tasks moved)
+def decide_job(redis, job_id, status, updates, notification):
+    reply = run_script(
+        redis, DECIDE_JOB_SCRIPT,
+        keys=[job_key(job_id), job_tasks_key(job_id), PENDING_JOBS, status_index_key('pending'), status_index_key(status), SLACK_NOTIFICATIONS_KEY, SCHEDULED_TASKS],
+        args=[job_id, json.dumps(dict(updates, status=status)), json.dumps(notification), 'task:', 'task_queue:' if status == 'approved' else '', TASK_READY_CHANNEL, time.time()]
+    )
+    outcome = reply[0].decode()
+    job = json.loads(reply[1]) if len(reply) > 1 else None
+    return outcome, job, reply[2] if len(reply) > 2 else 0
+
+
+# Lease up to max_tasks of the agent's queued tasks for lease_seconds. Returns a list of
+# (task, result) pairs, oldest first.
+def lease_tasks(redis, agent_id, dispatched_at, max_tasks=1, lease_seconds=TASK_LEASE_TIMEOUT):
+    reply = run_script(
+        redis, LEASE_SCRIPT,
+        keys=[task_queue_key(agent_id, priority) for priority in TASK_PRIORITIES] + [TASK_LEASES],
+        args=['task:', 'result:', dispatched_at, time.time() + lease_seconds, max_tasks]
+    )
+    return [(pairs_to_dict(task_data), pairs_to_dict(result)) for task_data, result in reply]
+
+
+def dequeue_task(redis, agent_id, dispatched_at):
+    leased = lease_tasks(redis, agent_id, dispatched_at)
+    if not leased:
+        return None, {}
+    return leased[0]
+
+
+# Returns (number of tasks re-queued, task_ids out of lease attempts)
+def requeue_expired_leases(redis, batch_size, max_attempts):
+    requeued, exhausted = run_script(
+        redis, REQUEUE_SCRIPT,
+        keys=[TASK_LEASES],
+        args=[time.time(), batch_size, 'task:', 'task_queue:', TASK_READY_CHANNEL, max_attempts]
+    )
+    return requeued, [task_id.decode() for task_id in exhausted]
+
+
+def promote_scheduled_tasks(redis, batch_size):
+    return run_script(
+        redis, PROMOTE_SCRIPT,
+        keys=[SCHEDULED_TASKS],
+        args=[time.time(), batch_size, 'task:', 'task_queue:', TASK_READY_CHANNEL]
+    )
+
+
+# Fields an agent receives for a dispatched task, over HTTP or the agent channel
+def dispatched_task_payload(task_data, result):
+    return {
+        "task_id": task_data["task_id"],
+        "input": task_data["input"],
+        "script_code": task_data["script_code"],
+        "timestamp": task_data.get("timestamp", "N/A"),
+        "output": decode_output(result.get('output', ''), result.get('output_encoding', '')),
+        "error": result.get('error', ''),
+        "interpretation": result.get('interpretation', '')
+    }
+
+
+# Store the result, its output compressed past the size threshold, and queue it for
+# interpretation by the scheduler's workers
+def complete_task(redis, task_id, completed_at, result):
+    moment = parse_moment(completed_at)
+    result = encode_result(dict(result, interpretation='', interpretation_status='pending'))
+    reply = run_script(
+        redis, COMPLETE_SCRIPT,
+        keys=[
+            f'task:{task_id}', status_index_key('approved'), status_index_key('completed'),
+            f'result:{task_id}', COMPLETED_INDEX, FAILED_INDEX,
+            GLOBAL_STATS_KEY, bucket_stats_key('hour', moment), bucket_stats_key('day', moment),
+            INTERPRETATION_QUEUE, TASK_EVENTS_STREAM, TASK_LEASES
+        ],
+        args=[
+            task_id, 'approved', json.dumps({'status': 'completed', 'completed_at': completed_at}),
+            json.dumps(result), to_score(completed_at), '1' if result.get('error') else '0',
+            'agent_tasks:', agent_stats_key(''), user_stats_key(''),
+            HOURLY_RETENTION_DAYS * 86400, DAILY_RETENTION_DAYS * 86400
+        ]
+    )
+    return to_outcome(reply)